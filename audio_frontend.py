@@ -0,0 +1,182 @@
+"""Загрузка аудио: одно декодирование, прямой ресемплинг, кэш PCM.
+
+Раньше файл декодировался ``librosa.load`` сразу в 22050 Гц, а CREPE затем
+еще раз ресемплировал сигнал в 16 кГц. Здесь файл декодируется один раз,
+блоками, в моно-PCM на исходной частоте. Каждая нужная этапам частота
+получается прямо из исходной потоковым ресемплером soxr с настраиваемым
+качеством. Декодированный PCM сохраняется в дисковый кэш (``PitchCache``)
+и открывается через memory map, поэтому повторный запуск на том же
+MP3/M4A не декодирует файл вовсе.
+"""
+import hashlib
+import os
+import tempfile
+
+import librosa
+import numpy as np
+
+from pitch_cache import PitchCache
+
+
+# Значения res_type librosa, для которых есть потоковый ресемплер soxr
+RESAMPLE_QUALITIES = {
+    "soxr_vhq": "VHQ",
+    "soxr_hq": "HQ",
+    "soxr_mq": "MQ",
+    "soxr_lq": "LQ",
+    "soxr_qq": "QQ",
+}
+
+BLOCK_FRAMES = 65536
+
+
+def file_digest(path):
+    """Хэш содержимого файла (читается блоками, без декодирования)"""
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def decode_blocks(path, block_frames=BLOCK_FRAMES):
+    """Генератор (sr, моно-блок float32) по мере декодирования файла.
+
+    Форматы libsndfile (WAV, FLAC, OGG, MP3) читаются через soundfile,
+    остальные (M4A и т.п.) - через audioread, как это делает librosa.load.
+    """
+    import audioread
+    import soundfile as sf
+
+    try:
+        with sf.SoundFile(path) as f:
+            sr = f.samplerate
+            if f.format in ("MP3", "MPEG"):
+                # libsndfile 1.2 дает разрывы на стыках при чтении MP3 по частям
+                block_frames = max(f.frames, 1)
+            for block in f.blocks(blocksize=block_frames, dtype="float32", always_2d=True):
+                yield sr, block.mean(axis=1, dtype=np.float32)
+        return
+    except sf.LibsndfileError:
+        pass
+
+    with audioread.audio_open(os.path.realpath(path)) as f:
+        sr, channels = f.samplerate, f.channels
+        for buf in f:
+            block = librosa.util.buf_to_float(buf, dtype=np.float32)
+            if channels > 1:
+                block = block.reshape((-1, channels)).mean(axis=1, dtype=np.float32)
+            yield sr, block
+
+
+def resample_stream(samples, orig_sr, target_sr, quality="soxr_hq", block_frames=BLOCK_FRAMES):
+    """Ресемплинг сигнала блоками, длина как у librosa.resample"""
+    samples = np.asarray(samples)
+    if orig_sr == target_sr:
+        return np.asarray(samples, dtype=np.float32)
+
+    n_out = int(np.ceil(len(samples) * target_sr / orig_sr))
+    if quality not in RESAMPLE_QUALITIES:
+        # Ресемплеры без потокового режима (kaiser_best и т.п.) - целиком
+        out = librosa.resample(np.asarray(samples, dtype=np.float32), orig_sr=orig_sr, target_sr=target_sr,
+                               res_type=quality)
+        return librosa.util.fix_length(out, size=n_out)
+
+    import soxr
+    stream = soxr.ResampleStream(orig_sr, target_sr, 1, dtype="float32", quality=RESAMPLE_QUALITIES[quality])
+    out = np.zeros(n_out, dtype=np.float32)
+    pos = 0
+    for start in range(0, max(len(samples), 1), block_frames):
+        block = np.ascontiguousarray(samples[start:start + block_frames], dtype=np.float32)
+        last = start + block_frames >= len(samples)
+        chunk = stream.resample_chunk(block, last=last)
+        count = min(len(chunk), n_out - pos)
+        out[pos:pos + count] = chunk[:count]
+        pos += count
+    return out
+
+
+class AudioSource:
+    """Декодированный моно-сигнал на исходной частоте и его копии на других частотах"""
+
+    def __init__(self, samples, sr, quality="soxr_hq"):
+        self.samples = samples
+        self.sr = int(sr)
+        self.quality = quality
+        self._rates = {}
+        self._digests = {}
+
+    @property
+    def duration(self):
+        return len(self.samples) / self.sr
+
+    @property
+    def nbytes(self):
+        """Память под сигнал и его копии на других частотах"""
+        return self.samples.nbytes + sum(samples.nbytes for samples in self._rates.values())
+
+    def at_rate(self, target_sr):
+        """Сигнал на частоте target_sr, ресемплированный прямо из исходного"""
+        target_sr = int(target_sr)
+        if target_sr not in self._rates:
+            self._rates[target_sr] = resample_stream(self.samples, self.sr, target_sr, self.quality)
+        return self._rates[target_sr]
+
+    def digest(self, target_sr):
+        """PitchCache.audio_digest сигнала на частоте target_sr (считается один раз)"""
+        target_sr = int(target_sr)
+        if target_sr not in self._digests:
+            self._digests[target_sr] = PitchCache.audio_digest(self.at_rate(target_sr), target_sr)
+        return self._digests[target_sr]
+
+
+def _decode_to_memory(path):
+    sr = None
+    blocks = []
+    for sr, block in decode_blocks(path):
+        blocks.append(block)
+    if sr is None:
+        raise ValueError(f"Не удалось прочитать аудио: {path}")
+    return np.concatenate(blocks) if blocks else np.zeros(0, dtype=np.float32), sr
+
+
+def _decode_to_cache(path, cache, key):
+    """Декодирует файл в запись кэша, не держа весь сигнал в памяти"""
+    sr = None
+    n_samples = 0
+    # Длина заранее неизвестна (audioread) - сначала пишем сырые отсчеты
+    with tempfile.TemporaryFile(dir=cache.root) as raw:
+        for sr, block in decode_blocks(path):
+            raw.write(block.tobytes())
+            n_samples += len(block)
+        if sr is None:
+            raise ValueError(f"Не удалось прочитать аудио: {path}")
+
+        pending = cache.open_entry(key, "samples", (n_samples,), dtype=np.float32)
+        try:
+            raw.seek(0)
+            for start in range(0, n_samples, BLOCK_FRAMES):
+                count = min(BLOCK_FRAMES, n_samples - start)
+                pending.array[start:start + count] = np.frombuffer(raw.read(count * 4), dtype=np.float32)
+        except BaseException:
+            pending.discard()
+            raise
+    pending.commit({"sr": np.array(sr)})
+
+
+def open_audio(path, cache=None, quality="soxr_hq"):
+    """AudioSource для файла. С кэшем PCM берется из memory map без декодирования."""
+    if cache is None:
+        samples, sr = _decode_to_memory(path)
+        return AudioSource(samples, sr, quality)
+
+    key = PitchCache.make_key(file_digest(path), "pcm", {"mono": True, "dtype": "float32"})
+    arrays = cache.get(key)
+    if arrays is None:
+        _decode_to_cache(path, cache, key)
+        arrays = cache.get(key)
+        if arrays is None:
+            # Запись сразу вытеснена (кэш меньше файла) - работаем из памяти
+            samples, sr = _decode_to_memory(path)
+            return AudioSource(samples, sr, quality)
+    return AudioSource(arrays["samples"], int(arrays["sr"]), quality)
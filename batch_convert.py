@@ -0,0 +1,330 @@
+"""Пакетная конвертация аудио в MIDI из командной строки.
+
+Пример:
+    python batch_convert.py stems/ -o midi/ -j 8 --method pyin
+    python batch_convert.py concert.wav --split -j 8
+    python batch_convert.py take.wav --trace stages.jsonl --chrome-trace trace.json --profile prof/
+    python batch_convert.py phrases/ --batch-files 32
+"""
+import argparse
+import multiprocessing
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from pathlib import Path
+
+from audio_frontend import RESAMPLE_QUALITIES
+from crepe_backend import MODEL_CAPACITIES, SPEED_PRESETS, CrepeBatcher, CrepeSession
+from engine import ConversionParams, VocalToMIDIEngine, PITCH_METHODS
+from instrumentation import profiled, write_chrome_trace, write_jsonl
+
+
+AUDIO_EXTENSIONS = {".mp3", ".wav", ".ogg", ".m4a", ".flac"}
+RESAMPLE_TYPES = sorted(RESAMPLE_QUALITIES) + ["kaiser_best", "kaiser_fast", "polyphase"]
+
+
+def collect_inputs(paths, recursive=False):
+    """Разворачивает список файлов и папок в пары (аудиофайл, путь относительно папки ввода)"""
+    files = []
+    for path in map(Path, paths):
+        if path.is_dir():
+            pattern = "**/*" if recursive else "*"
+            files.extend((p, p.relative_to(path)) for p in sorted(path.glob(pattern))
+                         if p.is_file() and p.suffix.lower() in AUDIO_EXTENSIONS)
+        elif path.is_file():
+            files.append((path, Path(path.name)))
+        else:
+            print(f"Пропускаю: файл не найден {path}", file=sys.stderr)
+    return files
+
+
+def output_path_for(input_path, relative, output_dir, suffix=".mid"):
+    """Куда писать результат: рядом с файлом или в output_dir.
+
+    В output_dir повторяются вложенные папки ввода (relative - путь файла
+    относительно его папки), поэтому одинаковые имена из разных подпапок
+    с -r не затирают друг друга.
+    """
+    if output_dir is None:
+        return input_path.with_suffix(suffix)
+    return Path(output_dir) / relative.with_suffix(suffix)
+
+
+def warm_worker(params_dict):
+    """Инициализатор рабочего процесса: модель загружается до первого файла"""
+    try:
+        VocalToMIDIEngine(ConversionParams.from_dict(params_dict)).warm_up()
+    except Exception as e:
+        print(f"Не удалось прогреть CREPE: {e}", file=sys.stderr)
+
+
+def convert_file(input_path, output_path, params_dict, profile_path=None):
+    """Задача для рабочего процесса: конвертирует один файл.
+
+    profile_path - файл статистики cProfile этой конвертации (pstats, snakeviz).
+    """
+    engine = VocalToMIDIEngine(ConversionParams.from_dict(params_dict))
+    if profile_path is None:
+        return engine.convert(str(input_path), str(output_path))
+    with profiled(str(profile_path)):
+        return engine.convert(str(input_path), str(output_path))
+
+
+def convert_group(jobs, params_dict):
+    """Задача для рабочего процесса: группа коротких файлов с общими батчами CREPE.
+
+    Каждый файл конвертируется в своем потоке обычным путем, но кадры CREPE
+    всех потоков идут в модель общими большими батчами. Возвращает список
+    (результат, текст ошибки) в порядке jobs.
+    """
+    params = ConversionParams.from_dict(params_dict)
+    batcher = CrepeBatcher(CrepeSession.get(params.crepe_model_capacity), len(jobs),
+                           batch_size=params.crepe_batch_size)
+
+    def convert_one(job):
+        input_path, output_path = job
+        engine = VocalToMIDIEngine(params)
+        engine.crepe_batcher = batcher
+        try:
+            return engine.convert(str(input_path), str(output_path)), None
+        except Exception as e:
+            return None, str(e)
+        finally:
+            batcher.leave()
+
+    with ThreadPoolExecutor(max_workers=len(jobs)) as pool:
+        return list(pool.map(convert_one, jobs))
+
+
+def add_params_arguments(parser):
+    """Аргументы командной строки, соответствующие ConversionParams"""
+    defaults = ConversionParams()
+    parser.add_argument("--method", choices=PITCH_METHODS, default=defaults.method,
+                        help="метод определения высоты тона")
+    parser.add_argument("--no-noise-reduction", dest="use_noise_reduction", action="store_false",
+                        help="отключить подавление шума")
+    parser.add_argument("--noise-profile", default=defaults.noise_profile,
+                        help="файл профиля шума: создается по первой секунде первого файла "
+                             "и применяется ко всем следующим")
+    parser.add_argument("--no-hpss", dest="use_harmonic_percussive", action="store_false",
+                        help="отключить разделение гармоник/перкуссии")
+    parser.add_argument("--min-note-duration", type=float, default=defaults.min_note_duration,
+                        help="минимальная длительность ноты, сек")
+    parser.add_argument("--sensitivity", type=float, default=defaults.sensitivity,
+                        help="чувствительность 0.1-1.0")
+    parser.add_argument("--volume-threshold", type=float, default=defaults.volume_threshold,
+                        help="порог громкости (RMS)")
+    parser.add_argument("--min-note", default=defaults.min_note, help="минимальная нота, например C3")
+    parser.add_argument("--max-note", default=defaults.max_note, help="максимальная нота, например C6")
+    parser.add_argument("--program", dest="instrument_program", type=int,
+                        default=defaults.instrument_program, help="номер программы MIDI-инструмента")
+    parser.add_argument("--resample-quality", choices=RESAMPLE_TYPES, default=defaults.resample_quality,
+                        help="качество ресемплинга исходного сигнала")
+    parser.add_argument("--preset", choices=sorted(SPEED_PRESETS),
+                        help="пресет скорость/точность CREPE (переопределяет размер модели и шаг)")
+    parser.add_argument("--crepe-capacity", dest="crepe_model_capacity", choices=MODEL_CAPACITIES,
+                        default=defaults.crepe_model_capacity, help="размер модели CREPE")
+    parser.add_argument("--crepe-step", dest="crepe_step_size", type=int, default=defaults.crepe_step_size,
+                        help="шаг кадров CREPE, мс")
+    parser.add_argument("--crepe-refine", action="store_true",
+                        help="двухпроходный CREPE: основная модель только в окнах у переходов нот, "
+                             "найденных грубым проходом")
+    parser.add_argument("--coarse-capacity", dest="crepe_coarse_capacity", choices=MODEL_CAPACITIES,
+                        default=defaults.crepe_coarse_capacity, help="модель грубого прохода при --crepe-refine")
+    parser.add_argument("--coarse-step", dest="crepe_coarse_step", type=int, default=defaults.crepe_coarse_step,
+                        help="шаг кадров грубого прохода, мс")
+    parser.add_argument("--refine-window", dest="crepe_refine_window_ms", type=float,
+                        default=defaults.crepe_refine_window_ms,
+                        help="полуширина окна точного прохода вокруг перехода, мс")
+    parser.add_argument("--crepe-batch-size", type=int, default=defaults.crepe_batch_size,
+                        help="размер батча при инференсе CREPE")
+    parser.add_argument("--crepe-chunk-seconds", type=float, default=defaults.crepe_chunk_seconds,
+                        help="длина окна потоковой обработки CREPE, сек (0 - без окон)")
+    parser.add_argument("--cache-dir", default=defaults.cache_dir,
+                        help="папка дискового кэша треков высоты тона")
+    parser.add_argument("--cache-max-mb", type=float, default=defaults.cache_max_mb,
+                        help="предельный размер кэша, МБ")
+    parser.add_argument("--viterbi-width", dest="viterbi_transition_bins", type=int,
+                        default=defaults.viterbi_transition_bins,
+                        help="наибольший скачок высоты между кадрами CREPE в сглаживании Витерби, "
+                             "бинов по 20 центов")
+    parser.add_argument("--no-vad", dest="vad_gating", action="store_false",
+                        help="запускать детекторы на всем сигнале, включая тишину")
+    parser.add_argument("--no-parallel-detectors", dest="parallel_detectors", action="store_false",
+                        help="в комбинированном режиме считать CREPE и PYIN последовательно")
+
+
+def params_from_args(args):
+    params = ConversionParams.from_dict(vars(args))
+    if getattr(args, "preset", None):
+        params = params.with_preset(args.preset)
+    return params
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Пакетная конвертация вокала в MIDI")
+    parser.add_argument("inputs", nargs="+", help="аудиофайлы или папки")
+    parser.add_argument("-o", "--output-dir", help="папка для MIDI-файлов (по умолчанию рядом с исходными)")
+    parser.add_argument("-j", "--jobs", type=int, default=os.cpu_count() or 1,
+                        help="число рабочих процессов")
+    parser.add_argument("-r", "--recursive", action="store_true", help="искать файлы во вложенных папках")
+    parser.add_argument("--split", action="store_true",
+                        help="резать каждый файл по паузам и обрабатывать фрагменты параллельно "
+                             "(для длинных записей)")
+    parser.add_argument("--split-seconds", type=float, default=60.0,
+                        help="желаемая длина фрагмента при --split, сек")
+    parser.add_argument("--trace", help="дописать замеры этапов в файл JSON Lines")
+    parser.add_argument("--chrome-trace", help="сохранить замеры этапов для chrome://tracing / Perfetto")
+    parser.add_argument("--batch-files", type=int, default=1,
+                        help="сколько файлов каждый процесс ведет одновременно с общими батчами CREPE "
+                             "(для тысяч коротких фраз)")
+    parser.add_argument("--profile", metavar="DIR",
+                        help="сохранить профиль cProfile каждой конвертации в папку (<имя файла>.prof)")
+    add_params_arguments(parser)
+    return parser
+
+
+def limit_worker_threads(jobs):
+    """Каждый процесс занимает одно ядро - не даем BLAS/TF плодить потоки"""
+    if jobs > 1:
+        for var in ("OMP_NUM_THREADS", "OPENBLAS_NUM_THREADS", "MKL_NUM_THREADS"):
+            os.environ.setdefault(var, "1")
+
+
+def print_result(path, result):
+    print(f"OK      {path}  нот: {result.note_count}  "
+          f"аудио: {result.audio_duration:.1f}с  время: {result.elapsed:.1f}с  "
+          f"скорость: {result.realtime_factor:.1f}x")
+
+
+def write_traces(runs, trace_path=None, chrome_trace_path=None):
+    """Замеры этапов всех файлов: JSON Lines и/или Chrome Trace"""
+    if trace_path:
+        write_jsonl(trace_path, runs)
+    if chrome_trace_path:
+        write_chrome_trace(chrome_trace_path, runs)
+
+
+def print_summary(done, total, total_audio, elapsed, jobs):
+    speed = total_audio / elapsed if elapsed > 0 else 0.0
+    print(f"Готово: {done}/{total} файлов, {total_audio:.1f}с аудио за {elapsed:.1f}с "
+          f"({speed:.1f}x реального времени, {jobs} процессов)")
+
+
+def run_batch(files, output_dir, params, jobs, trace_path=None, chrome_trace_path=None, profile_dir=None,
+              batch_files=1):
+    """Конвертирует файлы на пуле процессов и печатает пропускную способность.
+
+    files - пары (файл, путь относительно папки ввода) из collect_inputs.
+    batch_files > 1 - файлы раздаются процессам группами, внутри группы
+    CREPE считается общими батчами (convert_group).
+    """
+    outputs = {path: output_path_for(path, relative, output_dir) for path, relative in files}
+    profiles = {path: None if profile_dir is None else output_path_for(path, relative, profile_dir, ".prof")
+                for path, relative in files}
+    for output_path in list(outputs.values()) + list(profiles.values()):
+        if output_path is not None:
+            output_path.parent.mkdir(parents=True, exist_ok=True)
+    limit_worker_threads(jobs)
+    paths = list(outputs)
+
+    params_dict = params.to_dict()
+    if jobs > 1:
+        # Ядра уже заняты рабочими процессами - отдельный процесс для PYIN
+        # в каждом из них только перегружал бы процессор
+        params_dict["parallel_detectors"] = False
+    runs = []
+    failures = 0
+    total_audio = 0.0
+    started = time.perf_counter()
+
+    # spawn: TensorFlow плохо переносит fork после инициализации
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=jobs, mp_context=context,
+                             initializer=warm_worker, initargs=(params_dict,)) as pool:
+        if batch_files > 1:
+            groups = [paths[start:start + batch_files] for start in range(0, len(paths), batch_files)]
+            futures = {
+                pool.submit(convert_group, [(path, outputs[path]) for path in group], params_dict): group
+                for group in groups
+            }
+        else:
+            futures = {
+                pool.submit(convert_file, path, outputs[path], params_dict, profiles[path]): [path]
+                for path in paths
+            }
+        for future in as_completed(futures):
+            group = futures[future]
+            try:
+                outcomes = future.result() if batch_files > 1 else [(future.result(), None)]
+            except Exception as e:
+                outcomes = [(None, str(e))] * len(group)
+
+            for path, (result, error) in zip(group, outcomes):
+                if result is None:
+                    failures += 1
+                    print(f"ОШИБКА  {path}: {error}", file=sys.stderr)
+                    continue
+
+                total_audio += result.audio_duration
+                runs.append((str(path), result.stages))
+                print_result(path, result)
+
+    write_traces(runs, trace_path, chrome_trace_path)
+    print_summary(len(paths) - failures, len(paths), total_audio, time.perf_counter() - started, jobs)
+    return failures
+
+
+def run_split(files, output_dir, params, jobs, segment_seconds, trace_path=None, chrome_trace_path=None):
+    """Файлы по очереди, но каждый режется по паузам на jobs процессов"""
+    from split_convert import convert_split
+
+    limit_worker_threads(jobs)
+
+    runs = []
+    failures = 0
+    total_audio = 0.0
+    started = time.perf_counter()
+    for path, relative in files:
+        output_path = output_path_for(path, relative, output_dir)
+        output_path.parent.mkdir(parents=True, exist_ok=True)
+        try:
+            result = convert_split(str(path), str(output_path), params, jobs, target_seconds=segment_seconds)
+        except Exception as e:
+            failures += 1
+            print(f"ОШИБКА  {path}: {e}", file=sys.stderr)
+            continue
+
+        total_audio += result.audio_duration
+        runs.append((str(path), result.stages))
+        print_result(path, result)
+
+    write_traces(runs, trace_path, chrome_trace_path)
+    print_summary(len(files) - failures, len(files), total_audio, time.perf_counter() - started, jobs)
+    return failures
+
+
+def main(argv=None):
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    if args.profile and (args.split or args.batch_files > 1):
+        # cProfile видит только свой поток и процесс: фрагменты и группы файлов он не покрывает
+        parser.error("--profile работает только с обычной пакетной конвертацией (без --split и --batch-files)")
+    files = collect_inputs(args.inputs, recursive=args.recursive)
+    if not files:
+        print("Нет аудиофайлов для обработки", file=sys.stderr)
+        return 1
+
+    if args.split:
+        failures = run_split(files, args.output_dir, params_from_args(args), max(1, args.jobs), args.split_seconds,
+                             trace_path=args.trace, chrome_trace_path=args.chrome_trace)
+    else:
+        failures = run_batch(files, args.output_dir, params_from_args(args), max(1, args.jobs),
+                             trace_path=args.trace, chrome_trace_path=args.chrome_trace, profile_dir=args.profile,
+                             batch_files=max(1, args.batch_files))
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,454 @@
+"""Бенчмарк скорости и точности на синтетических мелодиях с известными нотами.
+
+Для каждого сценария генерируется "вокальная" мелодия: гармонический
+сигнал с формантами, вибрато, глиссандо между нотами, дыханием, фоновым
+шумом и паузами. Каждое сочетание метода и предобработки прогоняется в
+отдельном процессе (чтобы пик памяти относился только к нему) тем же путем,
+что и конвертация: ``VocalToMIDIEngine.transcribe`` с VAD, общим STFT,
+параллельным PYIN в комбинированном режиме и дисковым кэшем треков, затем
+запись MIDI. Прогонов два: с пустым кэшем (холодный) и повторный по
+заполненному кэшу (теплый), их время отчитывается отдельно.
+
+В отчет попадают скорость относительно реального времени, время каждого
+этапа, пиковый RSS (вместе с рабочим процессом PYIN) и точность нот:
+precision/recall/F1 (нота найдена, если высота совпала, а начало
+отличается не больше чем на ONSET_TOLERANCE) и средняя ошибка начала. Результат - JSON, который можно сравнить с прогоном
+на другом коммите:
+
+    python benchmark.py -o before.json
+    python benchmark.py -o after.json --compare before.json
+
+``--startup`` вместо прогонов измеряет время импорта точек входа (GUI и
+пакетного режима) в свежем интерпретаторе и проверяет, что при этом не
+загружаются тяжелые библиотеки (TensorFlow, scipy.signal и т.п.) - они
+должны импортироваться только этапами, которые их используют.
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import numpy as np
+
+from crepe_backend import SPEED_PRESETS
+
+
+SAMPLE_RATE = 22050
+ONSET_TOLERANCE = 0.05
+
+SCENARIOS = {
+    # Чистая мелодия без вибрато - проверка базовой точности
+    "clean": {"duration": 10.0, "snr_db": None, "vibrato_cents": 0.0, "glide_prob": 0.0, "gap_prob": 0.3, "seed": 1},
+    "vibrato": {"duration": 20.0, "snr_db": 30.0, "vibrato_cents": 35.0, "glide_prob": 0.3, "gap_prob": 0.3,
+                "seed": 2},
+    "noisy": {"duration": 20.0, "snr_db": 12.0, "vibrato_cents": 25.0, "glide_prob": 0.3, "gap_prob": 0.3, "seed": 3},
+    "legato": {"duration": 20.0, "snr_db": 25.0, "vibrato_cents": 25.0, "glide_prob": 0.8, "gap_prob": 0.05,
+               "seed": 4},
+    # Длинная запись с большими паузами (как дубль с тишиной между фразами)
+    "long_sparse": {"duration": 120.0, "snr_db": 25.0, "vibrato_cents": 25.0, "glide_prob": 0.3, "gap_prob": 0.6,
+                    "seed": 5},
+}
+
+METHODS = ("crepe", "pyin", "combined", "yin")
+PREPROCESSING = {
+    "none": (False, False),
+    "nr": (True, False),
+    "hpss": (False, True),
+    "nr+hpss": (True, True),
+}
+
+# Точки входа, время запуска которых измеряет --startup
+STARTUP_MODULES = ("mptomidi", "batch_convert")
+# Библиотеки, которых не должно быть в памяти сразу после импорта точки входа
+HEAVY_MODULES = ("crepe", "tensorflow", "scipy.signal", "scipy.ndimage", "pretty_midi")
+STARTUP_RUNS = 5
+
+# Форманты гласной "а": (частота, ширина) в Гц
+FORMANTS = ((700.0, 130.0), (1220.0, 70.0), (2600.0, 160.0))
+
+
+def synth_melody(duration, snr_db=None, vibrato_cents=25.0, glide_prob=0.3, gap_prob=0.3, seed=0,
+                 sr=SAMPLE_RATE, low=50, high=76):
+    """Синтетический вокал и список эталонных нот (pitch, start, end)"""
+    rng = np.random.default_rng(seed)
+    n = int(duration * sr)
+    f0 = np.zeros(n)
+    envelope = np.zeros(n)
+    notes = []
+
+    pos = int(rng.uniform(0.5, 1.0) * sr)
+    pitch = int(rng.integers(low + 6, high - 6))
+    while True:
+        length = int(rng.uniform(0.2, 0.9) * sr)
+        if pos + length >= n - sr // 2:
+            break
+        pitch = int(np.clip(pitch + rng.choice([-5, -3, -2, -1, 1, 2, 3, 4, 7]), low, high))
+        notes.append((pitch, pos / sr, (pos + length) / sr))
+
+        t = np.arange(length) / sr
+        # Вибрато развивается после атаки
+        depth = vibrato_cents * np.clip((t - 0.15) / 0.2, 0, 1)
+        cents = depth * np.sin(2 * np.pi * rng.uniform(5.0, 6.5) * t + rng.uniform(0, 2 * np.pi))
+        f0[pos:pos + length] = 440.0 * 2 ** ((pitch - 69 + cents / 100) / 12)
+
+        attack, release = min(length // 4, int(0.03 * sr)), min(length // 4, int(0.05 * sr))
+        env = np.ones(length)
+        env[:attack] = np.linspace(0, 1, attack)
+        env[length - release:] = np.linspace(1, 0, release)
+        envelope[pos:pos + length] = env * rng.uniform(0.6, 1.0)
+        pos += length
+
+        if rng.random() < gap_prob:
+            pos += int(rng.uniform(0.3, 2.0 if duration > 60 else 0.8) * sr)
+        elif rng.random() < glide_prob:
+            # Глиссандо: короткий переход высоты к следующей ноте
+            glide = int(0.06 * sr)
+            if pos + glide < n:
+                f0[pos:pos + glide] = f0[pos - 1]
+                envelope[pos:pos + glide] = envelope[pos - 1]
+                pos += glide
+        else:
+            pos += int(0.02 * sr)
+
+    # Глиссандо: сглаживаем высоту на стыках, где голос не прерывался
+    voiced = f0 > 0
+    log_f0 = np.where(voiced, np.log2(np.maximum(f0, 1)), 0)
+    kernel = np.hanning(int(0.04 * sr))
+    kernel /= kernel.sum()
+    smooth = np.convolve(log_f0, kernel, mode="same") / np.maximum(np.convolve(voiced, kernel, mode="same"), 1e-9)
+    f0 = np.where(voiced, 2 ** smooth, 0)
+
+    phase = 2 * np.pi * np.cumsum(f0) / sr
+    y = np.zeros(n)
+    for k in range(1, 25):
+        freq = k * f0
+        gain = sum(np.exp(-0.5 * ((freq - fc) / bw) ** 2) for fc, bw in FORMANTS) + 0.3 / k
+        gain = np.where(freq < sr / 2 - 500, gain, 0)
+        y += gain * np.sin(k * phase)
+    y *= envelope
+
+    # Дыхание на атаках и фоновый шум
+    y += 0.02 * rng.standard_normal(n) * np.convolve(envelope, np.ones(512) / 512, mode="same")
+    y /= np.max(np.abs(y)) + 1e-9
+    if snr_db is not None:
+        signal_power = np.mean(y[voiced] ** 2) if voiced.any() else 1.0
+        y += rng.standard_normal(n) * np.sqrt(signal_power / 10 ** (snr_db / 10))
+    y = 0.8 * y / np.max(np.abs(y))
+    return y.astype(np.float32), notes
+
+
+def match_notes(reference, estimated, onset_tolerance=ONSET_TOLERANCE):
+    """Жадное сопоставление нот один к одному. Возвращает (precision, recall, f1, ошибка начала, сек)"""
+    used = set()
+    onset_errors = []
+    for pitch, start, _ in reference:
+        best = None
+        for j, (est_pitch, est_start, _) in enumerate(estimated):
+            if j in used or int(est_pitch) != pitch:
+                continue
+            error = abs(est_start - start)
+            if error <= onset_tolerance and (best is None or error < best[1]):
+                best = (j, error)
+        if best is not None:
+            used.add(best[0])
+            onset_errors.append(best[1])
+
+    matched = len(onset_errors)
+    precision = matched / len(estimated) if estimated else 0.0
+    recall = matched / len(reference) if reference else 0.0
+    f1 = 2 * precision * recall / (precision + recall) if precision + recall else 0.0
+    onset_error = float(np.mean(onset_errors)) if onset_errors else None
+    return precision, recall, f1, onset_error
+
+
+def peak_rss_mb():
+    """Пиковый RSS прогона, МБ: процесс прогона плюс рабочий процесс PYIN.
+
+    Пики двух процессов могут приходиться на разное время, так что сумма -
+    оценка сверху. None - платформа не сообщает пиковый RSS.
+    """
+    own = own_peak_rss_mb()
+    if own is None:
+        return None
+    return own + (detector_peak_rss_mb() or 0.0)
+
+
+def own_peak_rss_mb():
+    try:
+        import resource
+    except ImportError:
+        # Windows: модуля resource нет, пиковый рабочий набор дает psutil
+        return process_peak_rss_mb(os.getpid())
+    # ru_maxrss в Linux - в килобайтах, в macOS - в байтах
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / (2 ** 20 if sys.platform == "darwin" else 1024)
+
+
+def detector_peak_rss_mb():
+    """Пиковый RSS рабочих процессов детектора, МБ.
+
+    Рабочий процесс PYIN живет до конца прогона, а RUSAGE_CHILDREN учитывает
+    только завершенные дочерние процессы, поэтому живой процесс опрашивается
+    по PID. Завершенные (например, остановленные отменой) берутся из
+    RUSAGE_CHILDREN.
+    """
+    from detector_pool import detector_worker_pid
+
+    pid = detector_worker_pid()
+    peaks = [process_peak_rss_mb(pid)] if pid else []
+    try:
+        import resource
+    except ImportError:
+        pass
+    else:
+        finished = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+        peaks.append(finished / (2 ** 20 if sys.platform == "darwin" else 1024))
+    peaks = [peak for peak in peaks if peak is not None]
+    return max(peaks) if peaks else None
+
+
+def process_peak_rss_mb(pid):
+    """Пиковый RSS процесса по PID, МБ (None - узнать нельзя)"""
+    try:
+        with open(f"/proc/{pid}/status", encoding="ascii") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    try:
+        import psutil
+        info = psutil.Process(pid).memory_info()
+    except Exception:
+        return None
+    # peak_wset есть только в Windows; в остальных системах - текущий RSS
+    return getattr(info, "peak_wset", info.rss) / 2 ** 20
+
+
+def run_case(scenario, method, preprocessing, onset_tolerance=ONSET_TOLERANCE, preset=None):
+    """Один прогон в свежем процессе: этапы, время, память, точность.
+
+    preset - пресет скорость/точность CREPE (crepe_backend.SPEED_PRESETS).
+    """
+    from engine import ConversionError, ConversionParams, VocalToMIDIEngine
+    from instrumentation import StageTrace
+    from midi_writer import encode_smf
+    from segmentation import as_note_array, note_tuples
+
+    y, reference = synth_melody(**SCENARIOS[scenario])
+    sr = SAMPLE_RATE
+    noise_reduction, hpss = PREPROCESSING[preprocessing]
+
+    def timed_run(engine):
+        """Время transcribe + MIDI и время этапов по замерам движка"""
+        engine.trace = StageTrace()
+        started = time.perf_counter()
+        try:
+            notes = engine.transcribe(y, sr)
+        except ConversionError:
+            notes = as_note_array([])
+        encode_smf(engine.playable_notes(notes), engine.params.instrument_program)
+        total = time.perf_counter() - started
+        return notes, total, {name: round(seconds, 4) for name, seconds in engine.trace.totals().items()}
+
+    with tempfile.TemporaryDirectory(prefix="mpdi-bench-") as cache_dir:
+        params = ConversionParams(method=method, use_noise_reduction=noise_reduction,
+                                  use_harmonic_percussive=hpss, cache_dir=cache_dir)
+        if preset:
+            params = params.with_preset(preset)
+        engine = VocalToMIDIEngine(params)
+        engine.warm_up()
+        # Холостой прогон на коротком отрывке: ленивые импорты, JIT и процесс PYIN
+        # не должны попасть в замер (в кэш отрывок ложится под своим ключом)
+        try:
+            engine.transcribe(y[:2 * sr], sr)
+        except Exception:
+            pass
+        baseline_rss = peak_rss_mb()
+
+        notes, total, stages = timed_run(engine)
+        cold_rss = peak_rss_mb()
+        # Повтор новым движком: треки берутся из дискового кэша
+        _, warm_total, warm_stages = timed_run(VocalToMIDIEngine(params))
+
+    duration = len(y) / sr
+    precision, recall, f1, onset_error = match_notes(reference, note_tuples(notes), onset_tolerance)
+    return {
+        "scenario": scenario,
+        "method": method,
+        "preprocessing": preprocessing,
+        "preset": preset or "default",
+        "audio_seconds": round(duration, 2),
+        "wall_seconds": round(total, 3),
+        "realtime_factor": round(duration / total, 2) if total > 0 else None,
+        "stages": stages,
+        "warm_wall_seconds": round(warm_total, 3),
+        "warm_realtime_factor": round(duration / warm_total, 2) if warm_total > 0 else None,
+        "warm_stages": warm_stages,
+        "baseline_rss_mb": round(baseline_rss, 1) if baseline_rss is not None else None,
+        "peak_rss_mb": round(cold_rss, 1) if cold_rss is not None else None,
+        "reference_notes": len(reference),
+        "estimated_notes": len(notes),
+        "precision": round(precision, 3),
+        "recall": round(recall, 3),
+        "f1": round(f1, 3),
+        "onset_error_ms": round(onset_error * 1000, 1) if onset_error is not None else None,
+    }
+
+
+def measure_startup(module, runs=STARTUP_RUNS):
+    """Время импорта модуля в свежем интерпретаторе (медиана по runs запускам)"""
+    code = (f"import json, sys, time; started = time.perf_counter(); import {module}; "
+            f"print(json.dumps([time.perf_counter() - started, "
+            f"sorted(name for name in {HEAVY_MODULES!r} if name in sys.modules)]))")
+    import_times, process_times = [], []
+    for _ in range(runs):
+        started = time.perf_counter()
+        output = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True,
+                                cwd=Path(__file__).parent, check=True).stdout
+        process_times.append(time.perf_counter() - started)
+        seconds, heavy = json.loads(output.splitlines()[-1])
+        import_times.append(seconds)
+    return {
+        "module": module,
+        "import_seconds": round(float(np.median(import_times)), 3),
+        "process_seconds": round(float(np.median(process_times)), 3),
+        "heavy_modules": heavy,
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=Path(__file__).parent, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def case_key(result):
+    return result["scenario"], result["method"], result["preprocessing"], result.get("preset", "default")
+
+
+def format_mb(value):
+    return "н/д" if value is None else f"{value:.0f}"
+
+
+def compare(results, baseline_path):
+    """Изменения относительно сохраненного прогона (скорость и F1)"""
+    with open(baseline_path, encoding="utf-8") as f:
+        baseline = {case_key(r): r for r in json.load(f)["results"]}
+    print(f"\nСравнение с {baseline_path}:")
+    for result in results:
+        old = baseline.get(case_key(result))
+        if old is None:
+            continue
+        speed = result["realtime_factor"] / old["realtime_factor"] if old["realtime_factor"] else float("nan")
+        warm = ""
+        if old.get("warm_realtime_factor"):
+            warm = f"с кэшем x{result['warm_realtime_factor'] / old['warm_realtime_factor']:.2f}  "
+        print(f"  {'/'.join(case_key(result)):32s} скорость x{speed:.2f}  {warm}"
+              f"F1 {old['f1']:.3f} -> {result['f1']:.3f}  "
+              f"RSS {format_mb(old['peak_rss_mb'])} -> {format_mb(result['peak_rss_mb'])} МБ")
+
+
+def compare_startup(startup, baseline_path):
+    """Изменение времени импорта точек входа относительно сохраненного прогона"""
+    with open(baseline_path, encoding="utf-8") as f:
+        baseline = {r["module"]: r for r in json.load(f).get("startup", [])}
+    print(f"\nСравнение с {baseline_path}:")
+    for result in startup:
+        old = baseline.get(result["module"])
+        if old is not None:
+            print(f"  {result['module']:16s} импорт {old['import_seconds']:.3f} -> {result['import_seconds']:.3f} с")
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Бенчмарк скорости и точности на синтетических мелодиях")
+    parser.add_argument("--scenarios", nargs="+", choices=sorted(SCENARIOS), default=sorted(SCENARIOS))
+    parser.add_argument("--methods", nargs="+", choices=METHODS, default=list(METHODS))
+    parser.add_argument("--preprocessing", nargs="+", choices=list(PREPROCESSING), default=list(PREPROCESSING))
+    parser.add_argument("--preset", choices=sorted(SPEED_PRESETS),
+                        help="пресет скорость/точность CREPE, например refine (двухпроходный)")
+    parser.add_argument("--onset-tolerance", type=float, default=ONSET_TOLERANCE,
+                        help="допустимая ошибка начала ноты, сек")
+    parser.add_argument("-o", "--output", help="сохранить результаты в JSON")
+    parser.add_argument("--compare", help="JSON предыдущего прогона для сравнения")
+    parser.add_argument("--startup", action="store_true",
+                        help="только время запуска точек входа и проверка тяжелых импортов")
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    if args.startup:
+        return run_startup(args)
+    cases = [(s, m, p) for s in args.scenarios for m in args.methods for p in args.preprocessing]
+
+    results = []
+    # Новый процесс на каждый прогон: пик RSS и прогрев не переходят между случаями.
+    # Не multiprocessing.Pool: его процессы - демоны, а движку нужен процесс для PYIN
+    context = multiprocessing.get_context("spawn")
+    for scenario, method, preprocessing in cases:
+        with ProcessPoolExecutor(max_workers=1, mp_context=context) as pool:
+            result = pool.submit(run_case, scenario, method, preprocessing, args.onset_tolerance,
+                                 args.preset).result()
+        results.append(result)
+        print(f"{scenario:12s} {method:9s} {preprocessing:8s} "
+              f"скорость {result['realtime_factor']:7.1f}x  с кэшем {result['warm_realtime_factor']:7.1f}x  "
+              f"F1 {result['f1']:.3f}  "
+              f"начало {result['onset_error_ms']} мс  RSS {format_mb(result['peak_rss_mb'])} МБ", file=sys.stderr)
+
+    report = {
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "onset_tolerance_s": args.onset_tolerance,
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=1)
+    else:
+        json.dump(report, sys.stdout, ensure_ascii=False, indent=1)
+        print()
+
+    if args.compare:
+        compare(results, args.compare)
+    return 0
+
+
+def run_startup(args):
+    """Замер запуска; код возврата 1, если точка входа тянет тяжелые библиотеки"""
+    startup = []
+    for module in STARTUP_MODULES:
+        result = measure_startup(module)
+        startup.append(result)
+        print(f"{module:16s} импорт {result['import_seconds']:.3f} с  процесс {result['process_seconds']:.3f} с  "
+              f"тяжелые модули: {', '.join(result['heavy_modules']) or 'нет'}", file=sys.stderr)
+
+    report = {
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "startup": startup,
+    }
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=1)
+    else:
+        json.dump(report, sys.stdout, ensure_ascii=False, indent=1)
+        print()
+
+    if args.compare:
+        compare_startup(startup, args.compare)
+    return 1 if any(result["heavy_modules"] for result in startup) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,97 @@
+"""Двухпроходный CREPE: грубый проход по всему сигналу, точный - у переходов.
+
+После квантования до полутонов большая часть кадров лежит в середине
+устойчивых нот, где точная модель с мелким шагом ничего не меняет. Грубый
+проход (малая модель, крупный шаг) находит устойчивые участки и кандидаты в
+переходы: смену полутона, начало и конец звучания, неуверенные кадры.
+Точная модель считает только окна вокруг них. Обе матрицы - в одном
+представлении (360 бинов CREPE), поэтому слияние сводится к заполнению
+кадров мелкой сетки строками грубой матрицы там, где точного расчета не
+было; дальше работает обычный Витерби по слитой матрице.
+"""
+import numpy as np
+
+from viterbi import local_average_cents
+
+
+COARSE_CAPACITY = "tiny"
+COARSE_STEP_MS = 40
+# Полуширина окна точного прохода вокруг перехода (сверх неопределенности грубой сетки)
+REFINE_WINDOW_MS = 30.0
+# Пределы порога уверенности CREPE (чувствительность 0..1): кадр с уверенностью
+# между ними может оказаться и звучащим, и тихим - его уточняет точный проход
+CONFIDENCE_LOW = 0.4
+CONFIDENCE_HIGH = 0.8
+# Строк на одно копирование при раскладке грубой матрицы (память на длинных файлах)
+SPREAD_BLOCK_FRAMES = 8192
+
+UNVOICED = -1
+UNCERTAIN = -2
+
+
+def frame_classes(activation):
+    """Класс каждого кадра грубой сетки: полутон, UNVOICED или UNCERTAIN.
+
+    Полутон берется по максимуму активации без сглаживания: выброс (например,
+    октавная ошибка) тоже становится переходом и уходит в точный проход, а не
+    растягивается на несколько кадров мелкой сетки. Классы не зависят от
+    диапазона нот и чувствительности, поэтому слитая матрица годится для
+    любых их значений (и кэшируется без них).
+    """
+    cents = local_average_cents(activation, np.argmax(activation, axis=1))
+    semitones = np.round(69 + (cents - 1200 * np.log2(440 / 10)) / 100)
+    confidence = activation.max(axis=1)
+    return np.where(confidence >= CONFIDENCE_HIGH, semitones,
+                    np.where(confidence < CONFIDENCE_LOW, UNVOICED, UNCERTAIN)).astype(np.int64)
+
+
+def refine_ranges(classes, coarse_step, fine_step, n_fine, window_ms=REFINE_WINDOW_MS):
+    """Диапазоны кадров мелкой сетки [first, last) вокруг переходов, слитые и отсортированные"""
+    changes = np.flatnonzero(classes[1:] != classes[:-1])
+    uncertain = np.flatnonzero(classes == UNCERTAIN)
+    # Переход лежит где-то между грубыми кадрами i и i + 1
+    centres = np.concatenate(((changes + 0.5) * coarse_step, uncertain * float(coarse_step)))
+    if len(centres) == 0:
+        return []
+    half = coarse_step / 2 + window_ms
+    firsts = np.clip(np.floor((centres - half) / fine_step).astype(np.int64), 0, n_fine)
+    lasts = np.clip(np.ceil((centres + half) / fine_step).astype(np.int64) + 1, 0, n_fine)
+    order = np.argsort(firsts, kind="stable")
+
+    ranges = []
+    for first, last in zip(firsts[order].tolist(), lasts[order].tolist()):
+        if ranges and first <= ranges[-1][1]:
+            ranges[-1][1] = max(ranges[-1][1], last)
+        elif last > first:
+            ranges.append([first, last])
+    return [tuple(r) for r in ranges]
+
+
+def intersect_ranges(ranges, allowed):
+    """Пересечение двух отсортированных списков диапазонов [first, last)"""
+    result = []
+    i = j = 0
+    while i < len(ranges) and j < len(allowed):
+        first = max(ranges[i][0], allowed[j][0])
+        last = min(ranges[i][1], allowed[j][1])
+        if last > first:
+            result.append((first, last))
+        if ranges[i][1] < allowed[j][1]:
+            i += 1
+        else:
+            j += 1
+    return result
+
+
+def spread_coarse(coarse, coarse_step, fine_step, out):
+    """Заполняет out (мелкая сетка) строками грубой матрицы: ближайший по времени кадр"""
+    for start in range(0, len(out), SPREAD_BLOCK_FRAMES):
+        stop = min(len(out), start + SPREAD_BLOCK_FRAMES)
+        index = np.round(np.arange(start, stop) * fine_step / coarse_step).astype(np.int64)
+        out[start:stop] = coarse[np.clip(index, 0, len(coarse) - 1)]
+    return out
+
+
+def frame_total(ranges):
+    """Число кадров в диапазонах"""
+    return sum(last - first for first, last in ranges)
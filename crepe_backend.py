@@ -0,0 +1,311 @@
+"""Сессия модели CREPE и потоковый запуск с ограниченным расходом памяти.
+
+Модель выбранного размера загружается один раз на процесс и остается
+"прогретой" между конвертациями (``CrepeSession.get``).
+
+``crepe.predict`` держит в памяти весь сигнал на 16 кГц и все кадры. Здесь
+сигнал подается в модель окнами фиксированной длины: каждое окно
+ресемплируется отдельно, а кадры строятся на общей для всего файла сетке,
+поэтому результат не зависит от разбиения на окна. ``fill_activation`` только
+заполняет матрицу активаций frames x 360 (обычно np.memmap в кэше высоты
+тона); сглаживание Витерби и перевод в частоту конвейер делает сам по этой
+матрице (``viterbi.py``), независимо от окон модели.
+
+``CrepeBatcher`` собирает кадры нескольких файлов, обрабатываемых в
+параллельных потоках, в общие большие батчи: на коротких фразах модель
+запускается один раз на тысячи кадров, а не на каждый файл отдельно.
+"""
+import tempfile
+import threading
+from math import gcd
+
+import librosa
+import numpy as np
+from numpy.lib.stride_tricks import as_strided
+
+
+MODEL_SR = 16000
+FRAME_LENGTH = 1024
+ACTIVATION_BINS = 360
+
+MODEL_CAPACITIES = ("tiny", "small", "medium", "large", "full")
+
+# Готовые сочетания скорость/точность для GUI и пакетного режима
+SPEED_PRESETS = {
+    "draft": {"crepe_model_capacity": "tiny", "crepe_step_size": 20},
+    "fast": {"crepe_model_capacity": "small", "crepe_step_size": 10},
+    "balanced": {"crepe_model_capacity": "medium", "crepe_step_size": 10},
+    "accurate": {"crepe_model_capacity": "full", "crepe_step_size": 10},
+    # Полная модель только у переходов нот, остальное - грубый проход tiny
+    "refine": {"crepe_model_capacity": "full", "crepe_step_size": 10, "crepe_refine": True},
+}
+
+# Запас исходных отсчетов по краям окна, чтобы фильтр ресемплера
+# не видел искусственного обрыва сигнала
+RESAMPLE_MARGIN_SECONDS = 0.1
+
+# Кадров в одном батче модели по умолчанию (ConversionParams.crepe_batch_size)
+BATCH_SIZE = 256
+
+# Сколько кадров CrepeBatcher копит до запуска модели
+BATCHER_FRAMES_PER_CALL = 4096
+
+
+def frame_count(n_samples, sr, step_size=10):
+    """Число кадров, которое crepe.predict(center=True) вернет для сигнала"""
+    # resampy, которым пользуется crepe, округляет длину вниз
+    n_model = int(n_samples * MODEL_SR / sr)
+    hop_length = int(MODEL_SR * step_size / 1000)
+    return 1 + n_model // hop_length
+
+
+def scratch_activation(n_frames):
+    """Нулевая матрица активаций frames x 360 (float16) во временном файле.
+
+    Для расчета без кэша высоты тона: матрица трехчасовой записи занимает
+    сотни мегабайт, а так в памяти остаются только страницы, с которыми
+    сейчас работают. Файл удаляется при закрытии, отображение в память
+    остается рабочим, пока жив массив.
+    """
+    if n_frames == 0:
+        return np.zeros((0, ACTIVATION_BINS), dtype=np.float16)
+    with tempfile.TemporaryFile(prefix="crepe-activation-") as handle:
+        return np.memmap(handle, dtype=np.float16, mode="w+", shape=(n_frames, ACTIVATION_BINS))
+
+
+def normalized_frames(audio, hop_length):
+    """Нарезка на кадры по 1024 отсчета с нормализацией, как в crepe.get_activation"""
+    n_frames = 1 + (len(audio) - FRAME_LENGTH) // hop_length
+    frames = as_strided(audio, shape=(n_frames, FRAME_LENGTH),
+                        strides=(hop_length * audio.itemsize, audio.itemsize))
+    frames = frames.astype(np.float32)
+    frames -= np.mean(frames, axis=1)[:, np.newaxis]
+    frames /= np.clip(np.std(frames, axis=1)[:, np.newaxis], 1e-8, None)
+    return frames
+
+
+def model_rate_segment(y, sr, start, stop, res_type="kaiser_best"):
+    """Отсчеты [start, stop) сигнала на частоте 16 кГц, за краями - нули.
+
+    Ресемплируется только нужный кусок исходного сигнала. Начало куска
+    выравнивается так, чтобы его отсчеты попадали точно на общую сетку 16 кГц.
+    """
+    g = gcd(int(sr), MODEL_SR)
+    src_step, dst_step = int(sr) // g, MODEL_SR // g
+    margin = int(RESAMPLE_MARGIN_SECONDS * MODEL_SR) // dst_step + 1
+
+    block_first = max(0, start // dst_step - margin)
+    block_last = (stop + dst_step - 1) // dst_step + margin
+    src_start = block_first * src_step
+    src_stop = min(len(y), block_last * src_step)
+
+    out = np.zeros(stop - start, dtype=np.float32)
+    if src_start >= src_stop:
+        return out
+
+    chunk = np.asarray(y[src_start:src_stop], dtype=np.float32)
+    if sr != MODEL_SR:
+        chunk = librosa.resample(chunk, orig_sr=sr, target_sr=MODEL_SR, res_type=res_type)
+
+    chunk_offset = block_first * dst_step
+    lo = max(start, chunk_offset)
+    hi = min(stop, chunk_offset + len(chunk), int(len(y) * MODEL_SR / sr))
+    if lo < hi:
+        out[lo - start:hi - start] = chunk[lo - chunk_offset:hi - chunk_offset]
+    return out
+
+
+class CrepeSession:
+    """Загруженная модель CREPE, переиспользуемая между вызовами"""
+
+    _sessions = {}
+    _lock = threading.Lock()
+
+    def __init__(self, model_capacity="full"):
+        if model_capacity not in MODEL_CAPACITIES:
+            raise ValueError(f"Неизвестный размер модели CREPE: {model_capacity}")
+        # crepe тянет TensorFlow - импорт только при первой загрузке модели
+        import crepe.core
+        self.model_capacity = model_capacity
+        self.model = crepe.core.build_and_load_model(model_capacity)
+        self.warmed_up = False
+
+    @classmethod
+    def get(cls, model_capacity="full"):
+        """Сессия для модели данного размера (создается один раз на процесс).
+
+        Сессию делят потоки с разными параметрами, поэтому размер батча
+        передается в каждый вызов, а не хранится в ней.
+        """
+        with cls._lock:
+            session = cls._sessions.get(model_capacity)
+            if session is None:
+                session = cls._sessions[model_capacity] = cls(model_capacity)
+        return session
+
+    def warm_up(self):
+        """Первый прогон модели, чтобы построение графа не попало в конвертацию"""
+        if not self.warmed_up:
+            self.activation(np.zeros((1, FRAME_LENGTH), dtype=np.float32))
+            self.warmed_up = True
+
+    def activation(self, frames, check=None, batch_size=BATCH_SIZE):
+        """Активации модели (frames x 360) для нормализованных кадров.
+
+        check - функция, вызываемая между батчами (бросает исключение при
+        отмене): тогда модель запускается по одному батчу за вызов.
+        """
+        self.warmed_up = True
+        if check is None or len(frames) <= batch_size:
+            return self.model.predict(frames, batch_size=batch_size, verbose=0)
+
+        out = np.empty((len(frames), ACTIVATION_BINS), dtype=np.float32)
+        for start in range(0, len(frames), batch_size):
+            check()
+            batch = frames[start:start + batch_size]
+            out[start:start + len(batch)] = self.model.predict(batch, batch_size=batch_size, verbose=0)
+        return out
+
+    def chunk_activation(self, y, sr, first_frame, last_frame, hop_length, res_type="kaiser_best", check=None,
+                         batcher=None, batch_size=BATCH_SIZE):
+        """Активации для кадров [first_frame, last_frame) общей сетки"""
+        # Кадр i центрирован на отсчете i * hop_length (center=True в crepe)
+        start = first_frame * hop_length - FRAME_LENGTH // 2
+        stop = (last_frame - 1) * hop_length + FRAME_LENGTH // 2
+        audio = model_rate_segment(y, sr, start, stop, res_type)
+        frames = normalized_frames(audio, hop_length)
+        if batcher is not None:
+            return batcher.activation(frames, check)
+        return self.activation(frames, check, batch_size)
+
+    def fill_activation(self, y, sr, out, step_size=10, chunk_seconds=60.0, frame_ranges=None,
+                        res_type="kaiser_best", check=None, batcher=None, batch_size=BATCH_SIZE):
+        """Заполняет out (frames x 360, например np.memmap) активациями окнами по chunk_seconds.
+
+        frame_ranges - список диапазонов кадров [first, last), которые нужно
+        посчитать; кадры вне них не трогаются (по умолчанию считается весь
+        сигнал). res_type - ресемплер librosa для перевода окон в 16 кГц
+        (kaiser_best - как в crepe.predict). check - проверка отмены между
+        окнами и батчами модели. batcher - CrepeBatcher, через который кадры
+        идут в модель вместе с кадрами других файлов (размер батча тогда
+        задает он). chunk_seconds=0 - весь сигнал одним окном.
+        """
+        hop_length = int(MODEL_SR * step_size / 1000)
+        n_frames = len(out)
+        chunk_frames = max(1, int(chunk_seconds * 1000 / step_size)) if chunk_seconds > 0 else max(1, n_frames)
+        if frame_ranges is None:
+            frame_ranges = [(0, n_frames)]
+
+        for range_start, range_stop in frame_ranges:
+            range_start, range_stop = max(0, range_start), min(n_frames, range_stop)
+            for start in range(range_start, range_stop, chunk_frames):
+                stop = min(range_stop, start + chunk_frames)
+                if check is not None:
+                    check()
+                out[start:stop] = self.chunk_activation(y, sr, start, stop, hop_length, res_type, check, batcher,
+                                                        batch_size)
+        return out
+
+
+def activation_chunked(y, sr, out, model_capacity="full", step_size=10, chunk_seconds=60.0, batch_size=BATCH_SIZE,
+                       frame_ranges=None, res_type="kaiser_best", check=None, batcher=None):
+    """Потоковый расчет матрицы активаций через прогретую сессию модели"""
+    session = CrepeSession.get(model_capacity)
+    return session.fill_activation(y, sr, out, step_size=step_size, chunk_seconds=chunk_seconds,
+                                   frame_ranges=frame_ranges, res_type=res_type, check=check, batcher=batcher,
+                                   batch_size=batch_size)
+
+
+class CrepeBatcher:
+    """Общие батчи модели для нескольких потоков, каждый из которых ведет свой файл.
+
+    Поток отдает кадры очередного окна и ждет. Модель запускается, когда
+    накопилось frames_per_call кадров или когда ждут все потоки, которые еще
+    работают (clients): больше кадров взять неоткуда. Активации раскладываются
+    обратно по запросам, дальше каждый файл идет обычным путем.
+    """
+
+    def __init__(self, session, clients, frames_per_call=BATCHER_FRAMES_PER_CALL, batch_size=BATCH_SIZE):
+        self.session = session
+        self.frames_per_call = frames_per_call
+        self.batch_size = batch_size
+        self.calls = 0
+        self.frames = 0
+        self._cond = threading.Condition()
+        self._pending = []
+        self._pending_frames = 0
+        self._clients = clients
+        self._waiting = 0
+        self._running = False
+
+    def leave(self):
+        """Поток закончил свой файл: остальным больше не нужно его ждать"""
+        with self._cond:
+            self._clients -= 1
+        self._flush_if_ready()
+
+    def activation(self, frames, check=None):
+        """Активации для кадров одного окна (блокирует до запуска модели)"""
+        request = {"frames": frames, "done": False, "result": None, "error": None}
+        with self._cond:
+            self._pending.append(request)
+            self._pending_frames += len(frames)
+            self._waiting += 1
+        while True:
+            self._flush_if_ready()
+            with self._cond:
+                if not request["done"]:
+                    self._cond.wait(timeout=0.2)
+                if request["done"]:
+                    break
+            if check is not None:
+                try:
+                    check()
+                except BaseException:
+                    self._withdraw(request)
+                    raise
+
+        if request["error"] is not None:
+            raise request["error"]
+        return request["result"]
+
+    def _withdraw(self, request):
+        with self._cond:
+            if request in self._pending:
+                self._pending.remove(request)
+                self._pending_frames -= len(request["frames"])
+                self._waiting -= 1
+
+    def _flush_if_ready(self):
+        with self._cond:
+            if self._running or not self._pending:
+                return
+            if self._pending_frames < self.frames_per_call and self._waiting < self._clients:
+                return
+            batch, self._pending, self._pending_frames = self._pending, [], 0
+            self._running = True
+
+        # Модель работает без блокировки: остальные потоки тем временем
+        # готовят кадры следующего батча
+        try:
+            activation = self.session.activation(np.concatenate([request["frames"] for request in batch]),
+                                                 batch_size=self.batch_size)
+            error = None
+        except BaseException as e:
+            activation, error = None, e
+
+        with self._cond:
+            position = 0
+            for request in batch:
+                count = len(request["frames"])
+                if error is None:
+                    request["result"] = activation[position:position + count]
+                request["error"] = error
+                request["done"] = True
+                position += count
+            # _waiting - потоки, чьи запросы еще не выполнены
+            self._waiting -= len(batch)
+            self.calls += 1
+            self.frames += position
+            self._running = False
+            self._cond.notify_all()
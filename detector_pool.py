@@ -0,0 +1,154 @@
+"""Фоновый запуск детектора высоты тона в отдельном процессе.
+
+В комбинированном режиме PYIN считается в рабочем процессе одновременно
+с CREPE в основном. Сигнал передается через разделяемую память
+(multiprocessing.shared_memory), а не сериализуется, обратно приходят
+только короткие массивы трека. Рабочий процесс создается один раз и
+переиспользуется между конвертациями.
+"""
+import multiprocessing
+import os
+import signal as signals
+import sys
+from concurrent.futures import ProcessPoolExecutor, wait
+from multiprocessing import shared_memory, util
+
+import numpy as np
+
+
+_executor = None
+# PID рабочего процесса пула (его записывает инициализатор; 0 - еще не запущен)
+_worker_pid = None
+
+
+def _register_worker(pid):
+    pid.value = os.getpid()
+
+
+def detector_executor():
+    """Общий пул из одного процесса (spawn - безопасно рядом с TensorFlow)"""
+    global _executor, _worker_pid
+    if _executor is None:
+        context = multiprocessing.get_context("spawn")
+        _worker_pid = context.Value("q", 0, lock=False)
+        _executor = ProcessPoolExecutor(max_workers=1, mp_context=context, initializer=_register_worker,
+                                        initargs=(_worker_pid,))
+        # Finalize, а не atexit: в рабочих процессах batch_convert atexit не вызывается,
+        # а multiprocessing при выходе ждет завершения всех дочерних процессов.
+        # Приоритет выше, чем у закрытия очередей пула (10), иначе сигнал
+        # остановки не дойдет до рабочего процесса
+        util.Finalize(None, _executor.shutdown, kwargs={"cancel_futures": True}, exitpriority=100)
+    return _executor
+
+
+def detector_worker_pid():
+    """PID рабочего процесса (None - пул еще не создан или процесс не запущен)"""
+    if _executor is None or not _worker_pid.value:
+        return None
+    return _worker_pid.value
+
+
+def terminate_detector_workers():
+    """Немедленно останавливает рабочий процесс (отмена долгого расчета).
+
+    Следующая задача создаст новый пул.
+    """
+    global _executor
+    if _executor is None:
+        return
+    executor, _executor = _executor, None
+    # У ProcessPoolExecutor нет публичного способа прервать уже идущую задачу,
+    # поэтому процесс останавливается по PID от инициализатора
+    if _worker_pid.value:
+        try:
+            os.kill(_worker_pid.value, signals.SIGTERM)
+        except OSError:
+            # Процесс уже завершился
+            pass
+    executor.shutdown(wait=False, cancel_futures=True)
+
+
+class SharedSignal:
+    """Копия сигнала в разделяемой памяти, доступная другим процессам по имени"""
+
+    def __init__(self, y):
+        y = np.ascontiguousarray(y, dtype=np.float32)
+        self.length = len(y)
+        self.shm = shared_memory.SharedMemory(create=True, size=max(1, y.nbytes))
+        np.ndarray(y.shape, dtype=np.float32, buffer=self.shm.buf)[:] = y
+
+    @property
+    def name(self):
+        return self.shm.name
+
+    def release(self):
+        self.shm.close()
+        self.shm.unlink()
+
+
+def attach_signal(name, length):
+    """Подключается к сигналу из SharedSignal. Возвращает (массив, shm)"""
+    if sys.version_info >= (3, 13):
+        # Память принадлежит создателю, рабочий процесс ее не отслеживает
+        shm = shared_memory.SharedMemory(name=name, track=False)
+    else:
+        # resource_tracker у spawn-процессов общий с родителем, повторная
+        # регистрация того же имени безвредна
+        shm = shared_memory.SharedMemory(name=name)
+    return np.ndarray((length,), dtype=np.float32, buffer=shm.buf), shm
+
+
+def _pyin_worker(name, length, sr, params_dict, spans):
+    from engine import ConversionParams, VocalToMIDIEngine
+
+    y, shm = attach_signal(name, length)
+    try:
+        engine = VocalToMIDIEngine(ConversionParams.from_dict(params_dict))
+        midi_notes, times, confidence = engine.detect_pitch_pyin(y, sr, spans=spans)
+        return {"midi_notes": midi_notes, "times": times, "confidence": confidence}
+    finally:
+        del y
+        shm.close()
+
+
+class BackgroundDetection:
+    """Детектор, запущенный в рабочем процессе"""
+
+    def __init__(self, future, signal):
+        self.future = future
+        self.signal = signal
+        self.released = False
+
+    def release(self):
+        if not self.released:
+            self.released = True
+            self.signal.release()
+
+    def result(self, check=None, poll_seconds=0.2):
+        """Результат детектора. check вызывается, пока результата нет (отмена)."""
+        try:
+            if check is not None:
+                while not wait([self.future], timeout=poll_seconds).done:
+                    check()
+            return self.future.result()
+        finally:
+            self.release()
+
+    def cancel(self, terminate=False):
+        """Отказ от результата. Уже запущенная задача доработает вхолостую,
+        если не terminate - тогда рабочий процесс останавливается."""
+        self.future.cancel()
+        if terminate and not self.future.done():
+            terminate_detector_workers()
+        self.release()
+
+
+def submit_pyin(y, sr, params, spans=None):
+    """Запускает PYIN в рабочем процессе над копией y в разделяемой памяти"""
+    signal = SharedSignal(y)
+    try:
+        future = detector_executor().submit(_pyin_worker, signal.name, signal.length, sr, params.to_dict(), spans)
+    except Exception:
+        signal.release()
+        raise
+    return BackgroundDetection(future, signal)
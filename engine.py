@@ -0,0 +1,994 @@
+"""Конвейер конвертации вокала в MIDI без зависимости от GUI.
+
+Содержит те же этапы, что и приложение ``mptomidi.py``:
+предобработка -> определение высоты тона -> обработка нот -> MIDI.
+Параметры задаются обычным объектом ``ConversionParams``, поэтому движок
+можно запускать на сервере без дисплея и в рабочих процессах.
+"""
+import importlib
+import os
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass, asdict, field, replace
+
+# Тяжелые библиотеки (crepe с TensorFlow, scipy.ndimage, scipy.signal,
+# pretty_midi) импортируются в тех этапах, которые их используют: окно GUI
+# и рабочий процесс PYIN не ждут загрузки TensorFlow. librosa сама грузит
+# подмодули при первом обращении.
+import librosa
+import numpy as np
+
+from audio_frontend import open_audio
+from coarse_to_fine import (CONFIDENCE_HIGH, CONFIDENCE_LOW, frame_classes, frame_total, intersect_ranges,
+                            refine_ranges, spread_coarse)
+from crepe_backend import (CrepeSession, activation_chunked, frame_count, scratch_activation, ACTIVATION_BINS, MODEL_SR,
+                           SPEED_PRESETS)
+from pitch_cache import PitchCache
+from midi_writer import write_midi
+from segmentation import as_note_array, segment_note_array
+from spectral import NoiseProfile, SpectralFrontEnd
+from detector_pool import submit_pyin
+from instrumentation import ProgressModel, StageTrace
+from vad import active_spans, activity_threshold, spans_to_frames, voiced_fraction
+from viterbi import band_for_range, viterbi_cents
+from yin import yin_track
+
+
+PITCH_METHODS = ("crepe", "pyin", "combined", "yin")
+
+# Сообщения для GUI в начале каждого этапа
+STAGE_MESSAGES = {
+    "decode": "Загрузка аудио...",
+    "normalize": "Предварительная обработка аудио...",
+    "spectral": "Подавление шума и разделение гармоник...",
+    "rms": "Вычисление громкости...",
+    "resample": "Ресемплинг...",
+    "crepe": "Анализ CREPE (нейросеть)...",
+    "viterbi": "Сглаживание трека CREPE...",
+    "pyin": "Анализ PYIN...",
+    "yin": "Быстрый анализ YIN...",
+    "fusion": "Объединение треков CREPE и PYIN...",
+    "segmentation": "Обработка и сглаживание нот...",
+    "midi": "Создание MIDI...",
+    "midi_write": "Сохранение файла...",
+}
+
+
+class ConversionError(Exception):
+    """Ошибка конвертации, которую стоит показать пользователю"""
+
+
+class ConversionCancelled(ConversionError):
+    """Конвертация остановлена по запросу пользователя"""
+
+
+class StageNotReady(Exception):
+    """Предпросмотр: результата этапа нет ни в памяти сессии, ни в кэше"""
+
+
+class CancelToken:
+    """Флаг отмены, который движок проверяет между этапами и внутри циклов по окнам"""
+
+    def __init__(self):
+        self._event = threading.Event()
+
+    def cancel(self):
+        self._event.set()
+
+    @property
+    def cancelled(self):
+        return self._event.is_set()
+
+    def check(self):
+        if self._event.is_set():
+            raise ConversionCancelled("Конвертация отменена")
+
+
+@dataclass
+class ConversionParams:
+    """Параметры алгоритма (то же, что настраивается в GUI)"""
+    method: str = "crepe"
+    use_noise_reduction: bool = True
+    # Файл профиля шума: если его нет, профиль снимается с первой секунды записи
+    # и сохраняется для следующих дублей. Пустая строка - гейт без профиля
+    noise_profile: str = ""
+    use_harmonic_percussive: bool = True
+    min_note_duration: float = 0.08
+    sensitivity: float = 0.7
+    volume_threshold: float = 0.02
+    min_note: str = "C3"
+    max_note: str = "C6"
+    instrument_program: int = 0
+    sample_rate: int = 22050
+    # Ресемплер (res_type librosa) для перевода исходного сигнала в рабочие частоты
+    resample_quality: str = "soxr_hq"
+    # Модель CREPE: размер (tiny/small/medium/large/full), шаг кадров в мс, размер батча
+    crepe_model_capacity: str = "full"
+    crepe_step_size: int = 10
+    crepe_batch_size: int = 256
+    # Длина окна потоковой обработки CREPE, сек (0 - весь сигнал за один вызов)
+    crepe_chunk_seconds: float = 60.0
+    # Дисковый кэш треков высоты тона (пустая строка - кэш выключен)
+    cache_dir: str = ""
+    cache_max_mb: float = 2048.0
+    # Ширина переходов Витерби по активациям CREPE, бинов по 20 центов
+    viterbi_transition_bins: int = 12
+    # Двухпроходный CREPE: грубая модель по всему сигналу, основная - только
+    # в окнах (полуширина в мс) вокруг переходов, найденных грубым проходом
+    crepe_refine: bool = False
+    crepe_coarse_capacity: str = "tiny"
+    crepe_coarse_step: int = 40
+    crepe_refine_window_ms: float = 30.0
+    # Запускать детекторы только на участках громче шумового фона (с запасом
+    # по краям); vad_threshold - нижняя граница порога для цифровой тишины
+    vad_gating: bool = True
+    vad_threshold: float = 0.005
+    vad_pad_seconds: float = 0.3
+    # В комбинированном режиме считать PYIN в отдельном процессе параллельно с CREPE
+    parallel_detectors: bool = True
+
+    def to_dict(self):
+        return asdict(self)
+
+    @classmethod
+    def from_dict(cls, data):
+        known = {name: value for name, value in data.items() if name in cls.__dataclass_fields__}
+        return cls(**known)
+
+    def with_preset(self, preset):
+        """Копия параметров с настройками CREPE из пресета скорость/точность"""
+        return replace(self, **SPEED_PRESETS[preset])
+
+
+@dataclass
+class ConversionResult:
+    """Итог конвертации одного файла"""
+    input_path: str
+    output_path: str
+    note_count: int
+    audio_duration: float
+    elapsed: float
+    # Замеры этапов (instrumentation.StageRecord)
+    stages: list = field(default_factory=list)
+
+    @property
+    def realtime_factor(self):
+        """Во сколько раз быстрее реального времени прошла конвертация"""
+        return self.audio_duration / self.elapsed if self.elapsed > 0 else float("inf")
+
+
+def parse_instrument_program(label):
+    """Извлекает номер программы из строки вида 'Violin (40)'"""
+    return int(label.split("(")[1].split(")")[0])
+
+
+# Модули, которые этап импортирует при первом запуске (для прогрева)
+STAGE_MODULES = {
+    "decode": ("soundfile", "soxr", "audioread"),
+    "spectral": ("librosa.core.spectrum", "scipy.signal", "librosa.decompose"),
+    "rms": ("librosa.feature", "scipy.ndimage"),
+    "pyin": ("librosa.sequence",),
+    "segmentation": ("scipy.ndimage",),
+}
+
+
+class VocalToMIDIEngine:
+    def __init__(self, params=None, progress_callback=None, cancel_token=None, memo=None):
+        self.params = params or ConversionParams()
+        self.progress_callback = progress_callback
+        self.cancel_token = cancel_token
+        # StageMemo сессии: результаты этапов, переживающие смену параметров
+        self.memo = memo
+        # Предпросмотр: только готовые результаты, без расчета тяжелых этапов
+        self.memo_only = False
+        # CrepeBatcher: кадры CREPE идут в модель вместе с кадрами других файлов
+        self.crepe_batcher = None
+        # Последний результат CREPE: {"activation", "times", "confidence"}.
+        # decode_crepe пересчитывает по нему трек без нейросети
+        self.crepe_activation = None
+        # Порог VAD текущего сигнала (activity_threshold по его RMS)
+        self.active_threshold = None
+        self.cache = None
+        timings_path = None
+        if self.params.cache_dir:
+            self.cache = PitchCache(self.params.cache_dir, int(self.params.cache_max_mb * 1024 ** 2))
+            timings_path = os.path.join(self.params.cache_dir, "stage_timings.json")
+        self.progress = ProgressModel(timings_path)
+        self.trace = StageTrace()
+
+    def update_progress(self, value, message):
+        if self.progress_callback is not None:
+            self.progress_callback(value, message)
+
+    def check_cancelled(self):
+        """Бросает ConversionCancelled, если конвертацию отменили"""
+        if self.cancel_token is not None:
+            self.cancel_token.check()
+
+    def report(self, message):
+        """Сообщение без смены процента готовности"""
+        self.update_progress(self.progress.percent(), message)
+
+    @contextmanager
+    def stage(self, name, data=None):
+        """Замер этапа: время, память, размеры; процент готовности по замерам"""
+        self.check_cancelled()
+        self.report(STAGE_MESSAGES[name])
+        with self.trace.stage(name, data) as record:
+            yield record
+        self.progress.finish(name)
+
+    def planned_stages(self, write_midi=False):
+        """Этапы, которые пройдет сигнал при текущих параметрах"""
+        stages = ["normalize"]
+        if self.params.use_noise_reduction or self.params.use_harmonic_percussive:
+            stages.append("spectral")
+        stages.append("rms")
+        method = self.params.method
+        if method in ("crepe", "combined"):
+            stages += ["crepe", "viterbi"]
+        # Параллельный PYIN идет одновременно с CREPE и времени не добавляет
+        if method == "pyin" or (method == "combined" and not self.params.parallel_detectors):
+            stages.append("pyin")
+        if method == "yin":
+            stages.append("yin")
+        if method == "combined":
+            stages.append("fusion")
+        stages += ["segmentation", "midi"]
+        if write_midi:
+            stages.append("midi_write")
+        return stages
+
+    def warm_up(self):
+        """Импортирует библиотеки этапов и прогревает модель CREPE, если они понадобятся"""
+        for stage in ["decode"] + self.planned_stages():
+            for module in STAGE_MODULES.get(stage, ()):
+                importlib.import_module(module)
+        if self.params.method in ("crepe", "combined"):
+            CrepeSession.get(self.params.crepe_model_capacity).warm_up()
+            if self.params.crepe_refine:
+                CrepeSession.get(self.params.crepe_coarse_capacity).warm_up()
+
+    def open_source(self, path):
+        """Однократное декодирование файла (с кэшем PCM, если задан cache_dir)"""
+        key = None
+        if self.memo is not None:
+            stat = os.stat(path)
+            key = ("decode", os.path.abspath(path), stat.st_mtime_ns, stat.st_size, self.params.resample_quality)
+            source = self.memo.get(key)
+            if source is not None:
+                return source
+        if self.memo_only:
+            raise StageNotReady("decode")
+
+        with self.stage("decode") as record:
+            source = open_audio(path, cache=self.cache, quality=self.params.resample_quality)
+            record.produced(source.samples)
+        if key is not None:
+            self.memo.put(key, source)
+        return source
+
+    def load_audio(self, path):
+        """Загрузка аудиофайла"""
+        source = self.open_source(path)
+        return source.at_rate(self.params.sample_rate), self.params.sample_rate
+
+    def noise_profile_for(self, y, sr):
+        """Профиль шума из файла params.noise_profile (None - без профиля).
+
+        y - исходный, ненормализованный сигнал: если файла профиля еще нет,
+        профиль снимается с первой секунды y и сохраняется.
+        """
+        path = self.params.noise_profile
+        if not path or not self.params.use_noise_reduction:
+            return None
+        if os.path.isfile(path):
+            try:
+                return NoiseProfile.load(path)
+            except Exception as e:
+                # Поврежденный файл (например, от прерванной старой записи) -
+                # снимаем профиль заново, а не работаем молча без него
+                print(f"Профиль шума не читается ({e}), снимаем заново")
+        try:
+            profile = NoiseProfile.from_signal(y[:min(sr, len(y))], sr)
+        except Exception as e:
+            print(f"Профиль шума недоступен: {e}")
+            return None
+        try:
+            profile.save(path)
+            self.report("Профиль шума сохранен")
+        except OSError as e:
+            # Профиль для этого файла уже снят - сохранить его можно и в другой раз
+            print(f"Профиль шума не сохранен: {e}")
+        return profile
+
+    def preprocess_audio(self, y, sr, gain=None, noise_profile=None):
+        """Предварительная обработка аудио: нормализация, шумоподавление, HPSS.
+
+        Спектральные маски применяются потоково, блоками кадров (см.
+        SpectralFrontEnd), поэтому спектр всего файла в памяти не держится.
+        gain=None - нормализовать y по его пику; число - y уже нормализован
+        с этим множителем (фрагменты длинной записи).
+        """
+        # Нормализация
+        with self.stage("normalize", y):
+            if gain is None:
+                peak = np.max(np.abs(y)) if len(y) else 0.0
+                gain = 1.0 / peak if peak > 0 else 1.0
+                y = y * gain
+
+        if not (self.params.use_noise_reduction or self.params.use_harmonic_percussive):
+            return y
+
+        with self.stage("spectral", y) as record:
+            front = SpectralFrontEnd(sr)
+            # Подавление шума: стационарное по профилю, если он есть, иначе
+            # нестационарное (как nr.reduce_noise по умолчанию)
+            if self.params.use_noise_reduction:
+                try:
+                    front.reduce_noise(prop_decrease=0.75, profile=noise_profile, gain=gain)
+                except Exception as e:
+                    print(f"Шумоподавление не удалось: {e}")
+            # Разделение гармоник и перкуссии: оставляем гармоническую составляющую
+            if self.params.use_harmonic_percussive:
+                front.harmonic()
+            if front.active:
+                try:
+                    y = front.process(y, check=self.check_cancelled)
+                except ConversionCancelled:
+                    raise
+                except Exception as e:
+                    print(f"Спектральная обработка не удалась: {e}")
+            record.produced(y)
+
+        return y
+
+    def crepe_activation_track(self, y, sr, activation_out=None, spans=None):
+        """Активации CREPE: (матрица frames x 360 в float16, времена, уверенность).
+
+        activation_out - готовый массив для матрицы (например, memory map
+        записи кэша); без него матрица пишется во временный файл. Кадры вне
+        spans остаются нулевыми.
+        """
+        n_frames = frame_count(len(y), sr, self.params.crepe_step_size)
+        activation = activation_out
+        if activation is None:
+            activation = scratch_activation(n_frames)
+
+        frame_ranges = None
+        if spans is not None:
+            frame_ranges = spans_to_frames(spans, sr, self.params.crepe_step_size / 1000, n_frames)
+        if self.params.crepe_refine:
+            frame_ranges = self.coarse_crepe_pass(y, sr, activation, frame_ranges, spans)
+
+        # Окнами фиксированной длины - память не растет с длиной записи
+        # (crepe_chunk_seconds=0 - одним окном, но тоже через прогретую сессию)
+        activation_chunked(
+            y, sr, activation,
+            model_capacity=self.params.crepe_model_capacity,
+            step_size=self.params.crepe_step_size,
+            chunk_seconds=self.params.crepe_chunk_seconds,
+            batch_size=self.params.crepe_batch_size,
+            frame_ranges=frame_ranges,
+            res_type=self.params.resample_quality,
+            check=self.check_cancelled,
+            batcher=self.crepe_batcher
+        )
+
+        times = np.arange(n_frames) * self.params.crepe_step_size / 1000.0
+        confidence = activation.max(axis=1).astype(np.float64)
+        return activation, times, confidence
+
+    def coarse_crepe_pass(self, y, sr, activation, frame_ranges=None, spans=None):
+        """Грубый проход двухпроходного CREPE.
+
+        Заполняет activation (мелкая сетка) строками грубой модели и
+        возвращает диапазоны кадров, которые должна пересчитать основная
+        модель: окна вокруг переходов внутри frame_ranges.
+        """
+        coarse_step = self.params.crepe_coarse_step
+        fine_step = self.params.crepe_step_size
+        n_coarse = frame_count(len(y), sr, coarse_step)
+        coarse = scratch_activation(n_coarse)
+        coarse_ranges = None
+        if spans is not None:
+            coarse_ranges = spans_to_frames(spans, sr, coarse_step / 1000, n_coarse)
+
+        self.report("Грубый проход CREPE...")
+        activation_chunked(
+            y, sr, coarse,
+            model_capacity=self.params.crepe_coarse_capacity,
+            step_size=coarse_step,
+            chunk_seconds=self.params.crepe_chunk_seconds,
+            batch_size=self.params.crepe_batch_size,
+            frame_ranges=coarse_ranges,
+            res_type=self.params.resample_quality,
+            check=self.check_cancelled,
+            # Не через crepe_batcher: он привязан к сессии основной модели
+            batcher=None
+        )
+        spread_coarse(coarse, coarse_step, fine_step, activation)
+
+        classes = frame_classes(coarse)
+        refine = refine_ranges(classes, coarse_step, fine_step, len(activation), self.params.crepe_refine_window_ms)
+        if frame_ranges is not None:
+            refine = intersect_ranges(refine, frame_ranges)
+        total = len(activation) if frame_ranges is None else frame_total(frame_ranges)
+        self.report(f"Уточнение у переходов: {frame_total(refine) / max(total, 1):.0%} кадров")
+        return refine
+
+    def decode_crepe(self, activation, key=None):
+        """MIDI-ноты по активациям CREPE: Витерби в полосе диапазона нот, без нейросети.
+
+        key - ключ активаций в кэше: с ним трек хранится в памяти сессии, и
+        предпросмотр при смене порогов и длительности нот Витерби не повторяет.
+        """
+        fmin = librosa.note_to_hz(self.params.min_note)
+        fmax = librosa.note_to_hz(self.params.max_note)
+        band = band_for_range(fmin * 0.9, fmax * 1.1)
+
+        memo_key = None
+        if key is not None and self.memo is not None:
+            memo_key = ("viterbi", key, band, self.params.viterbi_transition_bins)
+            midi_notes = self.memo.get(memo_key)
+            if midi_notes is not None:
+                self.progress.finish("viterbi")
+                return midi_notes
+
+        with self.stage("viterbi", activation) as record:
+            cents = viterbi_cents(activation, band, transition_bins=self.params.viterbi_transition_bins,
+                                  check=self.check_cancelled)
+            midi_notes = librosa.hz_to_midi(10 * 2 ** (cents / 1200))
+            record.produced(midi_notes)
+        if memo_key is not None:
+            self.memo.put(memo_key, midi_notes)
+        return midi_notes
+
+    def apply_crepe_confidence(self, midi_notes, confidence):
+        """Обнуляет кадры CREPE с уверенностью ниже порога чувствительности"""
+        confidence_threshold = CONFIDENCE_LOW + (CONFIDENCE_HIGH - CONFIDENCE_LOW) * self.params.sensitivity
+        return np.where(confidence > confidence_threshold, midi_notes, 0.0)
+
+    def detect_pitch_crepe(self, y, sr):
+        """Определение высоты тона с помощью CREPE"""
+        try:
+            # Используем CREPE для определения высоты тона
+            with self.stage("crepe", y) as record:
+                activation, time_, confidence = self.crepe_activation_track(y, sr)
+                record.produced(activation)
+            self.crepe_activation = {"activation": activation, "times": time_, "confidence": confidence}
+            midi_notes = self.decode_crepe(activation)
+
+            # Фильтруем по уверенности
+            return self.apply_crepe_confidence(midi_notes, confidence), time_, confidence
+
+        except ConversionCancelled:
+            raise
+        except Exception as e:
+            print(f"CREPE не удался: {e}")
+            return None, None, None
+
+    def pyin_track(self, y, sr):
+        """Трек PYIN: (MIDI-ноты, времена, вероятность вокализации)"""
+        fmin = librosa.note_to_hz(self.params.min_note)
+        fmax = librosa.note_to_hz(self.params.max_note)
+
+        f0, voiced_flag, voiced_probs = librosa.pyin(
+            y,
+            fmin=fmin * 0.9,  # Немного расширяем диапазон
+            fmax=fmax * 1.1,
+            sr=sr,
+            frame_length=2048,
+            hop_length=512,
+            fill_na=0
+        )
+
+        # Конвертируем в MIDI ноты
+        midi_notes = np.zeros_like(f0)
+        valid_mask = (voiced_flag) & (~np.isnan(f0)) & (f0 > 0)
+        midi_notes[valid_mask] = librosa.hz_to_midi(f0[valid_mask])
+
+        return midi_notes, librosa.times_like(f0, sr=sr, hop_length=512), voiced_probs
+
+    def detect_pitch_pyin(self, y, sr, spans=None):
+        """Определение высоты тона с помощью PYIN"""
+        with self.stage("pyin", y) as record:
+            track = self.pyin_track_spans(y, sr, spans)
+            record.produced(track[0])
+        return track
+
+    def pyin_track_spans(self, y, sr, spans=None):
+        """Трек PYIN по активным участкам (spans=None - весь сигнал).
+
+        HMM PYIN проходит каждый участок отдельно, а не весь файл, поэтому
+        трек совпадает с полным прогоном приближенно: границы отдельных нот
+        могут сдвинуться на кадр (см. vad.py).
+        """
+        if spans is None:
+            return self.pyin_track(y, sr)
+
+        # Только активные участки, результат раскладывается на полную сетку
+        hop_length = 512
+        n_frames = 1 + len(y) // hop_length
+        midi_notes = np.zeros(n_frames)
+        confidence = np.zeros(n_frames)
+
+        for start, stop in spans:
+            self.check_cancelled()
+            # Начало участка на сетке кадров, чтобы кадры совпали с полным прогоном
+            start = start // hop_length * hop_length
+            span_notes, _, span_confidence = self.pyin_track(y[start:stop], sr)
+            first = start // hop_length
+            count = min(len(span_notes), n_frames - first)
+            midi_notes[first:first + count] = span_notes[:count]
+            confidence[first:first + count] = span_confidence[:count]
+
+        return midi_notes, librosa.times_like(midi_notes, sr=sr, hop_length=hop_length), confidence
+
+    def detect_pitch_yin(self, y, sr):
+        """Черновое определение высоты тона: YIN по всем кадрам сразу (сетка PYIN)"""
+        fmin = librosa.note_to_hz(self.params.min_note)
+        fmax = librosa.note_to_hz(self.params.max_note)
+
+        with self.stage("yin", y) as record:
+            frequency, confidence = yin_track(y, sr, fmin * 0.9, fmax * 1.1, frame_length=2048, hop_length=512,
+                                              check=self.check_cancelled)
+            midi_notes = np.zeros_like(frequency)
+            voiced = frequency > 0
+            midi_notes[voiced] = librosa.hz_to_midi(frequency[voiced])
+            record.produced(midi_notes)
+        return midi_notes, librosa.times_like(midi_notes, sr=sr, hop_length=512), confidence
+
+    def combined_pitch_detection(self, y, sr):
+        """Комбинированный метод CREPE + PYIN"""
+        self.report("Комбинированный анализ...")
+
+        # Получаем результаты обоих методов
+        crepe_notes, crepe_times, crepe_conf = self.detect_pitch_crepe(y, sr)
+        pyin_notes, pyin_times, pyin_conf = self.detect_pitch_pyin(y, sr)
+
+        return self.fuse_tracks(crepe_notes, crepe_times, crepe_conf, pyin_notes, pyin_times, pyin_conf)
+
+    def fuse_tracks(self, crepe_notes, crepe_times, crepe_conf, pyin_notes, pyin_times, pyin_conf):
+        """Объединение треков CREPE и PYIN на временной сетке PYIN"""
+        if crepe_notes is None:
+            return pyin_notes, pyin_times, pyin_conf
+
+        with self.stage("fusion", pyin_notes):
+            # Интерполируем CREPE результаты к временной сетке PYIN
+            if len(crepe_notes) != len(pyin_notes):
+                crepe_notes_interp = np.interp(pyin_times, crepe_times, crepe_notes, left=0, right=0)
+                crepe_conf_interp = np.interp(pyin_times, crepe_times, crepe_conf, left=0, right=0)
+            else:
+                crepe_notes_interp = crepe_notes
+                crepe_conf_interp = crepe_conf
+
+            # Объединяем результаты: где оба метода дали результат - берем среднее,
+            # иначе тот, что есть
+            crepe_voiced = crepe_notes_interp > 0
+            pyin_voiced = pyin_notes > 0
+            combined_notes = np.where(crepe_voiced & pyin_voiced, (crepe_notes_interp + pyin_notes) / 2,
+                                      np.where(crepe_voiced, crepe_notes_interp,
+                                               np.where(pyin_voiced, pyin_notes, 0.0)))
+
+            return combined_notes, pyin_times, np.maximum(crepe_conf_interp, pyin_conf)
+
+    def stage_settings(self, stage, sr):
+        """Настройки, от которых зависит результат этапа (часть ключа кэша)"""
+        settings = {
+            "sr": int(sr),
+            "noise_reduction": self.params.use_noise_reduction,
+            "hpss": self.params.use_harmonic_percussive,
+        }
+        if stage in ("crepe", "pyin") and self.params.vad_gating:
+            settings.update(vad_threshold=self.active_threshold, vad_pad_seconds=self.params.vad_pad_seconds)
+        if stage == "crepe":
+            settings.update(model_capacity=self.params.crepe_model_capacity,
+                            step_size=self.params.crepe_step_size, resample_quality=self.params.resample_quality)
+            if self.params.crepe_refine:
+                settings.update(coarse_capacity=self.params.crepe_coarse_capacity,
+                                coarse_step=self.params.crepe_coarse_step,
+                                refine_window_ms=self.params.crepe_refine_window_ms)
+        elif stage in ("pyin", "yin"):
+            settings.update(fmin=self.params.min_note, fmax=self.params.max_note,
+                            frame_length=2048, hop_length=512)
+        elif stage == "rms":
+            settings.update(frame_length=2048, hop_length=512)
+        return settings
+
+    def cache_lookup(self, digest, stage, sr):
+        """(ключ, массивы) этапа из памяти сессии или дискового кэша; массивы None при промахе"""
+        if digest is None:
+            return None, None
+        key = PitchCache.make_key(digest, stage, self.stage_settings(stage, sr))
+        arrays = self.memo.get(key) if self.memo is not None else None
+        if arrays is None and self.cache is not None:
+            arrays = self.cache.get(key)
+            if arrays is not None and self.memo is not None:
+                # Копия в памяти: запись на диске может быть вытеснена
+                self.memo.put(key, {name: np.array(array) for name, array in arrays.items()})
+        if arrays is None and self.memo_only:
+            raise StageNotReady(stage)
+        return key, arrays
+
+    def cache_store(self, key, arrays):
+        if key is not None and arrays is not None:
+            if self.memo is not None:
+                self.memo.put(key, arrays)
+            if self.cache is not None:
+                # Если этап уже сам опубликовал запись, put ничего не сделает
+                self.cache.put(key, arrays)
+
+    def cached_stage(self, digest, stage, sr, compute):
+        """Результат этапа из кэша или compute() с сохранением в кэш"""
+        key, arrays = self.cache_lookup(digest, stage, sr)
+        if arrays is None:
+            arrays = compute(key)
+            self.cache_store(key, arrays)
+        else:
+            self.progress.finish(stage)
+        return arrays
+
+    def analyse(self, y, sr, gain=None, noise_profile=None, source=None):
+        """Предобработка, треки высоты тона и RMS с учетом кэша.
+
+        Возвращает (midi_notes, times, confidence, rms). При попадании в кэш
+        предобработка и детекторы не запускаются вовсе. source - AudioSource
+        исходного файла (y - его source.at_rate(sr)): без предобработки CREPE
+        получает 16 кГц прямо из него, а не повторным ресемплингом y.
+        """
+        if noise_profile is None:
+            noise_profile = self.noise_profile_for(y if gain is None else y / gain, sr)
+
+        digest = None
+        if self.cache is not None or self.memo is not None:
+            # Хэш сигнала источника считается один раз, а не при каждом предпросмотре
+            digest = source.digest(sr) if source is not None else PitchCache.audio_digest(y, sr)
+            if gain is not None or noise_profile is not None:
+                # Предобработка зависит не только от самого сигнала
+                digest = PitchCache.make_key(digest, "preprocess", {
+                    "gain": gain,
+                    "noise_profile": noise_profile.digest() if noise_profile is not None else None,
+                })
+        prepared = []
+        signal_key = None
+        if self.memo is not None and digest is not None:
+            signal_key = PitchCache.make_key(digest, "prepared", self.stage_settings("prepared", sr))
+
+        def signal():
+            """Сигнал для детекторов: предобработка только при первом обращении"""
+            if not prepared:
+                if signal_key is not None:
+                    # Другой детектор на том же сигнале - предобработка уже сделана
+                    y_memo = self.memo.get(signal_key)
+                    if y_memo is not None:
+                        return y_memo
+                prepared.append(self.preprocess_audio(y, sr, gain=gain, noise_profile=noise_profile))
+                if signal_key is not None and (self.params.use_noise_reduction
+                                               or self.params.use_harmonic_percussive):
+                    self.memo.put(signal_key, prepared[0])
+            return prepared[0]
+
+        def rms_stage(key):
+            # Во временной области по обработанному сигналу, как librosa.feature.rms
+            # до общего спектрального этапа: от нее зависит порог громкости
+            y_prepared = signal()
+            with self.stage("rms", y_prepared) as record:
+                rms = self.compute_rms(y_prepared)
+                record.produced(rms)
+            return {"rms": rms}
+
+        rms = self.cached_stage(digest, "rms", sr, rms_stage)["rms"]
+        # Порог VAD входит в ключи детекторов (stage_settings), поэтому считается до них
+        self.active_threshold = activity_threshold(rms, self.params.volume_threshold, self.params.vad_threshold)
+
+        found_spans = []
+
+        def spans():
+            """Активные участки для детекторов (None - весь сигнал)"""
+            if not self.params.vad_gating:
+                return None
+            if not found_spans:
+                found_spans.append(active_spans(rms, self.active_threshold, sr, len(y),
+                                                pad_seconds=self.params.vad_pad_seconds))
+                self.report(f"Активные участки: {voiced_fraction(found_spans[0], len(y)):.0%} записи")
+            return found_spans[0]
+
+        preprocessing = self.params.use_noise_reduction or self.params.use_harmonic_percussive
+        direct_model_rate = source is not None and not preprocessing
+        crepe_sr = MODEL_SR if direct_model_rate else sr
+
+        def crepe_input():
+            """Сигнал для CREPE и участки VAD в его отсчетах"""
+            if not direct_model_rate:
+                return signal(), spans()
+            # Нормализация не нужна: CREPE нормирует каждый кадр сам
+            found = spans()
+            if found is not None:
+                scale = MODEL_SR / sr
+                found = [(int(start * scale), int(np.ceil(stop * scale))) for start, stop in found]
+            with self.stage("resample", source.samples) as record:
+                crepe_y = source.at_rate(MODEL_SR)
+                record.produced(crepe_y)
+            return crepe_y, found
+
+        def crepe_stage(key):
+            pending = None
+            try:
+                crepe_y, crepe_spans = crepe_input()
+                with self.stage("crepe", crepe_y) as record:
+                    activation = None
+                    if key is not None and self.cache is not None:
+                        # Активации пишутся на диск по мере расчета, минуя память
+                        shape = (frame_count(len(crepe_y), crepe_sr, self.params.crepe_step_size),
+                                 ACTIVATION_BINS)
+                        pending = self.cache.open_entry(key, "activation", shape, dtype=np.float16)
+                        activation = pending.array
+                    activation, times, confidence = self.crepe_activation_track(crepe_y, crepe_sr,
+                                                                                activation_out=activation,
+                                                                                spans=crepe_spans)
+                    record.produced(activation)
+            except Exception as e:
+                if pending is not None:
+                    pending.discard()
+                if isinstance(e, ConversionCancelled):
+                    raise
+                print(f"CREPE не удался: {e}")
+                return None
+
+            result = {"activation": activation, "times": times, "confidence": confidence}
+            if pending is not None:
+                pending.commit({"times": times, "confidence": confidence})
+            return result
+
+        def pyin_stage(key):
+            midi_notes, times, confidence = self.detect_pitch_pyin(signal(), sr, spans=spans())
+            return {"midi_notes": midi_notes, "times": times, "confidence": confidence}
+
+        def yin_stage(key):
+            # Весь сигнал сразу: VAD экономил бы меньше, чем стоит нарезка
+            midi_notes, times, confidence = self.detect_pitch_yin(signal(), sr)
+            return {"midi_notes": midi_notes, "times": times, "confidence": confidence}
+
+        method = self.params.method
+
+        pyin_key, pyin_result = None, None
+        pyin_job = None
+        if method == "combined":
+            self.report("Комбинированный анализ...")
+            pyin_key, pyin_result = self.cache_lookup(digest, "pyin", sr)
+            if pyin_result is None and self.params.parallel_detectors:
+                # PYIN в рабочем процессе, пока CREPE считается здесь
+                pyin_y = signal()
+                pyin_record = self.trace.begin("pyin", pyin_y, thread="detector_pool")
+                pyin_job = submit_pyin(pyin_y, sr, self.params, spans())
+
+        crepe_result = None
+        if method in ("crepe", "combined"):
+            try:
+                crepe_result = self.cached_stage(digest, "crepe", crepe_sr, crepe_stage)
+            except BaseException as e:
+                if pyin_job is not None:
+                    # При отмене рабочий процесс останавливается, а не дорабатывает вхолостую
+                    pyin_job.cancel(terminate=isinstance(e, ConversionCancelled))
+                    self.trace.end(pyin_record, error=type(e).__name__)
+                raise
+
+        if pyin_job is not None:
+            # Слияние начинается, когда закончит более медленный детектор
+            self.report("Ожидание PYIN...")
+            try:
+                pyin_result = pyin_job.result(check=self.check_cancelled)
+            except BaseException as e:
+                if isinstance(e, ConversionCancelled):
+                    pyin_job.cancel(terminate=True)
+                self.trace.end(pyin_record, error=type(e).__name__)
+                raise
+            pyin_record.produced(pyin_result["midi_notes"])
+            self.trace.end(pyin_record)
+            self.cache_store(pyin_key, pyin_result)
+
+        yin_result = None
+        if method == "yin":
+            yin_result = self.cached_stage(digest, "yin", sr, yin_stage)
+
+        if pyin_result is None and (method in ("pyin", "combined") or (method == "crepe" and crepe_result is None)):
+            if method == "crepe":
+                self.report("CREPE не сработал, использую PYIN...")
+            pyin_result = self.cached_stage(digest, "pyin", sr, pyin_stage)
+
+        if crepe_result is not None:
+            # Витерби и порог - по сохраненным активациям, нейросеть не нужна
+            self.crepe_activation = crepe_result
+            crepe_key = None
+            if digest is not None:
+                crepe_key = PitchCache.make_key(digest, "crepe", self.stage_settings("crepe", crepe_sr))
+            crepe_notes = self.apply_crepe_confidence(self.decode_crepe(crepe_result["activation"], crepe_key),
+                                                      crepe_result["confidence"])
+
+        if method == "combined":
+            if crepe_result is None:
+                midi_notes, times, confidence = self.fuse_tracks(None, None, None, pyin_result["midi_notes"],
+                                                                 pyin_result["times"], pyin_result["confidence"])
+            else:
+                midi_notes, times, confidence = self.fuse_tracks(
+                    crepe_notes, crepe_result["times"], crepe_result["confidence"],
+                    pyin_result["midi_notes"], pyin_result["times"], pyin_result["confidence"])
+        elif crepe_result is not None:
+            midi_notes, times, confidence = crepe_notes, crepe_result["times"], crepe_result["confidence"]
+        elif yin_result is not None:
+            midi_notes, times, confidence = yin_result["midi_notes"], yin_result["times"], yin_result["confidence"]
+        else:
+            midi_notes, times, confidence = pyin_result["midi_notes"], pyin_result["times"], pyin_result["confidence"]
+
+        # Этапы, которые не понадобились благодаря кэшу, тоже пройдены
+        for name in ("normalize", "spectral", "rms", "crepe", "pyin", "yin"):
+            self.progress.finish(name)
+        return midi_notes, times, confidence, rms
+
+    def compute_rms(self, y):
+        """Энергия сигнала по кадрам (та же сетка, что у PYIN)"""
+        return librosa.feature.rms(y=y, frame_length=2048, hop_length=512)[0]
+
+    def base_velocity(self):
+        """Velocity ноты опорной громкости"""
+        return min(60 + int(40 * self.params.sensitivity), 127)
+
+    def advanced_note_processing(self, midi_notes, times, sr, y, rms=None, confidence=None):
+        """Продвинутая обработка нот. Возвращает массив NOTE_DTYPE."""
+        if len(midi_notes) == 0:
+            return as_note_array([])
+        from scipy.ndimage import median_filter, gaussian_filter1d
+
+        with self.stage("segmentation", midi_notes) as record:
+            # Вычисляем энергию сигнала для фильтрации тихих участков
+            hop_length = 512
+            if rms is None:
+                rms = self.compute_rms(y)
+
+            # Интерполируем RMS к временной сетке нот
+            if len(rms) != len(midi_notes):
+                rms_times = librosa.times_like(rms, sr=sr, hop_length=hop_length)
+                rms_interp = np.interp(times, rms_times, rms)
+            else:
+                rms_interp = rms
+
+            # Фильтрация по громкости
+            volume_threshold = self.params.volume_threshold
+            loud_enough = rms_interp > volume_threshold
+
+            # Медианная фильтрация для удаления выбросов
+            notes_clean = median_filter(midi_notes, size=5)
+
+            # Гауссово сглаживание
+            notes_smooth = gaussian_filter1d(notes_clean, sigma=2)
+
+            # Квантование к полутонам
+            notes_quantized = np.round(notes_smooth)
+
+            # Применяем фильтр громкости
+            notes_quantized[~loud_enough] = 0
+
+            # Создаем ноты; velocity - по громкости каждой ноты
+            notes = segment_note_array(notes_quantized, times, self.params.min_note_duration,
+                                       rms=rms_interp, confidence=confidence,
+                                       base_velocity=self.base_velocity())
+            record.produced(notes)
+        return notes
+
+    def transcribe(self, y, sr, gain=None, noise_profile=None, source=None):
+        """Полный анализ сигнала: предобработка, высота тона, ноты"""
+        planned_here = not self.progress.active
+        if planned_here:
+            self.progress.plan(self.planned_stages(), len(y) / sr)
+        try:
+            midi_notes, times, confidence, rms = self.analyse(y, sr, gain=gain, noise_profile=noise_profile,
+                                                              source=source)
+
+            if midi_notes is None or len(midi_notes) == 0:
+                raise ConversionError("Не удалось определить высоту тона в аудио")
+
+            # Продвинутая обработка нот
+            notes = self.advanced_note_processing(midi_notes, times, sr, None, rms=rms, confidence=confidence)
+        finally:
+            if planned_here:
+                self.progress.reset()
+
+        if len(notes) == 0:
+            raise ConversionError("Не удалось извлечь ноты из аудио")
+
+        return notes
+
+    def playable_notes(self, notes):
+        """Ноты в диапазоне настроек со сдвинутым началом - то, что попадет в MIDI.
+
+        notes - массив NOTE_DTYPE или список (pitch, start, end).
+        """
+        notes = as_note_array(notes, velocity=self.base_velocity())
+        with self.stage("midi", notes) as record:
+            min_midi = librosa.note_to_midi(self.params.min_note)
+            max_midi = librosa.note_to_midi(self.params.max_note)
+            playable = notes[(notes["pitch"] >= min_midi) & (notes["pitch"] <= max_midi)]
+
+            # Небольшая коррекция времени
+            playable["onset"] = np.maximum(0, playable["onset"] - 0.02)
+            record.produced(playable)
+        return playable
+
+    def build_midi(self, notes):
+        """Объект PrettyMIDI из нот (для правки в коде; файл пишет write_midi)"""
+        import pretty_midi
+        playable = self.playable_notes(notes)
+        midi_data = pretty_midi.PrettyMIDI()
+        instrument = pretty_midi.Instrument(program=self.params.instrument_program)
+        instrument.notes.extend(
+            pretty_midi.Note(velocity=velocity, pitch=pitch, start=start, end=end)
+            for pitch, start, end, velocity in zip(playable["pitch"].tolist(), playable["onset"].tolist(),
+                                                   playable["offset"].tolist(), playable["velocity"].tolist())
+        )
+        midi_data.instruments.append(instrument)
+        return midi_data
+
+    def convert_source(self, source, output_path=None):
+        """Ноты уже декодированного сигнала: (все ноты, ноты для MIDI).
+
+        output_path - куда записать MIDI-файл; None - только вернуть ноты
+        (сервер заданий отдает их клиенту сам).
+        """
+        sr = self.params.sample_rate
+        with self.stage("resample", source.samples) as record:
+            y = source.at_rate(sr)
+            record.produced(y)
+
+        self.progress.plan(self.planned_stages(write_midi=output_path is not None), len(y) / sr)
+        try:
+            notes = self.transcribe(y, sr, source=source)
+            playable = self.playable_notes(notes)
+
+            # Сохраняем MIDI-файл
+            if output_path is not None:
+                with self.stage("midi_write", playable):
+                    write_midi(output_path, playable, self.params.instrument_program)
+
+            self.progress.learn(self.trace.records)
+        finally:
+            self.progress.reset()
+        return notes, playable
+
+    def convert(self, input_path, output_path):
+        """Конвертирует аудиофайл в MIDI-файл"""
+        started = time.perf_counter()
+        self.trace = StageTrace()
+
+        source = self.open_source(input_path)
+        notes, _ = self.convert_source(source, output_path)
+
+        self.update_progress(100, "Конвертация завершена!")
+
+        return ConversionResult(
+            input_path=str(input_path),
+            output_path=str(output_path),
+            note_count=len(notes),
+            audio_duration=source.duration,
+            elapsed=time.perf_counter() - started,
+            stages=self.trace.records,
+        )
+
+    def preview(self, input_path):
+        """Ноты файла только из уже посчитанных этапов - без детекторов и записи MIDI.
+
+        Для предпросмотра при движении ползунков: годится, когда менялись
+        только параметры нот. None - нужна полная конвертация.
+        """
+        self.memo_only = True
+        try:
+            source = self.open_source(input_path)
+            sr = self.params.sample_rate
+            return self.transcribe(source.at_rate(sr), sr, source=source)
+        except StageNotReady:
+            return None
+        except ConversionError:
+            return []
+        finally:
+            self.memo_only = False
@@ -0,0 +1,262 @@
+"""Замеры этапов конвейера: время, память, размеры данных.
+
+Каждый этап конвертации (декодирование, нормализация, шумоподавление,
+HPSS, детекторы, слияние, RMS, сегментация, запись MIDI) оборачивается
+в ``StageTrace.stage``. Запись этапа хранит время по часам и процессорное
+время всего процесса за этап, размеры входа и выхода (число элементов) и
+изменение RSS процесса.
+Записи выгружаются в JSON Lines и в формат Chrome Trace (chrome://tracing,
+Perfetto).
+
+``ProgressModel`` считает процент готовности по ожидаемой длительности
+этапов, а ожидания уточняет по реальным замерам прошлых запусков.
+"""
+import cProfile
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass, asdict, field
+
+
+# Начальная оценка: секунд счета на секунду аудио на одном ядре
+DEFAULT_STAGE_COSTS = {
+    "decode": 0.003,
+    "normalize": 0.0005,
+    "spectral": 0.045,
+    "rms": 0.001,
+    "resample": 0.002,
+    "crepe": 0.3,
+    "viterbi": 0.003,
+    "pyin": 0.15,
+    "yin": 0.005,
+    "fusion": 0.0005,
+    "segmentation": 0.002,
+    "midi": 0.001,
+    "midi_write": 0.001,
+}
+# Вес нового замера при уточнении оценки (скользящее среднее)
+LEARNING_RATE = 0.3
+
+# Оценки, общие для всех запусков процесса без файла замеров
+_session_costs = dict(DEFAULT_STAGE_COSTS)
+
+
+def current_rss():
+    """Текущий RSS процесса в байтах (0, если узнать нельзя)"""
+    try:
+        import psutil
+        return psutil.Process().memory_info().rss
+    except ImportError:
+        pass
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        return 0
+
+
+def data_size(value):
+    """Размер данных этапа: число элементов массива или длина списка"""
+    if value is None:
+        return None
+    size = getattr(value, "size", None)
+    if isinstance(size, int):
+        return size
+    try:
+        return len(value)
+    except TypeError:
+        return None
+
+
+@dataclass
+class StageRecord:
+    """Замер одного этапа"""
+    name: str
+    start: float  # время начала, с (Unix time)
+    wall: float = 0.0
+    # Процессорное время всего процесса (time.process_time), а не потока этапа:
+    # туда входят его рабочие потоки (блоки шумоподавления, пакеты CREPE), но и
+    # этапы, идущие в это время параллельно. Рабочий процесс PYIN не входит
+    process_cpu: float = 0.0
+    input_size: int = None
+    output_size: int = None
+    rss_before: int = 0
+    rss_after: int = 0
+    thread: str = "main"
+    error: str = ""
+    # Отсчеты часов в начале этапа (для end), в выгрузку не попадают
+    wall_started: float = field(default=0.0, repr=False)
+    cpu_started: float = field(default=0.0, repr=False)
+
+    @property
+    def memory_delta(self):
+        return self.rss_after - self.rss_before
+
+    def produced(self, value):
+        """Отмечает результат этапа (для размера выхода)"""
+        self.output_size = data_size(value)
+
+    def to_dict(self):
+        data = asdict(self)
+        del data["wall_started"], data["cpu_started"]
+        data["memory_delta"] = self.memory_delta
+        return data
+
+
+class StageTrace:
+    """Замеры этапов одного запуска"""
+
+    def __init__(self):
+        self.records = []
+        self._origin = time.perf_counter()
+        self._epoch = time.time()
+        self._lock = threading.Lock()
+
+    def begin(self, name, data=None, thread="main"):
+        """Начало этапа, который завершается в другом месте (фоновый детектор)"""
+        started = time.perf_counter()
+        return StageRecord(name, self._epoch + started - self._origin, input_size=data_size(data),
+                           rss_before=current_rss(), thread=thread, wall_started=started,
+                           cpu_started=time.process_time())
+
+    def end(self, record, error=""):
+        record.wall = time.perf_counter() - record.wall_started
+        record.process_cpu = time.process_time() - record.cpu_started
+        record.rss_after = current_rss()
+        record.error = error
+        with self._lock:
+            self.records.append(record)
+
+    @contextmanager
+    def stage(self, name, data=None, thread="main"):
+        record = self.begin(name, data, thread)
+        try:
+            yield record
+        except BaseException as e:
+            self.end(record, error=type(e).__name__)
+            raise
+        self.end(record)
+
+    def totals(self):
+        """Суммарное время по этапам, с"""
+        totals = {}
+        for record in self.records:
+            totals[record.name] = totals.get(record.name, 0.0) + record.wall
+        return totals
+
+
+def write_jsonl(path, runs):
+    """Замеры в JSON Lines. runs - список (метка запуска, записи)"""
+    with open(path, "a", encoding="utf-8") as f:
+        for label, records in runs:
+            for record in records:
+                f.write(json.dumps(dict(record.to_dict(), run=label), ensure_ascii=False) + "\n")
+
+
+def write_chrome_trace(path, runs):
+    """Замеры в формате Chrome Trace: запуск - процесс, поток этапа - поток"""
+    starts = [record.start for _, records in runs for record in records]
+    origin = min(starts) if starts else 0.0
+    events = []
+    for pid, (label, records) in enumerate(runs, 1):
+        events.append({"name": "process_name", "ph": "M", "pid": pid, "args": {"name": label}})
+        threads = {}
+        for record in records:
+            if record.thread not in threads:
+                threads[record.thread] = len(threads) + 1
+                events.append({"name": "thread_name", "ph": "M", "pid": pid, "tid": threads[record.thread],
+                               "args": {"name": record.thread}})
+            events.append({
+                "name": record.name,
+                "ph": "X",
+                "ts": (record.start - origin) * 1e6,
+                "dur": record.wall * 1e6,
+                "pid": pid,
+                "tid": threads[record.thread],
+                "args": {key: value for key, value in record.to_dict().items()
+                         if key not in ("name", "start", "wall", "thread")},
+            })
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f, ensure_ascii=False)
+
+
+@contextmanager
+def profiled(path):
+    """cProfile всего, что выполняется внутри, со сбросом статистики в path"""
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield profiler
+    finally:
+        profiler.disable()
+        profiler.dump_stats(path)
+
+
+class ProgressModel:
+    """Процент готовности по ожидаемой длительности запланированных этапов.
+
+    path - JSON с оценками, уточненными прошлыми запусками; без него оценки
+    живут только в памяти процесса.
+    """
+
+    def __init__(self, path=None):
+        self.path = path
+        self.costs = _session_costs
+        if path:
+            self.costs = dict(DEFAULT_STAGE_COSTS)
+            try:
+                with open(path, encoding="utf-8") as f:
+                    self.costs.update({name: float(cost) for name, cost in json.load(f).items()})
+            except (OSError, ValueError, AttributeError):
+                pass
+        self.reset()
+
+    @property
+    def active(self):
+        return bool(self.expected)
+
+    def reset(self):
+        self.expected = {}
+        self.finished = set()
+        self.duration = 0.0
+        self.low, self.high = 0.0, 100.0
+
+    def plan(self, stages, duration, low=0.0, high=100.0):
+        """Этапы предстоящего запуска для аудио длительностью duration, с.
+
+        low/high - участок шкалы, который занимают эти этапы (остальное
+        отсчитывает вызывающий, например пул фрагментов).
+        """
+        self.duration = max(duration, 1e-3)
+        self.expected = {name: self.costs.get(name, 0.001) * self.duration for name in stages}
+        self.finished = set()
+        self.low, self.high = low, high
+
+    def finish(self, name):
+        """Этап выполнен или пропущен (например, взят из кэша)"""
+        self.finished.add(name)
+
+    def percent(self):
+        total = sum(self.expected.values())
+        if total <= 0:
+            return self.low
+        done = sum(cost for name, cost in self.expected.items() if name in self.finished)
+        return self.low + (self.high - self.low) * done / total
+
+    def learn(self, records):
+        """Уточняет оценки по замерам этапов основного потока"""
+        if not self.active:
+            return
+        for record in records:
+            if record.name in self.expected and record.thread == "main" and not record.error:
+                observed = record.wall / self.duration
+                self.costs[record.name] = (1 - LEARNING_RATE) * self.costs.get(record.name, observed) \
+                    + LEARNING_RATE * observed
+        if self.path:
+            try:
+                with open(self.path, "w", encoding="utf-8") as f:
+                    json.dump(self.costs, f, indent=1)
+            except OSError as e:
+                print(f"Не удалось сохранить замеры этапов: {e}")
@@ -0,0 +1,627 @@
+"""Локальный сервер заданий конвертации (HTTP на 127.0.0.1).
+
+Рабочие процессы запускаются один раз и держат загруженными CREPE с
+TensorFlow, librosa и память этапов (StageMemo), поэтому каждое задание
+платит только за свой анализ. Задания идут по приоритету, одновременно
+выполняется не больше -j; когда очередь заполнена, сервер отвечает 503 с
+Retry-After, и клиент решает сам, ждать или нет.
+
+API (ответы - JSON):
+    POST   /jobs                      {"path": ..., "params": {...}, "priority": 0}
+    POST   /jobs?sample_rate=16000&format=s16le&priority=5&params={...}
+                                      тело - сырой моно PCM (s16le или f32le)
+    GET    /jobs                      состояния всех заданий
+    GET    /jobs/<id>                 состояние: queued/running/done/failed/cancelled,
+                                      процент, сообщение этапа, место в очереди
+    GET    /jobs/<id>/midi            готовый MIDI-файл
+    GET    /jobs/<id>/notes           ноты; ?format=npy - массив NOTE_DTYPE в формате .npy
+    DELETE /jobs/<id>                 отмена (в очереди - сразу, в работе - на ближайшей проверке)
+    GET    /health                    процессы, длина очереди
+
+Пример:
+    python job_server.py -j 4 --cache-dir cache/
+    curl -X POST localhost:8765/jobs -d '{"path": "/data/take.wav", "priority": 1}'
+"""
+import argparse
+import heapq
+import io
+import itertools
+import json
+import multiprocessing
+import os
+import sys
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from dataclasses import dataclass, field
+from functools import partial
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+
+from audio_frontend import AudioSource
+from batch_convert import add_params_arguments, limit_worker_threads, params_from_args, warm_worker
+from engine import CancelToken, ConversionCancelled, ConversionError, ConversionParams, VocalToMIDIEngine, PITCH_METHODS
+from live_convert import PCM_FORMATS
+from midi_writer import encode_smf
+from segmentation import NOTE_DTYPE
+from stage_memo import StageMemo
+
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8765
+DEFAULT_URL = f"http://{DEFAULT_HOST}:{DEFAULT_PORT}"
+MAX_QUEUE = 64
+# Сколько завершенных заданий (с их MIDI и нотами) помнит сервер
+KEEP_FINISHED = 256
+MAX_BODY_MB = 512
+RETRY_AFTER_SECONDS = 2
+# Память этапов каждого рабочего процесса (повторные задания по тому же звуку)
+WORKER_MEMO_MB = 512
+# Кольцо флагов отмены заданий, которые уже выполняются
+CANCEL_SLOTS = 4096
+POLL_SECONDS = 0.2
+
+QUEUED, RUNNING, DONE, FAILED, CANCELLED = "queued", "running", "done", "failed", "cancelled"
+FINISHED_STATES = (DONE, FAILED, CANCELLED)
+# Параметры, которые задает сервер, а не клиент
+SERVER_PARAMS = ("cache_dir", "cache_max_mb", "parallel_detectors")
+
+
+class QueueFull(Exception):
+    """Очередь заданий заполнена"""
+
+
+class ServerBusy(ConversionError):
+    """Сервер не принял задание: очередь заполнена"""
+
+    def __init__(self, message, retry_after=RETRY_AFTER_SECONDS):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+# Состояние рабочего процесса (задается инициализатором пула)
+_progress_queue = None
+_cancelled = None
+_memo = None
+
+
+def init_worker(params_dict, progress_queue, cancelled):
+    """Инициализатор рабочего процесса: канал прогресса, флаги отмены, прогрев модели"""
+    global _progress_queue, _cancelled, _memo
+    _progress_queue = progress_queue
+    _cancelled = cancelled
+    _memo = StageMemo(WORKER_MEMO_MB * 1024 ** 2)
+    warm_worker(params_dict)
+
+
+class JobCancelToken(CancelToken):
+    """Флаг отмены задания: сервер выставляет его в общей памяти"""
+
+    def __init__(self, job_id):
+        super().__init__()
+        self.job_id = job_id
+
+    def check(self):
+        if _cancelled is not None and _cancelled[self.job_id % CANCEL_SLOTS] == self.job_id:
+            self.cancel()
+        super().check()
+
+
+def pcm_samples(data, sample_format="f32le"):
+    """Сырые моно-отсчеты в float32"""
+    dtype = PCM_FORMATS[sample_format]
+    samples = np.frombuffer(data, dtype=dtype)
+    if dtype.kind == "i":
+        samples = samples / 32768.0
+    return samples.astype(np.float32)
+
+
+def run_job(job_id, params_dict, path=None, pcm=None, sample_rate=0, sample_format="f32le"):
+    """Задача рабочего процесса: ноты и MIDI одного задания"""
+    started = time.perf_counter()
+    params = ConversionParams.from_dict(params_dict)
+
+    def progress(value, message):
+        if _progress_queue is not None:
+            _progress_queue.put((job_id, value, message))
+
+    engine = VocalToMIDIEngine(params, progress, JobCancelToken(job_id), _memo)
+    if path is not None:
+        source = engine.open_source(path)
+    else:
+        source = AudioSource(pcm_samples(pcm, sample_format), sample_rate, params.resample_quality)
+    notes, playable = engine.convert_source(source)
+    return {
+        "notes": playable,
+        "midi": encode_smf(playable, params.instrument_program),
+        "note_count": len(notes),
+        "audio_duration": source.duration,
+        "elapsed": time.perf_counter() - started,
+        "stages": [record.to_dict() for record in engine.trace.records],
+    }
+
+
+@dataclass
+class Job:
+    """Задание и его состояние"""
+    id: int
+    priority: int
+    params: dict
+    path: str = None
+    pcm: bytes = None
+    sample_rate: int = 0
+    sample_format: str = "f32le"
+    state: str = QUEUED
+    submitted: float = field(default_factory=time.time)
+    started: float = None
+    finished: float = None
+    progress: float = 0.0
+    message: str = ""
+    error: str = ""
+    result: dict = None
+
+    def status(self, position=None):
+        status = {
+            "id": self.id,
+            "state": self.state,
+            "priority": self.priority,
+            "source": self.path if self.path is not None else "pcm",
+            "submitted": self.submitted,
+            "started": self.started,
+            "finished": self.finished,
+            "progress": self.progress,
+            "message": self.message,
+            "error": self.error,
+        }
+        if position is not None:
+            status["position"] = position
+        if self.result is not None:
+            for name in ("note_count", "audio_duration", "elapsed", "stages"):
+                status[name] = self.result[name]
+        return status
+
+
+class JobServer:
+    """Очередь заданий с приоритетами над пулом прогретых рабочих процессов.
+
+    Больше workers заданий одновременно не выполняется, больше max_queue
+    ждущих не принимается (QueueFull). Из ждущих первым идет задание с
+    большим приоритетом, при равном - раньше поданное.
+    """
+
+    def __init__(self, params=None, workers=1, max_queue=MAX_QUEUE, keep_finished=KEEP_FINISHED):
+        self.params = params or ConversionParams()
+        self.workers = max(1, workers)
+        self.max_queue = max_queue
+        self.keep_finished = keep_finished
+        self._cond = threading.Condition()
+        self._heap = []
+        self._jobs = OrderedDict()
+        self._ids = itertools.count(1)
+        self._queued = 0
+        self._running = 0
+        self._stopping = False
+
+        # spawn: TensorFlow плохо переносит fork после инициализации
+        self._context = multiprocessing.get_context("spawn")
+        self._progress = self._context.Queue()
+        self._cancelled = self._context.Array("q", CANCEL_SLOTS, lock=False)
+        self._pool = self._new_pool()
+        self._threads = [threading.Thread(target=self._dispatch, daemon=True),
+                         threading.Thread(target=self._listen_progress, daemon=True)]
+
+    def _new_pool(self):
+        return ProcessPoolExecutor(max_workers=self.workers, mp_context=self._context, initializer=init_worker,
+                                   initargs=(self.params.to_dict(), self._progress, self._cancelled))
+
+    def start(self, warm=True):
+        """Запускает очередь; warm - дождаться запуска и прогрева всех процессов"""
+        if warm:
+            for future in [self._pool.submit(int) for _ in range(self.workers)]:
+                future.result()
+        for thread in self._threads:
+            thread.start()
+
+    def close(self):
+        with self._cond:
+            self._stopping = True
+            self._cond.notify_all()
+        self._progress.put(None)
+        self._pool.shutdown(cancel_futures=True)
+
+    def job_params(self, overrides=None):
+        """Параметры задания: параметры сервера с поправками клиента"""
+        params = self.params.to_dict()
+        overrides = dict(overrides or {})
+        preset = overrides.pop("preset", None)
+        for name, value in overrides.items():
+            if name in params and name not in SERVER_PARAMS:
+                params[name] = value
+        if params["method"] not in PITCH_METHODS:
+            raise ValueError(f"Неизвестный метод: {params['method']}")
+        if preset:
+            return ConversionParams.from_dict(params).with_preset(preset).to_dict()
+        return params
+
+    def submit(self, params=None, priority=0, path=None, pcm=None, sample_rate=0, sample_format="f32le"):
+        """Ставит задание в очередь и возвращает его состояние"""
+        if (path is None) == (pcm is None):
+            raise ValueError("Нужен либо путь к файлу, либо PCM")
+        if pcm is not None:
+            if sample_format not in PCM_FORMATS:
+                raise ValueError(f"Неизвестный формат PCM: {sample_format}")
+            if sample_rate <= 0 or len(pcm) % PCM_FORMATS[sample_format].itemsize:
+                raise ValueError("Неверная частота дискретизации или длина PCM")
+        params_dict = self.job_params(params)
+        with self._cond:
+            if self._stopping:
+                raise QueueFull("Сервер останавливается")
+            if self._queued >= self.max_queue:
+                raise QueueFull(f"Очередь заполнена ({self._queued} заданий)")
+            job = Job(next(self._ids), int(priority), params_dict, path, pcm, int(sample_rate), sample_format)
+            self._jobs[job.id] = job
+            heapq.heappush(self._heap, (-job.priority, job.id))
+            self._queued += 1
+            self._cond.notify_all()
+            return job.status(self._position(job))
+
+    def cancel(self, job_id):
+        """Отменяет задание. KeyError - такого задания нет."""
+        with self._cond:
+            job = self._jobs[job_id]
+            if job.state == QUEUED:
+                job.state = CANCELLED
+                job.finished = time.time()
+                job.pcm = None
+                self._queued -= 1
+            elif job.state == RUNNING:
+                self._cancelled[job_id % CANCEL_SLOTS] = job_id
+                job.message = "Отмена..."
+            return job.status(self._position(job))
+
+    def status(self, job_id):
+        with self._cond:
+            job = self._jobs[job_id]
+            return job.status(self._position(job))
+
+    def statuses(self):
+        with self._cond:
+            return [job.status(self._position(job)) for job in self._jobs.values()]
+
+    def result(self, job_id):
+        """Итог выполненного задания или None, если оно еще не готово"""
+        with self._cond:
+            return self._jobs[job_id].result
+
+    def health(self):
+        with self._cond:
+            return {"workers": self.workers, "running": self._running, "queued": self._queued,
+                    "max_queue": self.max_queue}
+
+    def _position(self, job):
+        """Сколько ждущих заданий пойдет раньше этого (None - задание не в очереди)"""
+        if job.state != QUEUED:
+            return None
+        key = (-job.priority, job.id)
+        return sum(1 for entry in self._heap if entry < key and self._jobs[entry[1]].state == QUEUED)
+
+    def _dispatch(self):
+        while True:
+            with self._cond:
+                while not self._stopping and (self._running >= self.workers or not self._heap):
+                    self._cond.wait()
+                if self._stopping:
+                    return
+                _, job_id = heapq.heappop(self._heap)
+                job = self._jobs.get(job_id)
+                if job is None or job.state != QUEUED:
+                    continue
+                job.state = RUNNING
+                job.started = time.time()
+                job.message = "Запуск..."
+                self._queued -= 1
+                self._running += 1
+                pool = self._pool
+            try:
+                future = pool.submit(run_job, job.id, job.params, job.path, job.pcm, job.sample_rate,
+                                     job.sample_format)
+            except BrokenProcessPool as e:
+                self._restart_pool(pool)
+                self._finish(job, pool, None, e)
+            else:
+                future.add_done_callback(partial(self._finish_future, job, pool))
+
+    def _finish_future(self, job, pool, future):
+        self._finish(job, pool, future.result() if future.exception() is None else None, future.exception())
+
+    def _finish(self, job, pool, result, error):
+        with self._cond:
+            self._running -= 1
+            job.finished = time.time()
+            job.pcm = None
+            if error is None:
+                job.state = DONE
+                job.result = result
+                job.progress = 100.0
+                job.message = "Конвертация завершена!"
+            elif isinstance(error, ConversionCancelled):
+                job.state = CANCELLED
+                job.message = str(error)
+            else:
+                job.state = FAILED
+                job.error = str(error) or type(error).__name__
+            self._forget_finished()
+            self._cond.notify_all()
+        if isinstance(error, BrokenProcessPool):
+            self._restart_pool(pool)
+
+    def _restart_pool(self, broken):
+        """Пул с упавшим процессом заменяется новым (один раз на поломку)"""
+        with self._cond:
+            if self._pool is not broken or self._stopping:
+                return
+            print("Рабочий процесс завершился аварийно, пул перезапускается", file=sys.stderr)
+            self._pool = self._new_pool()
+        broken.shutdown(wait=False)
+
+    def _forget_finished(self):
+        finished = [job_id for job_id, job in self._jobs.items() if job.state in FINISHED_STATES]
+        for job_id in finished[:max(0, len(finished) - self.keep_finished)]:
+            del self._jobs[job_id]
+
+    def _listen_progress(self):
+        while True:
+            item = self._progress.get()
+            if item is None:
+                return
+            job_id, value, message = item
+            with self._cond:
+                job = self._jobs.get(job_id)
+                if job is not None and job.state == RUNNING:
+                    job.progress = value
+                    job.message = message
+
+
+def notes_npy(notes):
+    """Массив нот в байтах формата .npy"""
+    buffer = io.BytesIO()
+    np.save(buffer, notes, allow_pickle=False)
+    return buffer.getvalue()
+
+
+class JobRequestHandler(BaseHTTPRequestHandler):
+    """HTTP-интерфейс к JobServer (self.server.jobs)"""
+    server_version = "mpdi-jobs/1.0"
+
+    def log_message(self, format, *args):
+        # Опрос состояния идет часто - в журнал только изменения
+        if self.command != "GET":
+            super().log_message(format, *args)
+
+    def send_bytes(self, code, data, content_type, headers=None):
+        self.send_response(code)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def send_json(self, code, payload, headers=None):
+        self.send_bytes(code, json.dumps(payload, ensure_ascii=False).encode("utf-8"),
+                        "application/json; charset=utf-8", headers)
+
+    def route(self):
+        """(части пути, параметры запроса)"""
+        url = urllib.parse.urlsplit(self.path)
+        parts = [part for part in url.path.split("/") if part]
+        return parts, {name: values[-1] for name, values in urllib.parse.parse_qs(url.query).items()}
+
+    def handle_errors(self, handler):
+        try:
+            handler()
+        except KeyError:
+            self.send_json(404, {"error": "Задание не найдено"})
+        except QueueFull as e:
+            self.send_json(503, {"error": str(e)}, {"Retry-After": str(RETRY_AFTER_SECONDS)})
+        except (ValueError, TypeError) as e:
+            self.send_json(400, {"error": str(e)})
+
+    def do_GET(self):
+        self.handle_errors(self.get)
+
+    def do_POST(self):
+        self.handle_errors(self.post)
+
+    def do_DELETE(self):
+        self.handle_errors(self.delete)
+
+    def get(self):
+        parts, query = self.route()
+        jobs = self.server.jobs
+        if parts == ["health"]:
+            self.send_json(200, jobs.health())
+        elif parts == ["jobs"]:
+            self.send_json(200, jobs.statuses())
+        elif len(parts) == 2 and parts[0] == "jobs":
+            self.send_json(200, jobs.status(int(parts[1])))
+        elif len(parts) == 3 and parts[0] == "jobs" and parts[2] in ("midi", "notes"):
+            job_id = int(parts[1])
+            result = jobs.result(job_id)
+            if result is None:
+                self.send_json(409, {"error": "Задание еще не выполнено", "status": jobs.status(job_id)})
+            elif parts[2] == "midi":
+                self.send_bytes(200, result["midi"], "audio/midi")
+            elif query.get("format") == "npy":
+                self.send_bytes(200, notes_npy(result["notes"]), "application/octet-stream")
+            else:
+                notes = result["notes"]
+                self.send_json(200, {"fields": list(notes.dtype.names), "notes": notes.tolist()})
+        else:
+            self.send_json(404, {"error": "Неизвестный адрес"})
+
+    def post(self):
+        parts, query = self.route()
+        if parts != ["jobs"]:
+            self.send_json(404, {"error": "Неизвестный адрес"})
+            return
+        length = int(self.headers.get("Content-Length") or 0)
+        if length > MAX_BODY_MB * 1024 ** 2:
+            self.send_json(413, {"error": f"Тело запроса больше {MAX_BODY_MB} МБ"})
+            return
+        body = self.rfile.read(length)
+
+        if self.headers.get("Content-Type", "").startswith("application/json"):
+            request = json.loads(body.decode("utf-8") or "{}")
+            path = request.get("path")
+            if not path or not os.path.isfile(path):
+                raise ValueError(f"Файл не найден: {path}")
+            status = self.server.jobs.submit(request.get("params"), request.get("priority", 0),
+                                             path=os.path.abspath(path))
+        else:
+            status = self.server.jobs.submit(json.loads(query.get("params", "{}")), int(query.get("priority", 0)),
+                                             pcm=body, sample_rate=int(query.get("sample_rate", 0)),
+                                             sample_format=query.get("format", "f32le"))
+        self.send_json(202, status)
+
+    def delete(self):
+        parts, _ = self.route()
+        if len(parts) != 2 or parts[0] != "jobs":
+            self.send_json(404, {"error": "Неизвестный адрес"})
+            return
+        self.send_json(200, self.server.jobs.cancel(int(parts[1])))
+
+
+def make_http_server(jobs, host=DEFAULT_HOST, port=DEFAULT_PORT):
+    """HTTP-сервер над очередью заданий (serve_forever запускает вызывающий)"""
+    httpd = ThreadingHTTPServer((host, port), JobRequestHandler)
+    httpd.daemon_threads = True
+    httpd.jobs = jobs
+    return httpd
+
+
+class JobClient:
+    """Клиент сервера заданий (GUI, скрипты)"""
+
+    def __init__(self, url=DEFAULT_URL, timeout=30.0):
+        self.url = url.rstrip("/")
+        self.timeout = timeout
+
+    def request(self, method, path, body=None, content_type=None):
+        """Байты ответа; ошибки сервера - ConversionError/ServerBusy"""
+        request = urllib.request.Request(self.url + path, data=body, method=method)
+        if content_type is not None:
+            request.add_header("Content-Type", content_type)
+        try:
+            with urllib.request.urlopen(request, timeout=self.timeout) as response:
+                return response.read()
+        except urllib.error.HTTPError as e:
+            try:
+                message = json.loads(e.read().decode("utf-8"))["error"]
+            except (ValueError, KeyError):
+                message = f"HTTP {e.code}"
+            if e.code == 503:
+                raise ServerBusy(message, int(e.headers.get("Retry-After") or RETRY_AFTER_SECONDS)) from None
+            raise ConversionError(f"Сервер заданий: {message}") from None
+        except urllib.error.URLError as e:
+            raise ConversionError(f"Сервер заданий недоступен ({self.url}): {e.reason}") from None
+
+    def request_json(self, method, path, payload=None):
+        body = None if payload is None else json.dumps(payload).encode("utf-8")
+        return json.loads(self.request(method, path, body, "application/json").decode("utf-8"))
+
+    def submit_file(self, path, params=None, priority=0):
+        """Ставит в очередь файл (путь на этой же машине); возвращает номер задания"""
+        payload = {"path": os.path.abspath(path), "params": params or {}, "priority": priority}
+        return self.request_json("POST", "/jobs", payload)["id"]
+
+    def submit_pcm(self, samples, sample_rate, params=None, priority=0):
+        """Ставит в очередь моно-сигнал; возвращает номер задания"""
+        query = urllib.parse.urlencode({"sample_rate": int(sample_rate), "format": "f32le", "priority": priority,
+                                        "params": json.dumps(params or {})})
+        body = np.ascontiguousarray(samples, dtype="<f4").tobytes()
+        response = self.request("POST", f"/jobs?{query}", body, "application/octet-stream")
+        return json.loads(response.decode("utf-8"))["id"]
+
+    def status(self, job_id):
+        return self.request_json("GET", f"/jobs/{job_id}")
+
+    def cancel(self, job_id):
+        return self.request_json("DELETE", f"/jobs/{job_id}")
+
+    def midi(self, job_id):
+        """Байты MIDI-файла выполненного задания"""
+        return self.request("GET", f"/jobs/{job_id}/midi")
+
+    def notes(self, job_id):
+        """Ноты выполненного задания (массив NOTE_DTYPE)"""
+        notes = np.load(io.BytesIO(self.request("GET", f"/jobs/{job_id}/notes?format=npy")), allow_pickle=False)
+        return notes.astype(NOTE_DTYPE, copy=False)
+
+    def wait(self, job_id, poll_seconds=POLL_SECONDS, on_status=None, check=None):
+        """Ждет завершения задания и возвращает его состояние.
+
+        on_status(status) вызывается при каждом опросе; check - проверка
+        отмены (ConversionCancelled отменяет задание и на сервере).
+        """
+        while True:
+            status = self.status(job_id)
+            if on_status is not None:
+                on_status(status)
+            if status["state"] == DONE:
+                return status
+            if status["state"] == FAILED:
+                raise ConversionError(status["error"])
+            if status["state"] == CANCELLED:
+                raise ConversionCancelled("Конвертация отменена")
+            if check is not None:
+                try:
+                    check()
+                except ConversionCancelled:
+                    self.cancel(job_id)
+                    raise
+            time.sleep(poll_seconds)
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Локальный сервер заданий конвертации вокала в MIDI")
+    parser.add_argument("--host", default=DEFAULT_HOST, help="адрес (по умолчанию только эта машина)")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT, help="порт HTTP")
+    parser.add_argument("-j", "--jobs", type=int, default=1, help="число рабочих процессов")
+    parser.add_argument("--max-queue", type=int, default=MAX_QUEUE,
+                        help="сколько заданий может ждать в очереди (дальше - ответ 503)")
+    parser.add_argument("--keep-finished", type=int, default=KEEP_FINISHED,
+                        help="сколько завершенных заданий хранить для выдачи результата")
+    add_params_arguments(parser)
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    jobs = max(1, args.jobs)
+    limit_worker_threads(jobs)
+
+    server = JobServer(params_from_args(args), jobs, args.max_queue, args.keep_finished)
+    print(f"Запуск {jobs} рабочих процессов...", file=sys.stderr)
+    server.start()
+    httpd = make_http_server(server, args.host, args.port)
+    print(f"Сервер заданий: http://{args.host}:{args.port} ({jobs} процессов, очередь до {args.max_queue})",
+          file=sys.stderr)
+    try:
+        httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        httpd.server_close()
+        server.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,308 @@
+"""Живой ввод: ноты из потока PCM в реальном времени.
+
+Источник - stdin, именованный канал, TCP-сокет или WAV-файл, проигрываемый
+в темпе реального времени (для проверки). Высота тона считается по кадрам
+по мере поступления блоков (YIN или CREPE без Витерби), сглаживание
+причинное (медиана последних кадров), а сегментация - автомат
+``NoteSegmenter``, который объявляет ноту, как только она продержалась
+несколько кадров. События печатаются строками JSON.
+
+Встроенный измеритель задержки считает для каждого события время от
+прихода блока с решающим отсчетом (начало или конец ноты) до выдачи
+события. Цель - меньше 100 мс.
+
+Примеры:
+    python live_convert.py --wav take.wav -o take.mid
+    arecord -f S16_LE -r 16000 -c 1 | python live_convert.py --stdin
+    python live_convert.py --listen 0.0.0.0:5000 --format f32le
+"""
+import argparse
+import json
+import socket
+import sys
+import time
+from collections import deque
+from contextlib import ExitStack
+
+import librosa
+import numpy as np
+
+from audio_frontend import open_audio
+from coarse_to_fine import CONFIDENCE_HIGH, CONFIDENCE_LOW
+from crepe_backend import CrepeSession, normalized_frames
+from engine import ConversionParams, VocalToMIDIEngine
+from midi_writer import write_midi
+from segmentation import NoteSegmenter
+
+
+LIVE_SR = 16000
+LIVE_HOP = 160
+LIVE_FRAME = 1024
+LIVE_DETECTORS = ("yin", "crepe")
+PCM_FORMATS = {"s16le": np.dtype("<i2"), "f32le": np.dtype("<f4")}
+LATENCY_TARGET_MS = 100.0
+# Сколько последних блоков помнить для измерения задержки
+ARRIVAL_HISTORY_BLOCKS = 4096
+
+
+class LatencyMeter:
+    """Задержки событий: от прихода решающего отсчета до выдачи события"""
+
+    def __init__(self):
+        self.values = []
+
+    def add(self, seconds):
+        self.values.append(seconds * 1000.0)
+
+    def summary(self):
+        if not self.values:
+            return {"events": 0}
+        values = np.asarray(self.values)
+        return {
+            "events": len(values),
+            "median_ms": round(float(np.median(values)), 1),
+            "p95_ms": round(float(np.percentile(values, 95)), 1),
+            "max_ms": round(float(values.max()), 1),
+            "target_ms": LATENCY_TARGET_MS,
+            "within_target": bool(np.percentile(values, 95) < LATENCY_TARGET_MS),
+        }
+
+
+class LiveTranscriber:
+    """Инкрементальный конвейер: блоки PCM -> кадры высоты тона -> события нот.
+
+    Кадр k охватывает отсчеты [k*hop, k*hop + frame_length) и считается,
+    как только пришел его последний отсчет. Время кадра - его середина.
+    """
+
+    def __init__(self, params, detector="yin", sr=LIVE_SR, hop_length=LIVE_HOP, frame_length=LIVE_FRAME,
+                 onset_seconds=0.03, median_frames=3, gain=1.0):
+        if detector not in LIVE_DETECTORS:
+            raise ValueError(f"Неизвестный детектор: {detector}")
+        if detector == "crepe" and (sr, frame_length) != (LIVE_SR, LIVE_FRAME):
+            raise ValueError("CREPE работает с кадрами 1024 отсчета на 16 кГц")
+
+        self.params = params
+        self.detector = detector
+        self.sr = sr
+        self.hop_length = hop_length
+        self.frame_length = frame_length
+        self.gain = gain
+        self.fmin = librosa.note_to_hz(params.min_note) * 0.9
+        self.fmax = librosa.note_to_hz(params.max_note) * 1.1
+        # Тот же порог, что у CREPE в движке
+        self.confidence_threshold = CONFIDENCE_LOW + (CONFIDENCE_HIGH - CONFIDENCE_LOW) * params.sensitivity
+
+        self.buffer = np.zeros(0, dtype=np.float32)
+        self.buffer_start = 0
+        self.next_frame = 0
+        self.recent = deque(maxlen=max(1, median_frames))
+        # (номер отсчета после конца блока, время прихода блока)
+        self.arrivals = deque(maxlen=ARRIVAL_HISTORY_BLOCKS)
+
+        self.segmenter = NoteSegmenter(params.min_note_duration,
+                                       onset_frames=max(1, round(onset_seconds * sr / hop_length)))
+        self.latency = LatencyMeter()
+        self.session = None
+        if detector == "crepe":
+            self.session = CrepeSession.get(params.crepe_model_capacity)
+            self.session.warm_up()
+        # Первый вызов детектора (компиляция numba, граф модели) - до прихода звука
+        self.frame_pitch(np.zeros(frame_length, dtype=np.float32), 1)
+
+    def arrival_time(self, sample):
+        """Когда пришел блок, содержащий данный отсчет"""
+        for end, arrived in self.arrivals:
+            if sample < end:
+                return arrived
+        return self.arrivals[-1][1] if self.arrivals else time.perf_counter()
+
+    def frame_pitch(self, frames_audio, n_frames):
+        """MIDI-ноты кадров (0 - нет тона) для n_frames кадров подряд"""
+        if self.detector == "yin":
+            f0 = librosa.yin(frames_audio, fmin=self.fmin, fmax=self.fmax, sr=self.sr,
+                             frame_length=self.frame_length, hop_length=self.hop_length, center=False)[:n_frames]
+            return librosa.hz_to_midi(f0)
+
+        import crepe.core
+        activation = self.session.activation(normalized_frames(frames_audio, self.hop_length)[:n_frames],
+                                             batch_size=self.params.crepe_batch_size)
+        cents = crepe.core.to_local_average_cents(activation)
+        midi = librosa.hz_to_midi(10 * 2 ** (cents / 1200))
+        return np.where(activation.max(axis=1) > self.confidence_threshold, midi, 0.0)
+
+    def feed(self, block, arrived=None):
+        """Новый блок отсчетов. Возвращает события, решенные на этом блоке.
+
+        arrived - момент (time.perf_counter) прихода блока, по умолчанию - сейчас.
+        """
+        arrived = time.perf_counter() if arrived is None else arrived
+        block = np.asarray(block, dtype=np.float32) * self.gain
+        self.buffer = np.concatenate([self.buffer, block])
+        self.arrivals.append((self.buffer_start + len(self.buffer), arrived))
+
+        available = self.buffer_start + len(self.buffer)
+        n_frames = 0
+        if available >= self.next_frame * self.hop_length + self.frame_length:
+            n_frames = 1 + (available - self.next_frame * self.hop_length - self.frame_length) // self.hop_length
+
+        events = []
+        if n_frames > 0:
+            offset = self.next_frame * self.hop_length - self.buffer_start
+            frames_audio = self.buffer[offset:offset + (n_frames - 1) * self.hop_length + self.frame_length]
+            midi = self.frame_pitch(frames_audio, n_frames)
+
+            for i in range(n_frames):
+                frame = frames_audio[i * self.hop_length:i * self.hop_length + self.frame_length]
+                loud = np.sqrt(np.mean(frame ** 2)) > self.params.volume_threshold
+                # Причинное сглаживание: медиана последних кадров
+                self.recent.append(midi[i] if loud and np.isfinite(midi[i]) else 0.0)
+                note = np.round(np.median(self.recent)) if loud else 0.0
+                time_val = ((self.next_frame + i) * self.hop_length + self.frame_length / 2) / self.sr
+                events.extend(self.segmenter.push(note, time_val))
+
+            self.next_frame += n_frames
+            # Храним только хвост, нужный следующему кадру
+            keep_from = self.next_frame * self.hop_length - self.buffer_start
+            self.buffer = self.buffer[keep_from:]
+            self.buffer_start += keep_from
+
+        return self.emit(events)
+
+    def emit(self, events):
+        emitted = []
+        now = time.perf_counter()
+        for kind, pitch, time_val in events:
+            latency = now - self.arrival_time(int(time_val * self.sr))
+            self.latency.add(latency)
+            emitted.append({"event": f"note_{kind}", "pitch": int(pitch), "time": round(float(time_val), 3),
+                            "latency_ms": round(latency * 1000, 1)})
+        return emitted
+
+    def finish(self):
+        return self.emit(self.segmenter.finish())
+
+
+def pcm_blocks(stream, block_frames, sample_format="s16le"):
+    """(блок float32, время прихода) из потока сырых моно-отсчетов (stdin, канал, сокет)"""
+    dtype = PCM_FORMATS[sample_format]
+    block_bytes = block_frames * dtype.itemsize
+    pending = b""
+    while True:
+        data = stream.read(block_bytes - len(pending))
+        if not data:
+            break
+        pending += data
+        usable = len(pending) // dtype.itemsize * dtype.itemsize
+        if usable:
+            samples = np.frombuffer(pending[:usable], dtype=dtype)
+            pending = pending[usable:]
+            if dtype.kind == "i":
+                samples = samples / 32768.0
+            yield samples.astype(np.float32), time.perf_counter()
+
+
+def wav_blocks(path, block_frames, sr=LIVE_SR, realtime=True):
+    """(блок, время прихода) из файла в темпе реального времени (имитация живого входа).
+
+    Время прихода - момент, когда блок пришел бы с микрофона, поэтому
+    отставание обработки тоже попадает в задержку.
+    """
+    y = open_audio(path).at_rate(sr)
+    started = time.perf_counter()
+    for start in range(0, len(y), block_frames):
+        if not realtime:
+            yield y[start:start + block_frames], time.perf_counter()
+            continue
+        # Блок "приходит", когда закончилась его последняя выборка
+        due = started + min(len(y), start + block_frames) / sr
+        delay = due - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+        yield y[start:start + block_frames], due
+
+
+def socket_blocks(address, block_frames, sample_format="s16le"):
+    """Принимает одно TCP-соединение и читает из него PCM"""
+    host, port = address.rsplit(":", 1)
+    with socket.create_server((host, int(port))) as server:
+        print(f"Ожидание подключения на {address}...", file=sys.stderr)
+        connection, peer = server.accept()
+        with connection:
+            print(f"Подключен {peer[0]}:{peer[1]}", file=sys.stderr)
+            yield from pcm_blocks(connection.makefile("rb"), block_frames, sample_format)
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Живая конвертация вокала в MIDI-события")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--wav", help="проиграть файл в темпе реального времени")
+    source.add_argument("--stdin", action="store_true", help="сырой PCM из stdin")
+    source.add_argument("--pipe", help="сырой PCM из именованного канала")
+    source.add_argument("--listen", metavar="HOST:PORT", help="сырой PCM из TCP-соединения")
+    parser.add_argument("--format", choices=sorted(PCM_FORMATS), default="s16le", help="формат сырого PCM")
+    parser.add_argument("--fast", action="store_true", help="проиграть --wav без пауз (проверка скорости)")
+    parser.add_argument("--detector", choices=LIVE_DETECTORS, default="yin", help="покадровый детектор")
+    parser.add_argument("--block-ms", type=float, default=10.0, help="размер блока ввода, мс")
+    parser.add_argument("--onset-ms", type=float, default=30.0,
+                        help="сколько нота должна продержаться до события note_on, мс")
+    parser.add_argument("--gain", type=float, default=1.0, help="усиление входа перед порогом громкости")
+    parser.add_argument("-o", "--output", help="сохранить сыгранные ноты в MIDI-файл")
+    defaults = ConversionParams()
+    parser.add_argument("--min-note", default=defaults.min_note)
+    parser.add_argument("--max-note", default=defaults.max_note)
+    parser.add_argument("--volume-threshold", type=float, default=defaults.volume_threshold)
+    parser.add_argument("--sensitivity", type=float, default=defaults.sensitivity)
+    parser.add_argument("--min-note-duration", type=float, default=defaults.min_note_duration)
+    parser.add_argument("--program", dest="instrument_program", type=int, default=defaults.instrument_program)
+    parser.add_argument("--crepe-capacity", dest="crepe_model_capacity", default="tiny")
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    params = ConversionParams.from_dict(vars(args))
+    block_frames = max(1, int(args.block_ms * LIVE_SR / 1000))
+
+    transcriber = LiveTranscriber(params, detector=args.detector, onset_seconds=args.onset_ms / 1000,
+                                  gain=args.gain)
+    played = []
+    sounding = {}
+
+    def handle(events):
+        for event in events:
+            print(json.dumps(event), flush=True)
+            if event["event"] == "note_on":
+                sounding[event["pitch"]] = event["time"]
+            elif event["pitch"] in sounding:
+                played.append((event["pitch"], sounding.pop(event["pitch"]), event["time"]))
+
+    # Канал закрывается и при Ctrl+C, и при ошибке чтения
+    with ExitStack() as stack:
+        if args.wav:
+            blocks = wav_blocks(args.wav, block_frames, realtime=not args.fast)
+        elif args.stdin:
+            blocks = pcm_blocks(sys.stdin.buffer, block_frames, args.format)
+        elif args.pipe:
+            blocks = pcm_blocks(stack.enter_context(open(args.pipe, "rb")), block_frames, args.format)
+        else:
+            blocks = socket_blocks(args.listen, block_frames, args.format)
+
+        try:
+            for block, arrived in blocks:
+                handle(transcriber.feed(block, arrived))
+        except KeyboardInterrupt:
+            pass
+    handle(transcriber.finish())
+
+    summary = transcriber.latency.summary()
+    print(f"Задержка событий: {json.dumps(summary, ensure_ascii=False)}", file=sys.stderr)
+
+    if args.output:
+        write_midi(args.output, VocalToMIDIEngine(params).playable_notes(played), params.instrument_program)
+        print(f"Сохранено нот: {len(played)} -> {args.output}", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
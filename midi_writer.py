@@ -0,0 +1,73 @@
+"""Запись нот прямо в байты Standard MIDI File.
+
+Ноты приходят массивом ``segmentation.NOTE_DTYPE``; события note-on/off
+кодируются целиком массивами NumPy (включая переменную длину дельт), без
+объектов на каждую ноту. Файл - формат 0, одна дорожка, темп 120 BPM.
+"""
+import struct
+
+import numpy as np
+
+
+TICKS_PER_BEAT = 480
+TEMPO_US = 500000  # микросекунд на четверть (120 BPM)
+TICKS_PER_SECOND = TICKS_PER_BEAT * 1000000 / TEMPO_US
+
+NOTE_ON = 0x90
+NOTE_OFF = 0x80
+
+
+def variable_length(values):
+    """Дельты в переменной длине MIDI: (байты (n, 4), маска значащих байтов)"""
+    values = np.asarray(values, dtype=np.int64)
+    shifts = np.array([21, 14, 7, 0])
+    groups = ((values[:, None] >> shifts) & 0x7F).astype(np.uint8)
+    # У всех байтов, кроме последнего, стоит старший бит продолжения
+    groups[:, :3] |= 0x80
+    length = 1 + (values >= 1 << 7) + (values >= 1 << 14) + (values >= 1 << 21)
+    mask = np.arange(4) >= 4 - length[:, None]
+    return groups, mask
+
+
+def note_events(notes, channel=0):
+    """Тело дорожки с событиями нот (без заголовка и конца дорожки)"""
+    onsets = np.round(np.maximum(notes["onset"], 0) * TICKS_PER_SECOND).astype(np.int64)
+    offsets = np.round(notes["offset"] * TICKS_PER_SECOND).astype(np.int64)
+    # Нота короче тика все равно звучит тик, иначе note-off встанет раньше note-on
+    offsets = np.maximum(offsets, onsets + 1)
+
+    n = len(notes)
+    ticks = np.concatenate((onsets, offsets))
+    is_on = np.concatenate((np.ones(n, dtype=bool), np.zeros(n, dtype=bool)))
+    # В один тик сначала снимаются старые ноты, потом берутся новые
+    order = np.lexsort((is_on, ticks))
+
+    pitches = np.concatenate((notes["pitch"], notes["pitch"])).astype(np.uint8)
+    velocities = np.concatenate((np.maximum(notes["velocity"], 1), np.zeros(n))).astype(np.uint8)
+    status = np.where(is_on, NOTE_ON | channel, NOTE_OFF | channel).astype(np.uint8)
+
+    ticks = ticks[order]
+    deltas = np.diff(ticks, prepend=0)
+    delta_bytes, delta_mask = variable_length(deltas)
+
+    rows = np.column_stack((delta_bytes, status[order], pitches[order], velocities[order]))
+    mask = np.column_stack((delta_mask, np.ones((len(rows), 3), dtype=bool)))
+    return rows[mask].tobytes()
+
+
+def encode_smf(notes, program=0, channel=0):
+    """Байты MIDI-файла с нотами массива NOTE_DTYPE"""
+    track = b"".join((
+        b"\x00\xff\x51\x03" + TEMPO_US.to_bytes(3, "big"),
+        bytes((0, 0xC0 | channel, program & 0x7F)),
+        note_events(notes, channel) if len(notes) else b"",
+        b"\x00\xff\x2f\x00",
+    ))
+    header = b"MThd" + struct.pack(">IHHH", 6, 0, 1, TICKS_PER_BEAT)
+    return header + b"MTrk" + struct.pack(">I", len(track)) + track
+
+
+def write_midi(path, notes, program=0):
+    """Записывает ноты в MIDI-файл"""
+    with open(path, "wb") as f:
+        f.write(encode_smf(notes, program))
@@ -1,16 +1,28 @@
+import queue
 import tkinter as tk
 from tkinter import ttk, filedialog, messagebox
 import threading
-import librosa
-import numpy as np
-import pretty_midi
-import os
 from pathlib import Path
-from scipy import signal
-from scipy.ndimage import median_filter, gaussian_filter1d
-import tempfile
-import noisereduce as nr
-import crepe
+
+from engine import (CancelToken, ConversionCancelled, ConversionParams, ConversionResult, VocalToMIDIEngine,
+                    parse_instrument_program)
+from job_server import JobClient
+from stage_memo import StageMemo
+
+# Как часто цикл Tk забирает события рабочего потока, мс
+EVENT_POLL_MS = 50
+# Задержка предпросмотра после движения ползунка, мс
+PREVIEW_DELAY_MS = 150
+
+
+# Пресеты скорость/точность CREPE (ключи - из crepe_backend.SPEED_PRESETS)
+CREPE_PRESET_LABELS = {
+    "Черновой (tiny, шаг 20 мс)": "draft",
+    "Быстрый (small)": "fast",
+    "Сбалансированный (medium)": "balanced",
+    "Точный (full)": "accurate",
+    "Двухпроходный (full у переходов нот)": "refine",
+}
 
 
 class AdvancedVocalToMIDIConverter:
@@ -23,10 +35,30 @@ class AdvancedVocalToMIDIConverter:
         # Переменные
         self.input_file = tk.StringVar()
         self.output_file = tk.StringVar()
+        # Адрес сервера заданий (job_server.py); пусто - конвертация в этом процессе
+        self.server_url = tk.StringVar()
         self.progress = tk.DoubleVar()
         self.status = tk.StringVar(value="Готов к работе")
         self.is_processing = False
 
+        # Рабочий поток не трогает Tk: он кладет события в очередь,
+        # а цикл Tk разбирает ее в poll_events
+        self.events = queue.Queue()
+        self.cancel_token = None
+
+        # Результаты этапов между конвертациями: при смене параметров нот
+        # декодирование, предобработка и детекторы не повторяются
+        self.stage_memo = StageMemo()
+        self.preview_job = None
+        # Предпросмотр тоже считается в своем потоке: Витерби на длинной записи
+        # занимает заметное время, а окно не должно замирать
+        self.preview_thread = None
+        self.preview_results = queue.Queue()
+
+        # Фоновый импорт библиотек и загрузка модели (ключи уже прогретых параметров)
+        self.warm_up_thread = None
+        self.warmed_up = set()
+
         # Параметры алгоритма
         self.pitch_detection_method = tk.StringVar(value="crepe")
         self.use_noise_reduction = tk.BooleanVar(value=True)
@@ -37,6 +69,10 @@ class AdvancedVocalToMIDIConverter:
 
         self.setup_ui()
 
+        # Предпросмотр числа нот при изменении параметров сегментации
+        for variable in (self.sensitivity, self.volume_threshold, self.min_note_duration):
+            variable.trace_add("write", self.schedule_preview)
+
     def setup_ui(self):
         # Стиль
         style = ttk.Style()
@@ -74,6 +110,12 @@ class AdvancedVocalToMIDIConverter:
         output_entry.grid(row=1, column=1, padx=(10, 5), sticky=tk.EW)
         ttk.Button(file_frame, text="Обзор...", command=self.browse_output_file).grid(row=1, column=2, padx=(5, 0))
 
+        # Сервер заданий (необязательно)
+        ttk.Label(file_frame, text="Сервер заданий:").grid(row=2, column=0, sticky=tk.W, pady=(10, 0))
+        server_entry = ttk.Entry(file_frame, textvariable=self.server_url, width=50)
+        server_entry.grid(row=2, column=1, padx=(10, 5), pady=(10, 0), sticky=tk.EW)
+        ttk.Label(file_frame, text="пусто - локально").grid(row=2, column=2, padx=(5, 0), pady=(10, 0))
+
         file_frame.columnconfigure(1, weight=1)
 
         # Фрейм метода определения высоты тона
@@ -88,7 +130,17 @@ class AdvancedVocalToMIDIConverter:
                         variable=self.pitch_detection_method, value="pyin").grid(row=1, column=0, sticky=tk.W,
                                                                                  pady=(0, 5))
         ttk.Radiobutton(method_frame, text="Комбинированный метод (CREPE + PYIN)",
-                        variable=self.pitch_detection_method, value="combined").grid(row=2, column=0, sticky=tk.W)
+                        variable=self.pitch_detection_method, value="combined").grid(row=2, column=0, sticky=tk.W,
+                                                                                     pady=(0, 5))
+        ttk.Radiobutton(method_frame, text="YIN (черновой - очень быстро, для просмотра и отбора)",
+                        variable=self.pitch_detection_method, value="yin").grid(row=3, column=0, sticky=tk.W)
+
+        # Пресет скорости CREPE
+        ttk.Label(method_frame, text="Скорость/точность CREPE:").grid(row=4, column=0, sticky=tk.W, pady=(10, 0))
+        self.crepe_preset_combo = ttk.Combobox(method_frame, values=list(CREPE_PRESET_LABELS),
+                                               state="readonly", width=36)
+        self.crepe_preset_combo.set("Точный (full)")
+        self.crepe_preset_combo.grid(row=4, column=1, sticky=tk.W, padx=(10, 0), pady=(10, 0))
 
         # Фрейм основных настроек
         basic_settings_frame = ttk.LabelFrame(main_frame, text="Основные настройки", padding="15")
@@ -216,6 +268,10 @@ class AdvancedVocalToMIDIConverter:
         self.convert_button = ttk.Button(button_frame, text="Конвертировать", command=self.start_conversion)
         self.convert_button.pack(side=tk.RIGHT, padx=(10, 0))
 
+        self.cancel_button = ttk.Button(button_frame, text="Отмена", command=self.cancel_conversion,
+                                        state=tk.DISABLED)
+        self.cancel_button.pack(side=tk.RIGHT, padx=(10, 0))
+
         ttk.Button(button_frame, text="Очистить", command=self.clear_all).pack(side=tk.RIGHT)
 
         # Информация
@@ -229,6 +285,7 @@ class AdvancedVocalToMIDIConverter:
 СОВЕТЫ:
 
 • CREPE: Лучшая точность, но требует больше ресурсов
+• Черновой пресет CREPE в разы быстрее - удобно для предпросмотра
 • PYIN: Быстрее, хорошо для чистых записей
 • Комбинированный: Наиболее устойчивый к артефактам
 • Увеличьте порог громкости для записей с шумом
@@ -239,6 +296,8 @@ class AdvancedVocalToMIDIConverter:
         info_text.config(state=tk.DISABLED)
 
     def browse_input_file(self):
+        # Пока открыт диалог, в фоне грузятся библиотеки и модель
+        self.start_warm_up()
         filename = filedialog.askopenfilename(
             title="Выберите аудиофайл",
             filetypes=[("Audio files", "*.mp3 *.wav *.ogg *.m4a *.flac"), ("All files", "*.*")]
@@ -259,6 +318,30 @@ class AdvancedVocalToMIDIConverter:
         if filename:
             self.output_file.set(filename)
 
+    def start_warm_up(self):
+        """Прогрев движка для текущих параметров в фоновом потоке"""
+        try:
+            params = self.get_params()
+        except (tk.TclError, ValueError):
+            return
+        if self.server_url.get().strip():
+            # Модель держит загруженной сервер
+            return
+        key = (params.method, params.crepe_model_capacity, params.crepe_refine, params.crepe_coarse_capacity,
+               params.use_noise_reduction, params.use_harmonic_percussive)
+        if key in self.warmed_up or (self.warm_up_thread is not None and self.warm_up_thread.is_alive()):
+            return
+        self.warmed_up.add(key)
+        self.warm_up_thread = threading.Thread(target=self.warm_up_engine, args=(params,), daemon=True)
+        self.warm_up_thread.start()
+
+    def warm_up_engine(self, params):
+        """Фоновый поток: не трогает Tk, ошибки прогрева проявятся при конвертации"""
+        try:
+            VocalToMIDIEngine(params).warm_up()
+        except Exception as e:
+            print(f"Не удалось прогреть движок: {e}")
+
     def clear_all(self):
         self.input_file.set("")
         self.output_file.set("")
@@ -276,314 +359,174 @@ class AdvancedVocalToMIDIConverter:
 
         self.is_processing = True
         self.convert_button.config(state=tk.DISABLED)
+        self.cancel_button.config(state=tk.NORMAL)
         self.progress.set(0)
         self.status.set("Начинаю обработку...")
 
         # Запуск конвертации в отдельном потоке
-        thread = threading.Thread(target=self.convert_audio_to_midi)
+        self.cancel_token = CancelToken()
+        server_url = self.server_url.get().strip()
+        args = (self.get_params(), self.input_file.get(), self.output_file.get(), self.cancel_token)
+        if server_url:
+            thread = threading.Thread(target=self.convert_on_server, args=args + (server_url,))
+        else:
+            thread = threading.Thread(target=self.convert_audio_to_midi, args=args)
         thread.daemon = True
         thread.start()
 
-        # Мониторинг прогресса
-        self.monitor_conversion(thread)
+        # Разбор событий рабочего потока
+        self.root.after(EVENT_POLL_MS, self.poll_events)
 
-    def monitor_conversion(self, thread):
-        if thread.is_alive():
-            self.root.after(100, lambda: self.monitor_conversion(thread))
-        else:
-            self.convert_button.config(state=tk.NORMAL)
-            self.is_processing = False
-
-    def update_progress(self, value, message):
-        self.progress.set(value)
-        self.status.set(message)
-        self.root.update_idletasks()
+    def schedule_preview(self, *args):
+        """Откладывает предпросмотр, пока ползунок еще движется"""
+        if self.preview_job is not None:
+            self.root.after_cancel(self.preview_job)
+        self.preview_job = self.root.after(PREVIEW_DELAY_MS, self.run_preview)
 
-    def preprocess_audio(self, y, sr):
-        """Предварительная обработка аудио"""
-        self.update_progress(10, "Предварительная обработка аудио...")
+    def run_preview(self):
+        """Число нот при текущих параметрах, если тяжелые этапы уже посчитаны"""
+        self.preview_job = None
+        if self.is_processing or not self.input_file.get():
+            return
+        if self.preview_thread is not None and self.preview_thread.is_alive():
+            # Предыдущий предпросмотр еще считается - повторим после него
+            self.preview_job = self.root.after(PREVIEW_DELAY_MS, self.run_preview)
+            return
+        try:
+            params = self.get_params()
+        except (tk.TclError, ValueError):
+            # Поле ввода в процессе редактирования
+            return
 
-        # Нормализация
-        y = librosa.util.normalize(y)
+        self.preview_thread = threading.Thread(target=self.preview_notes, args=(params, self.input_file.get()))
+        self.preview_thread.daemon = True
+        self.preview_thread.start()
+        self.root.after(EVENT_POLL_MS, self.poll_preview)
 
-        # Подавление шума
-        if self.use_noise_reduction.get():
-            try:
-                # Используем первую секунду как образец шума
-                noise_sample = y[:min(sr, len(y))]
-                y = nr.reduce_noise(y=y, sr=sr, y_noise=noise_sample, prop_decrease=0.75)
-            except Exception as e:
-                print(f"Шумоподавление не удалось: {e}")
-
-        # Разделение гармоник и перкуссии
-        if self.use_harmonic_percussive.get():
+    def preview_notes(self, params, input_path):
+        """Поток предпросмотра: результат (список нот или None) уходит в очередь"""
+        notes = None
+        try:
+            notes = VocalToMIDIEngine(params, memo=self.stage_memo).preview(input_path)
+        except (ValueError, OSError):
+            # Файл недоступен
+            pass
+        finally:
+            self.preview_results.put(notes)
+
+    def poll_preview(self):
+        """Показывает результат потока предпросмотра (вызывается только из цикла Tk)"""
+        try:
+            notes = self.preview_results.get_nowait()
+        except queue.Empty:
+            self.root.after(EVENT_POLL_MS, self.poll_preview)
+            return
+        if notes is not None and not self.is_processing:
+            self.status.set(f"Предпросмотр: {len(notes)} нот")
+
+    def cancel_conversion(self):
+        if self.cancel_token is not None:
+            self.cancel_token.cancel()
+            self.cancel_button.config(state=tk.DISABLED)
+            self.status.set("Отмена...")
+
+    def poll_events(self):
+        """Применяет события рабочего потока (вызывается только из цикла Tk)"""
+        finished = False
+        while True:
             try:
-                y_harmonic, y_percussive = librosa.effects.hpss(y)
-                y = y_harmonic  # Используем гармоническую составляющую
-            except Exception as e:
-                print(f"Разделение HPSS не удалось: {e}")
-
-        return y
+                event, *args = self.events.get_nowait()
+            except queue.Empty:
+                break
+
+            if event == "progress":
+                value, message = args
+                self.progress.set(value)
+                self.status.set(message)
+            elif event == "done":
+                result, = args
+                finished = True
+                messagebox.showinfo("Успех",
+                                    f"MIDI-файл успешно сохранен:\n{result.output_path}\n\n"
+                                    f"Извлечено нот: {result.note_count}")
+            elif event == "cancelled":
+                finished = True
+                self.progress.set(0)
+                self.status.set("Конвертация отменена")
+            elif event == "error":
+                message, = args
+                finished = True
+                self.progress.set(0)
+                self.status.set(f"Ошибка: {message}")
+                messagebox.showerror("Ошибка", f"Произошла ошибка при конвертации:\n{message}")
+
+        if finished:
+            self.convert_button.config(state=tk.NORMAL)
+            self.cancel_button.config(state=tk.DISABLED)
+            self.is_processing = False
+            self.cancel_token = None
+        else:
+            self.root.after(EVENT_POLL_MS, self.poll_events)
 
-    def detect_pitch_crepe(self, y, sr):
-        """Определение высоты тона с помощью CREPE"""
-        self.update_progress(30, "Анализ CREPE (нейросеть)...")
+    def update_progress(self, value, message):
+        """Колбэк движка: вызывается из рабочего потока, поэтому только кладет событие"""
+        self.events.put(("progress", value, message))
+
+    def get_params(self):
+        """Собирает параметры алгоритма из элементов интерфейса"""
+        params = ConversionParams(
+            method=self.pitch_detection_method.get(),
+            use_noise_reduction=self.use_noise_reduction.get(),
+            use_harmonic_percussive=self.use_harmonic_percussive.get(),
+            min_note_duration=self.min_note_duration.get(),
+            sensitivity=self.sensitivity.get(),
+            volume_threshold=self.volume_threshold.get(),
+            min_note=self.min_note_combo.get(),
+            max_note=self.max_note_combo.get(),
+            instrument_program=parse_instrument_program(self.instrument_combo.get()),
+        )
+        return params.with_preset(CREPE_PRESET_LABELS[self.crepe_preset_combo.get()])
 
+    def convert_audio_to_midi(self, params, input_path, output_path, cancel_token):
+        """Рабочий поток. Значения виджетов читаются заранее, в потоке Tk."""
         try:
-            # Используем CREPE для определения высоты тона
-            time, frequency, confidence, activation = crepe.predict(
-                y, sr,
-                viterbi=True,  # Сглаживание Витерби
-                model_capacity="full"  # Полная модель для лучшей точности
-            )
-
-            # Фильтруем по уверенности
-            confidence_threshold = 0.4 + 0.4 * self.sensitivity.get()
-            valid_mask = confidence > confidence_threshold
-            frequency[~valid_mask] = 0
-
-            # Конвертируем в MIDI ноты
-            midi_notes = np.zeros_like(frequency)
-            valid_freqs = frequency > 0
-            midi_notes[valid_freqs] = librosa.hz_to_midi(frequency[valid_freqs])
-
-            return midi_notes, time, confidence
+            engine = VocalToMIDIEngine(params, progress_callback=self.update_progress, cancel_token=cancel_token,
+                                       memo=self.stage_memo)
+            result = engine.convert(input_path, output_path)
+            self.events.put(("done", result))
 
+        except ConversionCancelled:
+            self.events.put(("cancelled",))
         except Exception as e:
-            print(f"CREPE не удался: {e}")
-            return None, None, None
-
-    def detect_pitch_pyin(self, y, sr):
-        """Определение высоты тона с помощью PYIN"""
-        self.update_progress(30, "Анализ PYIN...")
-
-        fmin = librosa.note_to_hz(self.min_note_combo.get())
-        fmax = librosa.note_to_hz(self.max_note_combo.get())
-
-        f0, voiced_flag, voiced_probs = librosa.pyin(
-            y,
-            fmin=fmin * 0.9,  # Немного расширяем диапазон
-            fmax=fmax * 1.1,
-            sr=sr,
-            frame_length=2048,
-            hop_length=512,
-            fill_na=0
-        )
-
-        # Конвертируем в MIDI ноты
-        midi_notes = np.zeros_like(f0)
-        valid_mask = (voiced_flag) & (~np.isnan(f0)) & (f0 > 0)
-        midi_notes[valid_mask] = librosa.hz_to_midi(f0[valid_mask])
-
-        return midi_notes, librosa.times_like(f0, sr=sr, hop_length=512), voiced_probs
-
-    def combined_pitch_detection(self, y, sr):
-        """Комбинированный метод CREPE + PYIN"""
-        self.update_progress(25, "Комбинированный анализ...")
-
-        # Получаем результаты обоих методов
-        crepe_notes, crepe_times, crepe_conf = self.detect_pitch_crepe(y, sr)
-        pyin_notes, pyin_times, pyin_conf = self.detect_pitch_pyin(y, sr)
+            self.events.put(("error", str(e)))
 
-        if crepe_notes is None:
-            return pyin_notes, pyin_times, pyin_conf
-
-        # Интерполируем CREPE результаты к временной сетке PYIN
-        if len(crepe_notes) != len(pyin_notes):
-            from scipy.interpolate import interp1d
-            try:
-                f = interp1d(crepe_times, crepe_notes, kind='linear',
-                             bounds_error=False, fill_value=0)
-                crepe_notes_interp = f(pyin_times)
-            except:
-                crepe_notes_interp = np.zeros_like(pyin_notes)
-        else:
-            crepe_notes_interp = crepe_notes
-
-        # Объединяем результаты
-        combined_notes = np.zeros_like(pyin_notes)
-
-        for i in range(len(combined_notes)):
-            crepe_note = crepe_notes_interp[i]
-            pyin_note = pyin_notes[i]
-
-            if crepe_note > 0 and pyin_note > 0:
-                # Оба метода дали результат - берем среднее
-                combined_notes[i] = (crepe_note + pyin_note) / 2
-            elif crepe_note > 0:
-                # Только CREPE
-                combined_notes[i] = crepe_note
-            elif pyin_note > 0:
-                # Только PYIN
-                combined_notes[i] = pyin_note
-
-        return combined_notes, pyin_times, np.maximum(crepe_conf if crepe_conf is not None else 0,
-                                                      pyin_conf if pyin_conf is not None else 0)
-
-    def advanced_note_processing(self, midi_notes, times, sr, y):
-        """Продвинутая обработка нот"""
-        self.update_progress(60, "Обработка и сглаживание нот...")
-
-        if len(midi_notes) == 0:
-            return []
-
-        # Вычисляем энергию сигнала для фильтрации тихих участков
-        hop_length = 512
-        frame_length = 2048
-        rms = librosa.feature.rms(y=y, frame_length=frame_length, hop_length=hop_length)[0]
-
-        # Интерполируем RMS к временной сетке нот
-        if len(rms) != len(midi_notes):
-            rms_times = librosa.times_like(rms, sr=sr, hop_length=hop_length)
-            rms_interp = np.interp(times, rms_times, rms)
-        else:
-            rms_interp = rms
-
-        # Фильтрация по громкости
-        volume_threshold = self.volume_threshold.get()
-        loud_enough = rms_interp > volume_threshold
-
-        # Медианная фильтрация для удаления выбросов
-        notes_clean = median_filter(midi_notes, size=5)
-
-        # Гауссово сглаживание
-        notes_smooth = gaussian_filter1d(notes_clean, sigma=2)
-
-        # Квантование к полутонам
-        notes_quantized = np.round(notes_smooth)
-
-        # Применяем фильтр громкости
-        notes_quantized[~loud_enough] = 0
-
-        # Создаем ноты
-        min_duration = self.min_note_duration.get()
-        notes = []
-        current_note = None
-        note_start = 0
-        note_pitches = []
-
-        for i, (note_num, time_val) in enumerate(zip(notes_quantized, times)):
-            if note_num > 0:
-                if current_note is None:
-                    current_note = note_num
-                    note_start = time_val
-                    note_pitches = [note_num]
-                elif note_num != current_note:
-                    # Проверяем, является ли изменение значительным
-                    if abs(note_num - current_note) < 2 and len(note_pitches) < 10:
-                        # Небольшое изменение - продолжаем ноту
-                        note_pitches.append(note_num)
-                        current_note = int(np.median(note_pitches))
-                    else:
-                        # Значительное изменение - начинаем новую ноту
-                        note_end = time_val
-                        duration = note_end - note_start
-
-                        if duration >= min_duration:
-                            final_pitch = int(np.median(note_pitches))
-                            notes.append((final_pitch, note_start, note_end))
-
-                        current_note = note_num
-                        note_start = time_val
-                        note_pitches = [note_num]
-                else:
-                    note_pitches.append(note_num)
+    def convert_on_server(self, params, input_path, output_path, cancel_token, server_url):
+        """Рабочий поток: задание уходит на сервер заданий, MIDI сохраняется здесь"""
+        def show_status(status):
+            if status["state"] == "queued":
+                self.update_progress(0, f"В очереди сервера, перед заданием: {status['position']}")
             else:
-                if current_note is not None:
-                    note_end = time_val
-                    duration = note_end - note_start
-
-                    if duration >= min_duration:
-                        final_pitch = int(np.median(note_pitches))
-                        notes.append((final_pitch, note_start, note_end))
-
-                    current_note = None
-                    note_pitches = []
-
-        # Добавляем последнюю ноту
-        if current_note is not None:
-            note_end = times[-1]
-            duration = note_end - note_start
-
-            if duration >= min_duration:
-                final_pitch = int(np.median(note_pitches))
-                notes.append((final_pitch, note_start, note_end))
-
-        return notes
+                self.update_progress(status["progress"], status["message"])
 
-    def convert_audio_to_midi(self):
         try:
-            self.update_progress(5, "Загрузка аудио...")
-
-            # Загрузка аудиофайла
-            y, sr = librosa.load(self.input_file.get(), sr=22050, mono=True)
-
-            # Предварительная обработка
-            y_processed = self.preprocess_audio(y, sr)
-
-            self.update_progress(20, "Определение высоты тона...")
-
-            # Выбор метода определения высоты тона
-            method = self.pitch_detection_method.get()
-
-            if method == "crepe":
-                midi_notes, times, confidence = self.detect_pitch_crepe(y_processed, sr)
-                if midi_notes is None:
-                    self.update_progress(20, "CREPE не сработал, использую PYIN...")
-                    midi_notes, times, confidence = self.detect_pitch_pyin(y_processed, sr)
-            elif method == "pyin":
-                midi_notes, times, confidence = self.detect_pitch_pyin(y_processed, sr)
-            else:  # combined
-                midi_notes, times, confidence = self.combined_pitch_detection(y_processed, sr)
-
-            if midi_notes is None or len(midi_notes) == 0:
-                raise Exception("Не удалось определить высоту тона в аудио")
-
-            self.update_progress(50, "Обработка нот...")
-
-            # Продвинутая обработка нот
-            notes = self.advanced_note_processing(midi_notes, times, sr, y_processed)
-
-            if len(notes) == 0:
-                raise Exception("Не удалось извлечь ноты из аудио")
-
-            self.update_progress(80, "Создание MIDI...")
-
-            # Создание объекта MIDI
-            midi_data = pretty_midi.PrettyMIDI()
-            instrument_program = int(self.instrument_combo.get().split("(")[1].split(")")[0])
-            instrument = pretty_midi.Instrument(program=instrument_program)
-
-            # Добавление нот в MIDI
-            min_midi = librosa.note_to_midi(self.min_note_combo.get())
-            max_midi = librosa.note_to_midi(self.max_note_combo.get())
-
-            for pitch, start, end in notes:
-                if min_midi <= pitch <= max_midi:
-                    # Вычисляем velocity на основе громкости
-                    velocity = 60 + int(40 * self.sensitivity.get())
-                    note = pretty_midi.Note(
-                        velocity=min(velocity, 127),
-                        pitch=int(pitch),
-                        start=max(0, start - 0.02),  # Небольшая коррекция времени
-                        end=end
-                    )
-                    instrument.notes.append(note)
-
-            midi_data.instruments.append(instrument)
-
-            self.update_progress(95, "Сохранение файла...")
-
-            # Сохраняем MIDI-файл
-            midi_data.write(self.output_file.get())
-
-            self.update_progress(100, "Конвертация завершена!")
-            messagebox.showinfo("Успех",
-                                f"MIDI-файл успешно сохранен:\n{self.output_file.get()}\n\nИзвлечено нот: {len(notes)}")
+            client = JobClient(server_url)
+            job_id = client.submit_file(input_path, params.to_dict())
+            status = client.wait(job_id, on_status=show_status, check=cancel_token.check)
+            with open(output_path, "wb") as f:
+                f.write(client.midi(job_id))
+            result = ConversionResult(
+                input_path=input_path,
+                output_path=output_path,
+                note_count=status["note_count"],
+                audio_duration=status["audio_duration"],
+                elapsed=status["elapsed"],
+            )
+            self.events.put(("done", result))
 
+        except ConversionCancelled:
+            self.events.put(("cancelled",))
         except Exception as e:
-            self.update_progress(0, f"Ошибка: {str(e)}")
-            messagebox.showerror("Ошибка", f"Произошла ошибка при конвертации:\n{str(e)}")
+            self.events.put(("error", str(e)))
 
 
 def main():
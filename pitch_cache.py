@@ -0,0 +1,156 @@
+"""Дисковый кэш результатов анализа (треки высоты тона, RMS, активации CREPE).
+
+Ключ записи - хэш декодированного аудио плюс все настройки, от которых
+зависит результат этапа (флаги предобработки, детектор, модель, fmin/fmax).
+Каждый массив хранится отдельным ``.npy`` и открывается через memory map,
+поэтому повторный прогон с другими параметрами сегментации почти ничего
+не читает с диска. Размер кэша ограничен, вытесняются давно не
+использованные записи (LRU по времени доступа).
+"""
+import hashlib
+import json
+import os
+import shutil
+import time
+from pathlib import Path
+
+import numpy as np
+
+
+STALE_TMP_SECONDS = 24 * 3600
+
+
+class PitchCache:
+    def __init__(self, cache_dir, max_bytes=2 * 1024 ** 3):
+        self.root = Path(cache_dir)
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+
+    @staticmethod
+    def audio_digest(y, sr):
+        """Хэш декодированного сигнала и его частоты дискретизации"""
+        h = hashlib.sha256()
+        h.update(str(int(sr)).encode())
+        h.update(np.ascontiguousarray(y, dtype=np.float32).tobytes())
+        return h.hexdigest()
+
+    @staticmethod
+    def make_key(audio_digest, stage, settings):
+        """Ключ записи: хэш аудио + имя этапа + его настройки"""
+        payload = json.dumps({"audio": audio_digest, "stage": stage, "settings": settings},
+                             sort_keys=True, default=str)
+        return hashlib.sha256(payload.encode()).hexdigest()
+
+    def _entry_dir(self, key):
+        return self.root / key[:2] / key
+
+    def get(self, key):
+        """Словарь массивов (memory map) или None, если записи нет"""
+        entry = self._entry_dir(key)
+        if not entry.is_dir():
+            return None
+
+        try:
+            arrays = {path.stem: np.load(path, mmap_mode="r") for path in entry.glob("*.npy")}
+            # Отмечаем использование для LRU
+            os.utime(entry)
+        except (OSError, ValueError):
+            # Запись удалили или повредили параллельно - считаем промахом
+            return None
+
+        return arrays or None
+
+    def put(self, key, arrays):
+        """Сохраняет словарь массивов. Запись появляется атомарно."""
+        entry = self._entry_dir(key)
+        if entry.is_dir():
+            return
+
+        entry.parent.mkdir(parents=True, exist_ok=True)
+        tmp = entry.parent / f"{key}.tmp-{os.getpid()}-{time.monotonic_ns()}"
+        tmp.mkdir()
+        try:
+            for name, array in arrays.items():
+                if array is not None:
+                    np.save(tmp / f"{name}.npy", np.asarray(array))
+            os.replace(tmp, entry)
+        except OSError:
+            # Другой процесс успел записать тот же ключ
+            shutil.rmtree(tmp, ignore_errors=True)
+            return
+
+        self.evict()
+
+    def open_entry(self, key, name, shape, dtype=np.float32):
+        """Начинает запись с большим массивом, заполняемым по частям.
+
+        Массив создается как memory map во временной папке, поэтому матрица
+        активаций не обязана целиком помещаться в память.
+        """
+        entry = self._entry_dir(key)
+        entry.parent.mkdir(parents=True, exist_ok=True)
+        tmp = entry.parent / f"{key}.tmp-{os.getpid()}-{time.monotonic_ns()}"
+        tmp.mkdir()
+        array = np.lib.format.open_memmap(tmp / f"{name}.npy", mode="w+", dtype=dtype, shape=shape)
+        return PendingEntry(self, tmp, entry, array)
+
+    def evict(self):
+        """Удаляет самые старые записи, пока кэш больше max_bytes"""
+        entries = []
+        total = 0
+        now = time.time()
+        for entry in self.root.glob("*/*"):
+            if not entry.is_dir():
+                continue
+            if ".tmp-" in entry.name:
+                # Недописанные записи упавших процессов
+                try:
+                    if now - entry.stat().st_mtime > STALE_TMP_SECONDS:
+                        shutil.rmtree(entry, ignore_errors=True)
+                except OSError:
+                    pass
+                continue
+            try:
+                size = sum(f.stat().st_size for f in entry.iterdir())
+                entries.append((entry.stat().st_mtime, size, entry))
+            except OSError:
+                continue
+            total += size
+
+        entries.sort()
+        for _, size, entry in entries:
+            if total <= self.max_bytes:
+                break
+            shutil.rmtree(entry, ignore_errors=True)
+            total -= size
+
+    def clear(self):
+        shutil.rmtree(self.root, ignore_errors=True)
+        self.root.mkdir(parents=True, exist_ok=True)
+
+
+class PendingEntry:
+    """Незавершенная запись кэша, созданная PitchCache.open_entry"""
+
+    def __init__(self, cache, tmp_dir, entry_dir, array):
+        self.cache = cache
+        self.tmp_dir = tmp_dir
+        self.entry_dir = entry_dir
+        self.array = array
+
+    def commit(self, extra_arrays=None):
+        """Дописывает остальные массивы и публикует запись"""
+        self.array.flush()
+        del self.array
+        for name, array in (extra_arrays or {}).items():
+            if array is not None:
+                np.save(self.tmp_dir / f"{name}.npy", np.asarray(array))
+        try:
+            os.replace(self.tmp_dir, self.entry_dir)
+        except OSError:
+            self.discard()
+            return
+        self.cache.evict()
+
+    def discard(self):
+        shutil.rmtree(self.tmp_dir, ignore_errors=True)
@@ -0,0 +1,355 @@
+"""Сегментация квантованного трека высоты тона на ноты.
+
+``segment_notes`` дает тот же список нот, что и исходный покадровый цикл
+из ``advanced_note_processing`` (он сохранен как ``segment_notes_loop``),
+но работает с отрезками одинаковых значений, а не с отдельными кадрами:
+длинная выдержанная нота обрабатывается за O(1), фильтр длительности и
+медианы высоты считаются сразу для всех нот.
+
+``NoteSegmenter`` - тот же цикл в виде автомата, который получает кадры
+по одному (живой ввод) и сообщает о началах и концах нот по мере решения.
+
+Конвейер хранит ноты не списком кортежей, а структурированным массивом
+``NOTE_DTYPE`` (высота, начало, конец, velocity, уверенность):
+``segment_note_array`` строит его сразу, velocity каждой ноты считается
+векторно из RMS ее кадров.
+
+Совпадение всех реализаций с исходным циклом проверяет
+``tests/test_segmentation.py``.
+"""
+import numpy as np
+
+
+# Пока в ноте меньше стольких кадров, отклонение на полутон
+# считается дрожанием и поглощается текущей нотой
+ABSORB_FRAMES = 10
+
+NOTE_DTYPE = np.dtype([
+    ("pitch", np.int16),
+    ("onset", np.float64),
+    ("offset", np.float64),
+    ("velocity", np.uint8),
+    ("confidence", np.float32),
+])
+
+# Velocity по громкости ноты: нота с RMS VELOCITY_REF_DB (сигнал
+# нормализован по пику) получает базовую velocity, на VELOCITY_RANGE_DB
+# тише - MIN_VELOCITY
+VELOCITY_REF_DB = -10.0
+VELOCITY_RANGE_DB = 40.0
+MIN_VELOCITY = 20
+
+
+def _small_median(values):
+    """int(np.median(values)) для короткого списка без накладных расходов numpy"""
+    ordered = sorted(values)
+    mid = len(ordered) // 2
+    if len(ordered) % 2:
+        return int(ordered[mid])
+    return int((ordered[mid - 1] + ordered[mid]) / 2)
+
+
+def run_lengths(values):
+    """Начала, длины и значения отрезков из одинаковых подряд значений"""
+    values = np.asarray(values)
+    if len(values) == 0:
+        empty = np.zeros(0, dtype=np.intp)
+        return empty, empty, values[:0]
+    starts = np.concatenate(([0], np.flatnonzero(values[1:] != values[:-1]) + 1))
+    lengths = np.diff(np.append(starts, len(values)))
+    return starts, lengths, values[starts]
+
+
+def segment_medians(values, starts, stops):
+    """int(np.median(values[s:e])) для набора отрезков за один проход"""
+    if len(starts) == 0:
+        return np.zeros(0, dtype=np.int64)
+
+    lengths = stops - starts
+    seg_ids = np.repeat(np.arange(len(starts)), lengths)
+    # Индексы кадров всех отрезков подряд
+    frame_idx = np.arange(lengths.sum()) - np.repeat(np.cumsum(lengths) - lengths, lengths) + np.repeat(starts, lengths)
+    seg_values = values[frame_idx]
+
+    # Сортировка внутри каждого отрезка: сначала по отрезку, затем по значению
+    ordered = seg_values[np.lexsort((seg_values, seg_ids))]
+    offsets = np.cumsum(lengths) - lengths
+    lo = ordered[offsets + (lengths - 1) // 2]
+    hi = ordered[offsets + lengths // 2]
+    return np.trunc((lo + hi) / 2).astype(np.int64)
+
+
+def note_boundaries(notes_quantized):
+    """Границы нот: (первый кадр, кадр окончания) для каждой ноты.
+
+    Кадр окончания - это кадр, на котором нота закрылась (тишина или
+    новая нота), либо len(notes_quantized) для ноты, дошедшей до конца.
+    """
+    starts, lengths, values = run_lengths(notes_quantized)
+    note_starts = []
+    note_stops = []
+
+    current = None
+    count = 0
+    head = []
+
+    for run_start, run_length, value in zip(starts.tolist(), lengths.tolist(), values.tolist()):
+        # NaN (нет оценки высоты) - тоже тишина, как в исходном цикле
+        if not value > 0:
+            if current is not None:
+                note_stops.append(run_start)
+                current = None
+            continue
+
+        offset = run_start
+        remaining = run_length
+        if current is None:
+            current = value
+            note_starts.append(offset)
+            count = 1
+            head = [value]
+            offset += 1
+            remaining -= 1
+
+        while remaining > 0:
+            if value == current:
+                # Весь остаток отрезка продолжает ноту
+                head.extend([value] * min(remaining, ABSORB_FRAMES - len(head)))
+                count += remaining
+                remaining = 0
+            elif abs(value - current) < 2 and count < ABSORB_FRAMES:
+                # Небольшое изменение - продолжаем ноту
+                head.append(value)
+                count += 1
+                current = _small_median(head)
+                offset += 1
+                remaining -= 1
+            else:
+                # Значительное изменение - начинаем новую ноту
+                note_stops.append(offset)
+                note_starts.append(offset)
+                current = value
+                count = 1
+                head = [value]
+                offset += 1
+                remaining -= 1
+
+    if current is not None:
+        note_stops.append(len(notes_quantized))
+
+    return np.asarray(note_starts, dtype=np.intp), np.asarray(note_stops, dtype=np.intp)
+
+
+def _segments(notes_quantized, times, min_duration):
+    """(первые кадры, кадры окончания, высоты, начала, концы) нот не короче min_duration"""
+    notes_quantized = np.asarray(notes_quantized)
+    times = np.asarray(times)
+    empty = np.zeros(0, dtype=np.intp)
+    if len(notes_quantized) == 0:
+        return empty, empty, empty, times[:0], times[:0]
+
+    starts, stops = note_boundaries(notes_quantized)
+    if len(starts) == 0:
+        return empty, empty, empty, times[:0], times[:0]
+
+    # Нота, дошедшая до конца трека, заканчивается на последнем кадре
+    start_times = times[starts]
+    end_times = times[np.minimum(stops, len(times) - 1)]
+
+    keep = (end_times - start_times) >= min_duration
+    starts, stops = starts[keep], stops[keep]
+    pitches = segment_medians(notes_quantized, starts, stops)
+    return starts, stops, pitches, start_times[keep], end_times[keep]
+
+
+def segment_notes(notes_quantized, times, min_duration):
+    """Список нот (pitch, start, end) из квантованного трека"""
+    _, _, pitches, start_times, end_times = _segments(notes_quantized, times, min_duration)
+    return list(zip(pitches.tolist(), start_times.tolist(), end_times.tolist()))
+
+
+def segment_means(values, starts, stops):
+    """Среднее values по отрезкам [start, stop) за один проход"""
+    cumulative = np.concatenate(([0.0], np.cumsum(values, dtype=np.float64)))
+    return (cumulative[stops] - cumulative[starts]) / np.maximum(stops - starts, 1)
+
+
+def note_velocities(loudness, base_velocity):
+    """Velocity нот по их средней RMS (линейно в децибелах)"""
+    loudness_db = 20 * np.log10(np.maximum(loudness, 1e-10))
+    slope = (base_velocity - MIN_VELOCITY) / VELOCITY_RANGE_DB
+    velocity = base_velocity + (loudness_db - VELOCITY_REF_DB) * slope
+    return np.clip(np.round(velocity), MIN_VELOCITY, 127).astype(np.uint8)
+
+
+def segment_note_array(notes_quantized, times, min_duration, rms=None, confidence=None, base_velocity=88):
+    """Ноты квантованного трека массивом NOTE_DTYPE.
+
+    rms и confidence - покадровые значения на той же сетке, что и трек:
+    velocity ноты считается по ее средней RMS (без rms - base_velocity),
+    уверенность - среднее по ее кадрам.
+    """
+    starts, stops, pitches, start_times, end_times = _segments(notes_quantized, times, min_duration)
+    notes = np.zeros(len(starts), dtype=NOTE_DTYPE)
+    notes["pitch"] = pitches
+    notes["onset"] = start_times
+    notes["offset"] = end_times
+    if rms is None:
+        notes["velocity"] = base_velocity
+    else:
+        notes["velocity"] = note_velocities(segment_means(rms, starts, stops), base_velocity)
+    if confidence is not None:
+        notes["confidence"] = segment_means(confidence, starts, stops)
+    return notes
+
+
+def as_note_array(notes, velocity=88):
+    """Массив NOTE_DTYPE из массива нот или списка (pitch, start, end)"""
+    if isinstance(notes, np.ndarray) and notes.dtype == NOTE_DTYPE:
+        return notes
+    array = np.zeros(len(notes), dtype=NOTE_DTYPE)
+    if len(notes):
+        pitches, onsets, offsets = zip(*notes)
+        array["pitch"] = pitches
+        array["onset"] = onsets
+        array["offset"] = offsets
+        array["velocity"] = velocity
+    return array
+
+
+def note_tuples(notes):
+    """Список (pitch, start, end) из массива NOTE_DTYPE"""
+    return list(zip(notes["pitch"].tolist(), notes["onset"].tolist(), notes["offset"].tolist()))
+
+
+def segment_notes_loop(notes_quantized, times, min_duration):
+    """Исходный покадровый цикл сегментации (эталон для сверки)"""
+    notes = []
+    current_note = None
+    note_start = 0
+    note_pitches = []
+
+    for i, (note_num, time_val) in enumerate(zip(notes_quantized, times)):
+        if note_num > 0:
+            if current_note is None:
+                current_note = note_num
+                note_start = time_val
+                note_pitches = [note_num]
+            elif note_num != current_note:
+                # Проверяем, является ли изменение значительным
+                if abs(note_num - current_note) < 2 and len(note_pitches) < 10:
+                    # Небольшое изменение - продолжаем ноту
+                    note_pitches.append(note_num)
+                    current_note = int(np.median(note_pitches))
+                else:
+                    # Значительное изменение - начинаем новую ноту
+                    note_end = time_val
+                    duration = note_end - note_start
+
+                    if duration >= min_duration:
+                        final_pitch = int(np.median(note_pitches))
+                        notes.append((final_pitch, note_start, note_end))
+
+                    current_note = note_num
+                    note_start = time_val
+                    note_pitches = [note_num]
+            else:
+                note_pitches.append(note_num)
+        else:
+            if current_note is not None:
+                note_end = time_val
+                duration = note_end - note_start
+
+                if duration >= min_duration:
+                    final_pitch = int(np.median(note_pitches))
+                    notes.append((final_pitch, note_start, note_end))
+
+                current_note = None
+                note_pitches = []
+
+    # Добавляем последнюю ноту
+    if current_note is not None:
+        note_end = times[-1]
+        duration = note_end - note_start
+
+        if duration >= min_duration:
+            final_pitch = int(np.median(note_pitches))
+            notes.append((final_pitch, note_start, note_end))
+
+    return notes
+
+
+class NoteSegmenter:
+    """Покадровая сегментация с сохранением состояния между вызовами.
+
+    push() принимает один кадр (квантованная нота, время) и возвращает
+    события ("on", pitch, time) / ("off", pitch, time). Нота объявляется,
+    когда продержалась onset_frames кадров, и заканчивается на кадре, где
+    ее закрыл бы segment_notes_loop. В notes накапливается тот же список
+    (pitch, start, end), что у segment_notes_loop, с фильтром min_duration.
+    """
+
+    def __init__(self, min_duration, onset_frames=1):
+        self.min_duration = min_duration
+        self.onset_frames = max(1, onset_frames)
+        self.notes = []
+        self.current_note = None
+        self.note_start = 0.0
+        self.note_pitches = []
+        self.note_frames = 0
+        self.sounding = None
+        self.last_time = None
+
+    def _close(self, time_val):
+        events = []
+        if self.sounding is not None:
+            events.append(("off", self.sounding, time_val))
+            self.sounding = None
+        if time_val - self.note_start >= self.min_duration:
+            self.notes.append((int(np.median(self.note_pitches)), self.note_start, time_val))
+        return events
+
+    def _start(self, note_num, time_val):
+        self.current_note = note_num
+        self.note_start = time_val
+        self.note_pitches = [note_num]
+        self.note_frames = 1
+
+    def push(self, note_num, time_val):
+        """Следующий кадр трека. Возвращает список событий."""
+        events = []
+        self.last_time = time_val
+        if note_num > 0:
+            if self.current_note is None:
+                self._start(note_num, time_val)
+            elif note_num != self.current_note:
+                if abs(note_num - self.current_note) < 2 and len(self.note_pitches) < ABSORB_FRAMES:
+                    # Небольшое изменение - продолжаем ноту
+                    self.note_pitches.append(note_num)
+                    self.current_note = int(np.median(self.note_pitches))
+                    self.note_frames += 1
+                else:
+                    # Значительное изменение - начинаем новую ноту
+                    events.extend(self._close(time_val))
+                    self._start(note_num, time_val)
+            else:
+                self.note_pitches.append(note_num)
+                self.note_frames += 1
+
+            if self.sounding is None and self.note_frames >= self.onset_frames:
+                self.sounding = int(self.current_note)
+                events.append(("on", self.sounding, self.note_start))
+        elif self.current_note is not None:
+            events.extend(self._close(time_val))
+            self.current_note = None
+            self.note_pitches = []
+        return events
+
+    def finish(self):
+        """Конец потока: закрывает звучащую ноту на последнем кадре"""
+        events = []
+        if self.current_note is not None:
+            events = self._close(self.last_time)
+            self.current_note = None
+            self.note_pitches = []
+        return events
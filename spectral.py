@@ -0,0 +1,233 @@
+"""Общий спектральный этап предобработки.
+
+Раньше ``nr.reduce_noise`` и ``librosa.effects.hpss`` каждый считали свою
+STFT и ISTFT всего сигнала, а RMS затем еще раз считалась по отсчетам.
+Здесь STFT (2048/512 - те же параметры, что у HPSS и RMS) считается один
+раз: шумоподавление и выделение гармоник применяются как маски к одному
+спектру, а обратное преобразование делается один раз в конце. RMS
+считается по восстановленному сигналу во временной области: модули спектра
+с окном Ханна дают другую огибающую на атаках и спадах, и порог громкости
+сдвигал бы границы нот.
+
+Вся цепочка STFT -> маски -> ISTFT идет блоками кадров на нескольких
+потоках, и спектр целиком не хранится: память ограничена размером блока,
+а не длиной файла. Каждый блок считает STFT с соседними кадрами (контекст
+фильтров масок и HPSS), а в выходной сигнал пишет только свой участок,
+собранный сложением всех перекрывающих его кадров, поэтому на стыках
+блоков нет разрывов. Со стационарным профилем шума (``NoiseProfile``) и
+для HPSS результат совпадает с расчетом целиком; нестационарный гейт
+отличается на стыках лишь хвостом огибающей за пределами контекста.
+"""
+import hashlib
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import librosa
+import numpy as np
+
+
+N_FFT = 2048
+HOP_LENGTH = 512
+
+# Кадров спектра в одном блоке потоковой обработки (~95 с при 22050 Гц)
+SPECTRAL_BLOCK_FRAMES = 4096
+# Ядро медианных фильтров HPSS (как по умолчанию в librosa)
+HPSS_KERNEL = 31
+# Порог стационарного гейта: столько стандартных отклонений выше среднего шума
+NOISE_STD_THRESHOLD = 1.5
+
+
+def mask_smoothing_filter(sr, n_fft, hop_length, freq_smooth_hz=500, time_smooth_ms=50):
+    """Треугольное ядро сглаживания маски, как в noisereduce"""
+    n_grad_freq = max(1, int(freq_smooth_hz / (sr / (n_fft / 2))))
+    n_grad_time = max(1, int(time_smooth_ms / (hop_length / sr * 1000)))
+
+    def ramp(n):
+        return np.concatenate([np.linspace(0, 1, n + 1, endpoint=False), np.linspace(1, 0, n + 2)])[1:-1]
+
+    kernel = np.outer(ramp(n_grad_freq), ramp(n_grad_time))
+    return kernel / kernel.sum()
+
+
+def time_smoothed(magnitude, sr, hop_length, time_constant_s):
+    """Огибающая модулей по времени (IIR-фильтр вперед-назад)"""
+    from scipy.signal import filtfilt
+    t_frames = time_constant_s * sr / float(hop_length)
+    b = (np.sqrt(1 + 4 * t_frames ** 2) - 1) / (2 * t_frames ** 2)
+    return filtfilt([b], [1, b - 1], magnitude, axis=-1, padtype=None)
+
+
+def amplitude_db(magnitude):
+    return 20 * np.log10(magnitude + np.finfo(np.float32).eps)
+
+
+class NoiseProfile:
+    """Спектр шума записи: среднее и разброс уровня (дБ) по частотам.
+
+    Уровень хранится для исходного, ненормализованного сигнала, поэтому
+    профиль можно снять один раз и применять ко всем дублям одной сессии
+    или одного микрофона, как бы они ни нормализовались.
+    """
+
+    def __init__(self, mean_db, std_db, sr, n_fft=N_FFT):
+        self.mean_db = np.asarray(mean_db, dtype=np.float32)
+        self.std_db = np.asarray(std_db, dtype=np.float32)
+        self.sr = int(sr)
+        self.n_fft = int(n_fft)
+
+    @classmethod
+    def from_signal(cls, noise, sr, n_fft=N_FFT, hop_length=HOP_LENGTH, top_db=80.0):
+        """Профиль по отрезку без полезного сигнала (например, первой секунде)"""
+        magnitude = np.abs(librosa.stft(np.asarray(noise, dtype=np.float32), n_fft=n_fft, hop_length=hop_length))
+        noise_db = amplitude_db(magnitude)
+        # Цифровая тишина не должна опускать порог до -300 дБ
+        noise_db = np.maximum(noise_db, noise_db.max(axis=-1, keepdims=True) - top_db)
+        return cls(noise_db.mean(axis=1), noise_db.std(axis=1), sr, n_fft)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            return cls(data["mean_db"], data["std_db"], int(data["sr"]), int(data["n_fft"]))
+
+    def save(self, path):
+        """Сохраняет профиль. Файл появляется атомарно: параллельный load
+        видит либо старый профиль, либо новый, но не недописанный."""
+        tmp = f"{path}.tmp-{os.getpid()}-{time.monotonic_ns()}"
+        try:
+            # Через файловый объект, чтобы np.savez не дописывал .npz к имени
+            with open(tmp, "wb") as f:
+                np.savez(f, mean_db=self.mean_db, std_db=self.std_db, sr=self.sr, n_fft=self.n_fft)
+            os.replace(tmp, path)
+        except BaseException:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
+
+    def digest(self):
+        """Хэш профиля (часть ключа кэша)"""
+        h = hashlib.sha256()
+        h.update(f"{self.sr}/{self.n_fft}".encode())
+        h.update(self.mean_db.tobytes())
+        h.update(self.std_db.tobytes())
+        return h.hexdigest()
+
+    def threshold_db(self, sr, n_fft, gain=1.0):
+        """Порог гейта по частотам для сигнала, умноженного на gain"""
+        if (sr, n_fft) != (self.sr, self.n_fft):
+            raise ValueError(f"профиль шума снят для {self.sr} Гц / n_fft={self.n_fft}, "
+                             f"а сигнал {sr} Гц / n_fft={n_fft}")
+        return self.mean_db + NOISE_STD_THRESHOLD * self.std_db + 20 * np.log10(gain)
+
+
+class SpectralFrontEnd:
+    """Шумоподавление и HPSS одним потоковым проходом: STFT -> маски -> ISTFT блоками.
+
+    Спектр целиком не хранится: каждый блок кадров считает свою STFT с
+    контекстом (окрестность фильтров масок и HPSS), применяет маски и сразу
+    восстанавливает свой участок сигнала. Кадры, перекрывающие участок,
+    берутся полностью, поэтому сложение перекрытий на стыках блоков дает
+    то же, что ISTFT всего спектра. Память - блок на поток, а не длина файла.
+    """
+
+    def __init__(self, sr, n_fft=N_FFT, hop_length=HOP_LENGTH, block_frames=SPECTRAL_BLOCK_FRAMES):
+        self.sr = sr
+        self.n_fft = n_fft
+        self.hop_length = hop_length
+        self.block_frames = block_frames
+        self._gate = None
+        self._gate_context = 0
+        self._prop_decrease = 0.0
+        self._harmonic_margin = None
+
+    @property
+    def active(self):
+        """Есть ли что делать (включено шумоподавление или HPSS)"""
+        return self._gate is not None or self._harmonic_margin is not None
+
+    def reduce_noise(self, prop_decrease=0.75, profile=None, gain=1.0,
+                     time_constant_s=2.0, thresh_n_mult=2, sigmoid_slope=10):
+        """Включает спектральное гейтирование.
+
+        С профилем шума - стационарный гейт (порог по частотам из профиля,
+        gain - множитель, которым сигнал уже нормализован). Без профиля -
+        нестационарный гейт относительно огибающей самого сигнала, как
+        nr.reduce_noise по умолчанию. Профиль другой частоты - ValueError.
+        """
+        kernel = mask_smoothing_filter(self.sr, self.n_fft, self.hop_length)
+        context = kernel.shape[1] // 2
+
+        if profile is not None:
+            threshold = profile.threshold_db(self.sr, self.n_fft, gain)[:, np.newaxis]
+
+            def gate(magnitude):
+                return (amplitude_db(magnitude) > threshold).astype(np.float32)
+        else:
+            # Огибающая затухает с постоянной t_frames - четырех постоянных
+            # контекста хватает, чтобы стыки блоков не были слышны
+            context += int(4 * time_constant_s * self.sr / self.hop_length)
+
+            def gate(magnitude):
+                smooth = time_smoothed(magnitude, self.sr, self.hop_length, time_constant_s)
+                with np.errstate(divide="ignore", invalid="ignore"):
+                    above = (magnitude - smooth) / smooth
+                above = np.nan_to_num(above, nan=0.0, posinf=0.0, neginf=0.0)
+                return 1 / (1 + np.exp(-(above - thresh_n_mult) * sigmoid_slope))
+
+        def smoothed_gate(magnitude):
+            from scipy.signal import fftconvolve
+            return fftconvolve(gate(magnitude), kernel, mode="same")
+
+        self._gate = smoothed_gate
+        self._gate_context = context
+        self._prop_decrease = prop_decrease
+
+    def harmonic(self, margin=1.0):
+        """Включает выделение гармонической составляющей (маска HPSS)"""
+        self._harmonic_margin = margin
+
+    def process(self, y, jobs=None, check=None):
+        """Обработанный сигнал той же длины. check - проверка отмены перед каждым блоком."""
+        y = np.asarray(y, dtype=np.float32)
+        out = np.zeros(len(y), dtype=np.float32)
+        n_frames = 1 + len(y) // self.hop_length
+        # Кадров, перекрывающих один отсчет: столько нужно по краям участка для ISTFT
+        overlap = self.n_fft // self.hop_length
+        hpss_context = HPSS_KERNEL // 2 if self._harmonic_margin is not None else 0
+
+        def process_block(start):
+            if check is not None:
+                check()
+            stop = min(n_frames, start + self.block_frames)
+            out_lo, out_hi = max(0, start - overlap), min(n_frames, stop + overlap)
+            hpss_lo, hpss_hi = max(0, out_lo - hpss_context), min(n_frames, out_hi + hpss_context)
+            lo, hi = max(0, hpss_lo - self._gate_context), min(n_frames, hpss_hi + self._gate_context)
+
+            stft = self._stft_frames(y, lo, hi)
+            if self._gate is not None:
+                mask = self._gate(np.abs(stft))
+                stft *= (mask * self._prop_decrease + (1.0 - self._prop_decrease)).astype(np.float32)
+            stft = stft[:, hpss_lo - lo:hpss_hi - lo]
+            if self._harmonic_margin is not None:
+                stft, _ = librosa.decompose.hpss(stft, kernel_size=HPSS_KERNEL, margin=self._harmonic_margin)
+            stft = stft[:, out_lo - hpss_lo:out_hi - hpss_lo]
+
+            # Сигнал кадров [out_lo, out_hi) начинается за полкадра до центра первого
+            segment = librosa.istft(stft, hop_length=self.hop_length, n_fft=self.n_fft, center=False)
+            offset = out_lo * self.hop_length - self.n_fft // 2
+            first, last = start * self.hop_length, min(len(y), stop * self.hop_length)
+            out[first:last] = segment[first - offset:last - offset]
+
+        starts = range(0, n_frames, self.block_frames)
+        with ThreadPoolExecutor(max_workers=jobs or os.cpu_count() or 1) as pool:
+            list(pool.map(process_block, starts))
+        return out
+
+    def _stft_frames(self, y, first, last):
+        """STFT кадров [first, last) сетки center=True (нули за краями сигнала)"""
+        start = first * self.hop_length - self.n_fft // 2
+        stop = (last - 1) * self.hop_length + self.n_fft // 2
+        segment = y[max(0, start):min(len(y), stop)]
+        if start < 0 or stop > len(y):
+            segment = np.pad(segment, (max(0, -start), max(0, stop - len(y))))
+        return librosa.stft(segment, n_fft=self.n_fft, hop_length=self.hop_length, center=False)
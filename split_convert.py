@@ -0,0 +1,152 @@
+"""Параллельная конвертация одного длинного файла.
+
+Запись режется по паузам на независимые фрагменты, и для каждого
+фрагмента весь конвейер (предобработка -> высота тона -> ноты) выполняется
+в отдельном процессе. Резы проходят по середине пауз длиннее
+``min_silence`` - там сигнал тише порога громкости, поэтому ни одна нота
+не может оказаться разрезанной. Нормализация делается один раз по всему
+файлу, а профиль шума (если он задан) снимается один раз и передается
+всем фрагментам.
+"""
+import multiprocessing
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import librosa
+import numpy as np
+
+from batch_convert import warm_worker
+from detector_pool import SharedSignal, attach_signal
+from engine import ConversionParams, ConversionResult, ConversionError, VocalToMIDIEngine
+from midi_writer import write_midi
+from segmentation import as_note_array, run_lengths
+
+
+def find_cut_points(y, sr, threshold, min_silence=0.5, target_seconds=60.0, hop_length=512):
+    """Отсчеты, по которым можно резать запись.
+
+    Кандидаты - середины пауз (RMS ниже threshold) длиннее min_silence.
+    Из них выбираются резы так, чтобы фрагменты были не короче target_seconds.
+    """
+    rms = librosa.feature.rms(y=y, frame_length=2048, hop_length=hop_length)[0]
+    starts, lengths, silent = run_lengths(rms < threshold)
+
+    min_frames = int(np.ceil(min_silence * sr / hop_length))
+    long_pauses = silent & (lengths >= min_frames)
+    candidates = (starts[long_pauses] + lengths[long_pauses] // 2) * hop_length
+
+    cuts = []
+    last_cut = 0
+    target = int(target_seconds * sr)
+    for cut in candidates.tolist():
+        if cut - last_cut >= target and len(y) - cut >= target // 2:
+            cuts.append(cut)
+            last_cut = cut
+    return cuts
+
+
+def split_spans(n_samples, cuts):
+    """Фрагменты [start, stop) между точками реза"""
+    bounds = [0] + list(cuts) + [n_samples]
+    return list(zip(bounds[:-1], bounds[1:]))
+
+
+def _transcribe_segment(name, length, start, stop, sr, params_dict, gain, noise_profile):
+    """Задача рабочего процесса: (ноты фрагмента со сдвигом к началу файла, замеры этапов)"""
+    y, shm = attach_signal(name, length)
+    try:
+        segment = np.array(y[start:stop])
+    finally:
+        del y
+        shm.close()
+
+    engine = VocalToMIDIEngine(ConversionParams.from_dict(params_dict))
+    try:
+        notes = engine.transcribe(segment, sr, gain=gain, noise_profile=noise_profile)
+    except ConversionError:
+        # В фрагменте нет нот - это нормально для длинной записи
+        return as_note_array([]), engine.trace.records
+
+    notes["onset"] += start / sr
+    notes["offset"] += start / sr
+    return notes, engine.trace.records
+
+
+def transcribe_split(y, sr, params, jobs, target_seconds=60.0, min_silence=0.5, progress_callback=None,
+                     trace=None):
+    """Ноты всей записи, посчитанные по фрагментам на пуле процессов.
+
+    trace - StageTrace, в который добавляются замеры этапов каждого фрагмента.
+    """
+    noise_profile = VocalToMIDIEngine(params).noise_profile_for(y, sr)
+    peak = np.max(np.abs(y)) if len(y) else 0.0
+    gain = 1.0 / peak if peak > 0 else 1.0
+    y = y * gain
+
+    threshold = min(params.volume_threshold, params.vad_threshold)
+    spans = split_spans(len(y), find_cut_points(y, sr, threshold, min_silence, target_seconds))
+
+    # Ядра уже заняты фрагментами - отдельный процесс для PYIN
+    # внутри каждого фрагмента только мешал бы
+    params_dict = params.to_dict()
+    params_dict["parallel_detectors"] = False
+
+    signal = SharedSignal(y)
+    notes = [as_note_array([])]
+    try:
+        context = multiprocessing.get_context("spawn")
+        with ProcessPoolExecutor(max_workers=jobs, mp_context=context,
+                                 initializer=warm_worker, initargs=(params_dict,)) as pool:
+            futures = {
+                pool.submit(_transcribe_segment, signal.name, signal.length, start, stop, sr,
+                            params_dict, gain, noise_profile): index
+                for index, (start, stop) in enumerate(spans)
+            }
+            done_samples = 0
+            for done, future in enumerate(as_completed(futures), 1):
+                segment_notes, records = future.result()
+                notes.append(segment_notes)
+                index = futures[future]
+                if trace is not None:
+                    for record in records:
+                        record.thread = f"фрагмент {index + 1}"
+                    trace.records.extend(records)
+                # Время фрагмента пропорционально его длине, а не их числу
+                start, stop = spans[index]
+                done_samples += stop - start
+                if progress_callback is not None:
+                    progress_callback(10 + 70 * done_samples / max(len(y), 1),
+                                      f"Обработано фрагментов: {done} из {len(futures)}")
+    finally:
+        signal.release()
+
+    notes = np.concatenate(notes)
+    return notes[np.argsort(notes["onset"], kind="stable")]
+
+
+def convert_split(input_path, output_path, params, jobs, target_seconds=60.0, progress_callback=None):
+    """Конвертирует длинный файл, распределяя фрагменты по jobs процессам"""
+    started = time.perf_counter()
+    engine = VocalToMIDIEngine(params, progress_callback=progress_callback)
+
+    y, sr = engine.load_audio(input_path)
+    notes = transcribe_split(y, sr, params, jobs, target_seconds, progress_callback=progress_callback,
+                             trace=engine.trace)
+    if len(notes) == 0:
+        raise ConversionError("Не удалось извлечь ноты из аудио")
+
+    # Фрагменты довели шкалу до 80%, остаток - по оценкам этапов записи
+    engine.progress.plan(["midi", "midi_write"], len(y) / sr, low=80.0)
+    playable = engine.playable_notes(notes)
+    with engine.stage("midi_write", playable):
+        write_midi(output_path, playable, params.instrument_program)
+    engine.update_progress(100, "Конвертация завершена!")
+
+    return ConversionResult(
+        input_path=str(input_path),
+        output_path=str(output_path),
+        note_count=len(notes),
+        audio_duration=len(y) / sr,
+        elapsed=time.perf_counter() - started,
+        stages=engine.trace.records,
+    )
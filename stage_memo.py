@@ -0,0 +1,82 @@
+"""Память сессии для промежуточных результатов конвейера.
+
+Конвейер - граф этапов:
+
+    decode -> normalize -> spectral -> rms
+    spectral -> crepe, pyin -> fusion -> segmentation -> midi -> midi_write
+
+Результат тяжелого этапа (декодирование, RMS, треки CREPE и PYIN) хранится
+под ключом из его входа (файл или хэш сигнала) и только тех параметров,
+от которых этап зависит (``VocalToMIDIEngine.stage_settings``). Поэтому при
+смене, например, минимальной длительности ноты или инструмента заново
+считаются лишь сегментация и MIDI, а при смене метода - только новый
+детектор. Объем памяти ограничен: сверх лимита вытесняются записи, к
+которым дольше всего не обращались.
+"""
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+
+# Лимит памяти сессии GUI по умолчанию
+SESSION_MEMO_MB = 512
+
+
+def value_nbytes(value):
+    """Примерный объем результата этапа в байтах"""
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    if isinstance(value, dict):
+        return sum(value_nbytes(item) for item in value.values())
+    if isinstance(value, (list, tuple)):
+        return sum(value_nbytes(item) for item in value)
+    return getattr(value, "nbytes", 0)
+
+
+class StageMemo:
+    """LRU-хранилище результатов этапов с ограничением по объему"""
+
+    def __init__(self, max_bytes=SESSION_MEMO_MB * 1024 ** 2):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._entries
+
+    def get(self, key):
+        with self._lock:
+            value = self._entries.get(key)
+            if value is not None:
+                self._entries.move_to_end(key)
+            return value
+
+    def put(self, key, value):
+        """Сохраняет результат. Результат больше всего лимита не сохраняется."""
+        if value is None or value_nbytes(value) > self.max_bytes:
+            return
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            self._evict()
+
+    def nbytes(self):
+        with self._lock:
+            return sum(value_nbytes(value) for value in self._entries.values())
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def _evict(self):
+        # Объем пересчитывается целиком: AudioSource растет после сохранения
+        # (копии на других частотах), а записей в сессии немного
+        total = sum(value_nbytes(value) for value in self._entries.values())
+        while total > self.max_bytes and len(self._entries) > 1:
+            _, value = self._entries.popitem(last=False)
+            total -= value_nbytes(value)
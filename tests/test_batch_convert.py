@@ -0,0 +1,38 @@
+"""Пути результатов пакетной конвертации"""
+import os
+import sys
+from pathlib import Path
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from batch_convert import collect_inputs, output_path_for  # noqa: E402
+
+
+def touch(path):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_bytes(b"")
+    return path
+
+
+def test_recursive_outputs_mirror_input_tree(tmp_path):
+    stems = tmp_path / "stems"
+    touch(stems / "a" / "take1.wav")
+    touch(stems / "b" / "take1.wav")
+    touch(stems / "notes.txt")
+    files = collect_inputs([stems], recursive=True)
+    outputs = [output_path_for(path, relative, tmp_path / "out") for path, relative in files]
+    assert outputs == [tmp_path / "out" / "a" / "take1.mid", tmp_path / "out" / "b" / "take1.mid"]
+
+
+def test_single_file_and_default_output(tmp_path):
+    take = touch(tmp_path / "dir" / "take.flac")
+    (path, relative), = collect_inputs([take])
+    assert relative == Path("take.flac")
+    assert output_path_for(path, relative, None) == tmp_path / "dir" / "take.mid"
+    assert output_path_for(path, relative, tmp_path / "out", ".prof") == tmp_path / "out" / "take.prof"
+
+
+def test_flat_directory_is_not_recursed(tmp_path):
+    touch(tmp_path / "top.mp3")
+    touch(tmp_path / "sub" / "deep.mp3")
+    assert [relative for _, relative in collect_inputs([tmp_path])] == [Path("top.mp3")]
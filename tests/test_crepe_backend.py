@@ -0,0 +1,122 @@
+"""Общие батчи CREPE для нескольких файлов против расчета каждого файла отдельно"""
+import os
+import sys
+import threading
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from crepe_backend import (ACTIVATION_BINS, FRAME_LENGTH, CrepeBatcher, CrepeSession,  # noqa: E402
+                           frame_count)
+
+
+SR = 22050
+
+
+class StubModel:
+    """Модель-заглушка: активации - функция только своего кадра, как у CREPE"""
+
+    def __init__(self, seed=0):
+        self.weights = np.random.default_rng(seed).standard_normal((FRAME_LENGTH, ACTIVATION_BINS)) / 32
+        self.batches = []
+
+    def predict(self, frames, batch_size, verbose=0):
+        self.batches.append(len(frames))
+        # float64 и по кадру: результат не зависит от того, с какими кадрами
+        # модель получила этот кадр в один батч
+        return np.stack([1 / (1 + np.exp(-frame.astype(np.float64) @ self.weights)) for frame in frames])
+
+
+class StubSession(CrepeSession):
+    def __init__(self, model):
+        self.model_capacity = "stub"
+        self.model = model
+        self.warmed_up = False
+
+
+def signals():
+    rng = np.random.default_rng(1)
+    t = np.arange(int(3.5 * SR)) / SR
+    return [(0.5 * np.sin(2 * np.pi * freq * t[:int(seconds * SR)])
+             + 0.01 * rng.standard_normal(int(seconds * SR))).astype(np.float32)
+            for freq, seconds in ((220.0, 1.0), (330.0, 3.5), (196.0, 0.2), (440.0, 2.3))]
+
+
+def fill(session, y, **kwargs):
+    out = np.zeros((frame_count(len(y), SR, 10), ACTIVATION_BINS), dtype=np.float32)
+    return session.fill_activation(y, SR, out, chunk_seconds=0.5, **kwargs)
+
+
+def run_clients(batcher, session, ys, checks=None):
+    """Каждый файл - в своем потоке через общий batcher; (результаты, ошибки)"""
+    results, errors = [None] * len(ys), [None] * len(ys)
+    checks = checks or [None] * len(ys)
+
+    def client(index):
+        try:
+            results[index] = fill(session, ys[index], batcher=batcher, check=checks[index])
+        except BaseException as e:
+            errors[index] = e
+        finally:
+            batcher.leave()
+
+    threads = [threading.Thread(target=client, args=(index,)) for index in range(len(ys))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(timeout=60)
+    assert not any(thread.is_alive() for thread in threads)
+    return results, errors
+
+
+def test_batched_clients_match_unbatched_fill_activation():
+    ys = signals()
+    model = StubModel()
+    session = StubSession(model)
+    expected = [fill(session, y) for y in ys]
+    unbatched_calls = len(model.batches)
+
+    model.batches.clear()
+    batcher = CrepeBatcher(session, len(ys), frames_per_call=300)
+    results, errors = run_clients(batcher, session, ys)
+
+    assert errors == [None] * len(ys)
+    for result, reference in zip(results, expected):
+        np.testing.assert_array_equal(result, reference)
+    # Окна разных файлов действительно шли в модель вместе
+    assert batcher.calls < unbatched_calls
+    assert batcher.frames == sum(len(reference) for reference in expected)
+
+
+def test_model_error_reaches_every_waiting_client():
+    class FailingModel(StubModel):
+        def predict(self, frames, batch_size, verbose=0):
+            raise RuntimeError("модель упала")
+
+    ys = signals()
+    session = StubSession(FailingModel())
+    batcher = CrepeBatcher(session, len(ys), frames_per_call=10 ** 6)
+    results, errors = run_clients(batcher, session, ys)
+    assert results == [None] * len(ys)
+    assert all(isinstance(error, RuntimeError) for error in errors)
+
+
+def test_cancelled_client_does_not_block_the_others():
+    class Cancelled(Exception):
+        pass
+
+    def cancel():
+        raise Cancelled()
+
+    ys = signals()
+    session = StubSession(StubModel())
+    expected = [fill(session, y) for y in ys]
+    # Второй файл отменяется на первом же окне; остальные не должны ждать его кадров
+    batcher = CrepeBatcher(session, len(ys), frames_per_call=10 ** 6)
+    results, errors = run_clients(batcher, session, ys, checks=[None, cancel, None, None])
+
+    assert isinstance(errors[1], Cancelled)
+    for index in (0, 2, 3):
+        assert errors[index] is None
+        np.testing.assert_array_equal(results[index], expected[index])
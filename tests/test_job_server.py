@@ -0,0 +1,132 @@
+"""Сервер заданий: порядок по приоритету, 503 при полной очереди, отмена"""
+import json
+import os
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from engine import ConversionParams  # noqa: E402
+from job_server import (CANCELLED, DONE, FINISHED_STATES, QUEUED, RETRY_AFTER_SECONDS, RUNNING,  # noqa: E402
+                        JobClient, JobServer, QueueFull, ServerBusy, make_http_server)
+
+
+SR = 22050
+
+
+def melody_pcm(notes=2, seconds=0.5, pause=0.25):
+    """Тоны с паузами в байтах f32le"""
+    t = np.arange(int(seconds * SR)) / SR
+    parts = []
+    for freq in np.geomspace(196.0, 392.0, notes):
+        parts += [0.5 * np.sin(2 * np.pi * freq * t), np.zeros(int(pause * SR))]
+    return np.concatenate(parts).astype("<f4").tobytes()
+
+
+@pytest.fixture
+def make_server():
+    servers = []
+
+    def make(**kwargs):
+        server = JobServer(ConversionParams(method="yin", use_noise_reduction=False,
+                                            use_harmonic_percussive=False), **kwargs)
+        servers.append(server)
+        return server
+
+    yield make
+    for server in servers:
+        server.close()
+
+
+def wait_finished(server, job_id, timeout=120):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        status = server.status(job_id)
+        if status["state"] in FINISHED_STATES:
+            return status
+        time.sleep(0.05)
+    raise AssertionError(f"задание {job_id} не завершилось: {server.status(job_id)}")
+
+
+def test_jobs_run_by_priority_then_submission_order(make_server):
+    server = make_server(workers=1)
+    pcm = melody_pcm()
+    # Очередь копится до запуска: иначе первое задание сразу уйдет в работу
+    ids = {name: server.submit(priority=priority, pcm=pcm, sample_rate=SR)["id"]
+           for name, priority in (("low1", 0), ("high1", 5), ("low2", 0), ("high2", 5), ("mid", 1))}
+    assert [server.status(ids[name])["position"] for name in ("high1", "high2", "mid", "low1", "low2")] == \
+        [0, 1, 2, 3, 4]
+
+    # Отмена ждущего задания - сразу, в работу оно уже не попадет
+    assert server.cancel(ids["low2"])["state"] == CANCELLED
+    assert server.status(ids["low1"])["position"] == 3
+
+    server.start()
+    statuses = {name: wait_finished(server, job_id) for name, job_id in ids.items()}
+    assert statuses["low2"]["state"] == CANCELLED and statuses["low2"]["started"] is None
+    done = sorted((status["started"], name) for name, status in statuses.items() if status["state"] == DONE)
+    assert [name for _, name in done] == ["high1", "high2", "mid", "low1"]
+    assert all(statuses[name]["note_count"] > 0 for name in ("high1", "high2", "mid", "low1"))
+
+
+def test_full_queue_answers_503_with_retry_after(make_server):
+    server = make_server(workers=1, max_queue=2)
+    httpd = make_http_server(server, port=0)
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    try:
+        url = f"http://127.0.0.1:{httpd.server_address[1]}"
+        client = JobClient(url)
+        samples = np.frombuffer(melody_pcm(), dtype="<f4")
+        first = client.submit_pcm(samples, SR)
+        client.submit_pcm(samples, SR, priority=3)
+
+        with pytest.raises(ServerBusy) as busy:
+            client.submit_pcm(samples, SR)
+        assert busy.value.retry_after == RETRY_AFTER_SECONDS
+
+        request = urllib.request.Request(f"{url}/jobs?sample_rate={SR}", data=samples.tobytes(), method="POST")
+        with pytest.raises(urllib.error.HTTPError) as error:
+            urllib.request.urlopen(request, timeout=10)
+        assert error.value.code == 503
+        assert error.value.headers["Retry-After"] == str(RETRY_AFTER_SECONDS)
+        assert "error" in json.loads(error.value.read().decode("utf-8"))
+
+        # Отмененное задание освобождает место в очереди
+        client.cancel(first)
+        assert client.status(client.submit_pcm(samples, SR))["state"] == QUEUED
+        with pytest.raises(QueueFull):
+            server.submit(pcm=samples.tobytes(), sample_rate=SR)
+    finally:
+        httpd.shutdown()
+        httpd.server_close()
+
+
+def test_cancel_running_job(make_server):
+    server = make_server(workers=1)
+    server.start()
+    # Длинная запись PYIN с паузами: отмена проверяется между активными участками
+    job_id = server.submit({"method": "pyin"}, pcm=melody_pcm(notes=60, seconds=1.0, pause=0.5),
+                           sample_rate=SR)["id"]
+    deadline = time.monotonic() + 120
+    while True:
+        status = server.status(job_id)
+        assert status["state"] in (QUEUED, RUNNING) and time.monotonic() < deadline
+        if status["state"] == RUNNING and status["progress"] > 0:
+            break
+        time.sleep(0.05)
+
+    cancelled_at = time.time()
+    server.cancel(job_id)
+    status = wait_finished(server, job_id)
+    assert status["state"] == CANCELLED
+    assert status["finished"] - cancelled_at < 5.0
+
+    # Рабочий процесс после отмены принимает новые задания
+    next_id = server.submit(pcm=melody_pcm(), sample_rate=SR)["id"]
+    assert wait_finished(server, next_id)["state"] == DONE
@@ -0,0 +1,74 @@
+"""Запись MIDI: байты encode_smf, прочитанные обратно pretty_midi и mido"""
+import io
+import os
+import sys
+
+import mido
+import numpy as np
+import pretty_midi
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from midi_writer import TICKS_PER_BEAT, TICKS_PER_SECOND, encode_smf  # noqa: E402
+from segmentation import NOTE_DTYPE  # noqa: E402
+
+
+def note_array(rows):
+    notes = np.zeros(len(rows), dtype=NOTE_DTYPE)
+    for i, (pitch, onset, offset, velocity) in enumerate(rows):
+        notes[i] = (pitch, onset, offset, velocity, 1.0)
+    return notes
+
+
+def read_back(data):
+    return pretty_midi.PrettyMIDI(io.BytesIO(data)), mido.MidiFile(file=io.BytesIO(data))
+
+
+def note_messages(midi):
+    """(абсолютный тик, тип, высота, velocity) событий нот единственной дорожки"""
+    tick, events = 0, []
+    for message in midi.tracks[0]:
+        tick += message.time
+        if message.type in ("note_on", "note_off"):
+            events.append((tick, message.type, message.note, message.velocity))
+    return events
+
+
+def test_notes_read_back_with_times_pitches_and_velocities():
+    # Последняя нота далеко: дельта больше 2^21 тиков занимает все 4 байта
+    rows = [(60, 0.0, 0.5, 100), (64, 0.5, 1.25, 80), (67, 0.75, 1.0, 0), (72, 3000.0, 3000.5, 127)]
+    pm, midi = read_back(encode_smf(note_array(rows), program=40))
+
+    assert midi.ticks_per_beat == TICKS_PER_BEAT
+    instrument, = pm.instruments
+    assert instrument.program == 40
+    notes = sorted(instrument.notes, key=lambda note: (note.start, note.pitch))
+    assert [note.pitch for note in notes] == [60, 64, 67, 72]
+    # velocity 0 - это note-off, поэтому нота пишется с velocity 1
+    assert [note.velocity for note in notes] == [100, 80, 1, 127]
+    np.testing.assert_allclose([(note.start, note.end) for note in notes],
+                               [(onset, offset) for _, onset, offset, _ in rows], atol=1e-9)
+
+    ticks = [tick for tick, kind, _, _ in note_messages(midi) if kind == "note_on"]
+    assert ticks == [round(onset * TICKS_PER_SECOND) for _, onset, _, _ in rows]
+
+
+def test_note_off_precedes_note_on_on_the_same_tick():
+    # Повтор той же высоты встык: снятие старой ноты должно идти первым,
+    # иначе плеер погасит только что взятую
+    pm, midi = read_back(encode_smf(note_array([(60, 0.0, 0.5, 90), (60, 0.5, 1.0, 90)])))
+    events = note_messages(midi)
+    assert events == [(0, "note_on", 60, 90), (480, "note_off", 60, 0),
+                      (480, "note_on", 60, 90), (960, "note_off", 60, 0)]
+    assert [(note.start, note.end) for note in pm.instruments[0].notes] == [(0.0, 0.5), (0.5, 1.0)]
+
+
+def test_note_shorter_than_a_tick_still_sounds():
+    events = note_messages(read_back(encode_smf(note_array([(62, 1.0, 1.0, 70)])))[1])
+    assert [tick for tick, _, _, _ in events] == [960, 961]
+
+
+def test_empty_note_array():
+    pm, midi = read_back(encode_smf(np.zeros(0, dtype=NOTE_DTYPE)))
+    assert note_messages(midi) == []
+    assert all(not instrument.notes for instrument in pm.instruments)
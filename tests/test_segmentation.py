@@ -0,0 +1,84 @@
+"""Сверка векторной сегментации и NoteSegmenter с исходным покадровым циклом"""
+import os
+import sys
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from segmentation import (NoteSegmenter, note_tuples, segment_note_array, segment_notes,  # noqa: E402
+                          segment_notes_loop)
+
+
+FRAME_SECONDS = 512 / 22050
+
+
+def random_track(rng, n_frames):
+    """Случайный квантованный трек: ноты, дрожание на полутон, паузы"""
+    track = np.zeros(n_frames)
+    pos = 0
+    while pos < n_frames:
+        length = int(rng.integers(1, 40))
+        if rng.random() < 0.25:
+            pos += length
+            continue
+        pitch = float(rng.integers(40, 80))
+        segment = np.full(length, pitch)
+        wobble = rng.random(length) < 0.2
+        segment[wobble] += rng.choice([-2.0, -1.0, 1.0, 2.0], size=wobble.sum())
+        track[pos:pos + length] = segment[:n_frames - pos]
+        pos += length
+    return track
+
+
+def streamed_notes(track, times, min_duration):
+    segmenter = NoteSegmenter(min_duration)
+    for note_num, time_val in zip(track, times):
+        segmenter.push(note_num, time_val)
+    segmenter.finish()
+    return segmenter.notes
+
+
+def assert_all_match(track, min_duration):
+    times = np.arange(len(track)) * FRAME_SECONDS
+    expected = segment_notes_loop(track, times, min_duration)
+    assert segment_notes(track, times, min_duration) == expected
+    assert note_tuples(segment_note_array(track, times, min_duration)) == expected
+    assert streamed_notes(track, times, min_duration) == expected
+    return expected
+
+
+@pytest.mark.parametrize("seed", range(10))
+def test_random_tracks_match_loop(seed):
+    rng = np.random.default_rng(seed)
+    for _ in range(50):
+        track = random_track(rng, int(rng.integers(0, 2000)))
+        assert_all_match(track, float(rng.choice([0.0, 0.05, 0.08, 0.2])))
+
+
+def test_empty_track():
+    assert assert_all_match(np.zeros(0), 0.08) == []
+    assert len(segment_note_array(np.zeros(0), np.zeros(0), 0.08)) == 0
+
+
+def test_all_nan_track_has_no_notes():
+    assert assert_all_match(np.full(100, np.nan), 0.0) == []
+
+
+def test_nan_frames_are_silence():
+    track = np.array([np.nan, 60, 60, 60, np.nan, 62, 62, np.nan])
+    notes = assert_all_match(track, 0.0)
+    assert [pitch for pitch, _, _ in notes] == [60, 62]
+
+
+def test_single_frame():
+    assert assert_all_match(np.array([60.0]), 0.0) == [(60, 0.0, 0.0)]
+    assert assert_all_match(np.array([60.0]), 0.08) == []
+    assert assert_all_match(np.array([0.0]), 0.0) == []
+
+
+def test_semitone_wobble_is_absorbed():
+    track = np.array([60, 60, 61, 60, 60, 60, 60, 60, 60, 60, 60, 60, 0], dtype=float)
+    notes = assert_all_match(track, 0.0)
+    assert len(notes) == 1 and notes[0][0] == 60
@@ -0,0 +1,83 @@
+"""Спектральная предобработка: RMS и сигнал против librosa"""
+import os
+import sys
+
+import librosa
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from engine import ConversionParams, VocalToMIDIEngine  # noqa: E402
+from spectral import NoiseProfile, SpectralFrontEnd  # noqa: E402
+
+
+SR = 22050
+
+
+def phrase(rng):
+    """Ноты с атаками и спадами, паузы и слабый шум"""
+    parts = []
+    for freq in (220.0, 261.6, 196.0, 329.6):
+        t = np.arange(int(0.5 * SR)) / SR
+        envelope = np.minimum(1, t / 0.03) * np.minimum(1, (t[-1] - t) / 0.08)
+        parts += [0.6 * envelope * np.sin(2 * np.pi * freq * t), 0.002 * rng.standard_normal(int(0.3 * SR))]
+    return np.concatenate(parts).astype(np.float32)
+
+
+def test_rms_matches_time_domain_rms_after_hpss():
+    y = phrase(np.random.default_rng(0))
+    engine = VocalToMIDIEngine(ConversionParams(method="yin", use_noise_reduction=False,
+                                                use_harmonic_percussive=True))
+    _, _, _, rms = engine.analyse(y, SR)
+
+    y_norm = y / np.max(np.abs(y))
+    expected = librosa.feature.rms(y=librosa.effects.harmonic(y_norm, margin=1.0), frame_length=2048,
+                                   hop_length=512)[0]
+    np.testing.assert_allclose(rms, expected, rtol=1e-4, atol=1e-6)
+
+
+def long_phrase():
+    rng = np.random.default_rng(1)
+    return np.tile(phrase(rng), 3) + 0.01 * rng.standard_normal(3 * len(phrase(rng))).astype(np.float32)
+
+
+def test_streamed_blocks_match_whole_signal():
+    # Блоки по 40 кадров против одного блока на весь сигнал (обычный расчет целиком)
+    y = long_phrase()
+    profile = NoiseProfile.from_signal(0.01 * np.random.default_rng(2).standard_normal(SR), SR)
+
+    def run(block_frames, **noise):
+        front = SpectralFrontEnd(SR, block_frames=block_frames)
+        front.reduce_noise(**noise)
+        front.harmonic()
+        return front.process(y, jobs=2)
+
+    whole = run(10 ** 6, profile=profile)
+    assert whole.shape == y.shape
+    np.testing.assert_allclose(run(40, profile=profile), whole, atol=1e-5)
+
+    # Нестационарный гейт: огибающая за пределами контекста блока отброшена
+    whole = run(10 ** 6)
+    np.testing.assert_allclose(run(40), whole, atol=1e-3)
+
+
+def test_hpss_only_matches_librosa_harmonic():
+    y = long_phrase()
+    front = SpectralFrontEnd(SR, block_frames=40)
+    front.harmonic()
+    np.testing.assert_allclose(front.process(y), librosa.effects.harmonic(y, margin=1.0), atol=1e-5)
+
+
+def test_noise_profile_save_is_atomic_and_corrupt_file_is_recomputed(tmp_path):
+    path = tmp_path / "room.npz"
+    noise = 0.01 * np.random.default_rng(3).standard_normal(SR)
+    profile = NoiseProfile.from_signal(noise, SR)
+    profile.save(path)
+    assert [p.name for p in tmp_path.iterdir()] == ["room.npz"]
+    assert NoiseProfile.load(path).digest() == profile.digest()
+
+    # Обрезанный файл не должен оставлять конвертацию без профиля
+    path.write_bytes(path.read_bytes()[:100])
+    engine = VocalToMIDIEngine(ConversionParams(noise_profile=str(path)))
+    assert engine.noise_profile_for(noise, SR).digest() == profile.digest()
+    assert NoiseProfile.load(path).digest() == profile.digest()
@@ -0,0 +1,72 @@
+"""VAD: доля сигнала, которая идет в детекторы, и совпадение с полным прогоном"""
+import os
+import sys
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from engine import ConversionParams, VocalToMIDIEngine  # noqa: E402
+from vad import activity_threshold  # noqa: E402
+
+
+SR = 22050
+HOP_SECONDS = 512 / SR
+
+
+def tone(seconds, freq, amplitude=0.8):
+    t = np.arange(int(seconds * SR)) / SR
+    return amplitude * (np.sin(2 * np.pi * freq * t) + 0.3 * np.sin(4 * np.pi * freq * t)) / 1.3
+
+
+def noise(seconds, rms, rng):
+    return rms * rng.standard_normal(int(seconds * SR))
+
+
+def pyin_engine(**params):
+    return VocalToMIDIEngine(ConversionParams(method="pyin", use_noise_reduction=False,
+                                              use_harmonic_percussive=False, parallel_detectors=False, **params))
+
+
+def test_threshold_follows_noise_floor_below_volume_gate():
+    rng = np.random.default_rng(0)
+    quiet = np.abs(rng.normal(0.002, 0.0002, 1000))
+    assert activity_threshold(quiet, 0.02) == pytest.approx(4 * np.percentile(quiet, 10))
+    # Фон выше порога громкости: тише порога громкости кадры все равно обнуляются
+    assert activity_threshold(quiet * 100, 0.02) == 0.02
+    # Цифровая тишина
+    assert activity_threshold(np.zeros(100), 0.02, 0.005) == 0.005
+
+
+def test_half_silent_file_sends_half_to_detector(monkeypatch):
+    rng = np.random.default_rng(1)
+    # Фон 0.01 - выше прежнего постоянного порога 0.005, но ниже порога громкости
+    y = np.concatenate([tone(8, 220), noise(8, 0.01, rng), tone(8, 330), noise(8, 0.01, rng)]).astype(np.float32)
+    engine = pyin_engine()
+    sent = []
+
+    def counting_track(segment, sr):
+        sent.append(len(segment))
+        n_frames = 1 + len(segment) // 512
+        return np.zeros(n_frames), np.arange(n_frames) * HOP_SECONDS, np.zeros(n_frames)
+
+    monkeypatch.setattr(engine, "pyin_track", counting_track)
+    engine.analyse(y, SR)
+    assert sum(sent) / len(y) == pytest.approx(0.5, abs=0.06)
+
+
+def test_gated_pyin_matches_full_run():
+    rng = np.random.default_rng(2)
+    parts = [noise(0.7, 0.003, rng)]
+    for freq in (196.0, 220.0, 246.9, 261.6, 293.7):
+        parts += [tone(0.6, freq), noise(0.9, 0.003, rng)]
+    y = np.concatenate(parts).astype(np.float32)
+
+    full = pyin_engine(vad_gating=False).transcribe(y, SR)
+    gated = pyin_engine(vad_gating=True).transcribe(y, SR)
+    # HMM PYIN проходит участки по отдельности: допускаем сдвиг границы на кадр
+    assert len(gated) == len(full) == 5
+    assert list(gated["pitch"]) == list(full["pitch"])
+    assert np.abs(gated["onset"] - full["onset"]).max() <= HOP_SECONDS + 1e-9
+    assert np.abs(gated["offset"] - full["offset"]).max() <= HOP_SECONDS + 1e-9
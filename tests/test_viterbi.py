@@ -0,0 +1,109 @@
+"""Витерби по активациям CREPE против to_viterbi_cents из crepe"""
+import os
+import sys
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import viterbi  # noqa: E402
+from viterbi import CONTEXT_FRAMES, viterbi_cents  # noqa: E402
+
+
+def reference_viterbi_cents(salience):
+    """crepe.core.to_viterbi_cents на NumPy (в crepe путь ищет hmmlearn): (центы, путь).
+
+    Равномерное начальное распределение, переходы max(12 - |i - j|, 0),
+    нормированные по строке, вероятность узнать свой бин 0.1, наблюдение -
+    бин максимума; центы - среднее по активации в окне +-4 бина вокруг пути.
+    """
+    n_bins = salience.shape[1]
+    cents_mapping = np.linspace(0, 7180, 360) + 1997.3794084376191
+    xx, yy = np.meshgrid(range(n_bins), range(n_bins))
+    transition = np.maximum(12 - abs(xx - yy), 0)
+    transition = transition / np.sum(transition, axis=1)[:, None]
+    self_emission = 0.1
+    emission = np.eye(n_bins) * self_emission + np.ones((n_bins, n_bins)) * ((1 - self_emission) / n_bins)
+    observations = np.argmax(salience, axis=1)
+
+    with np.errstate(divide="ignore"):
+        log_transition, log_emission = np.log(transition), np.log(emission)
+    score = np.log(np.ones(n_bins) / n_bins) + log_emission[:, observations[0]]
+    back = np.zeros((len(observations), n_bins), dtype=int)
+    for t in range(1, len(observations)):
+        candidates = score[:, None] + log_transition
+        back[t] = np.argmax(candidates, axis=0)
+        score = candidates[back[t], np.arange(n_bins)] + log_emission[:, observations[t]]
+    path = np.zeros(len(observations), dtype=int)
+    path[-1] = np.argmax(score)
+    for t in range(len(observations) - 1, 0, -1):
+        path[t - 1] = back[t, path[t]]
+
+    cents = []
+    for frame, center in zip(salience, path):
+        start, end = max(0, center - 4), min(n_bins, center + 5)
+        cents.append(np.sum(frame[start:end] * cents_mapping[start:end]) / np.sum(frame[start:end]))
+    return np.array(cents), path
+
+
+def path_log_likelihood(salience, path, self_emission=0.1, transition_bins=12):
+    """Логарифм вероятности пути в модели crepe (без постоянного начального члена)"""
+    n_bins = salience.shape[1]
+    hits = path == np.argmax(salience, axis=1)
+    emission = np.where(hits, np.log(self_emission + (1 - self_emission) / n_bins),
+                        np.log((1 - self_emission) / n_bins))
+    bins = np.arange(n_bins)
+    row_sums = np.maximum(transition_bins - np.abs(bins[:, None] - bins[None, :]), 0).sum(axis=1)
+    weights = np.maximum(transition_bins - np.abs(np.diff(path)), 0) / row_sums[path[:-1]]
+    with np.errstate(divide="ignore"):
+        return emission.sum() + np.log(weights).sum()
+
+
+def melody_activation(n_frames, seed=0, octave_share=0.45):
+    """Активации как у CREPE: гауссов пик на бине мелодии, паузы - шум.
+
+    В доле кадров octave_share сильнее пик октавой выше: такие кадры идут
+    вперемешку с верными, и выбор между октавами зависит от далеких кадров.
+    """
+    rng = np.random.default_rng(seed)
+    bins = np.arange(360)
+    centers = np.repeat(rng.uniform(120, 250, n_frames // 40 + 1), 40)[:n_frames]
+    centers += rng.normal(0, 0.7, n_frames)
+    melody = np.exp(-0.5 * ((bins[None, :] - centers[:, None]) / 1.5) ** 2)
+    octave = np.exp(-0.5 * ((bins[None, :] - centers[:, None] - 60) / 1.5) ** 2)
+    flipped = rng.random(n_frames) < octave_share
+    activation = np.where(flipped[:, None], 0.9 * melody + octave, melody + 0.1 * octave)
+    activation += 0.05 * rng.random((n_frames, 360))
+    pause = (np.arange(n_frames) // 40) % 5 == 4
+    activation[pause] = 0.3 * rng.random((pause.sum(), 360))
+    return activation.astype(np.float32)
+
+
+def test_full_band_matches_crepe_reference():
+    activation = melody_activation(300)
+    expected, _ = reference_viterbi_cents(activation.astype(np.float64))
+    np.testing.assert_allclose(viterbi_cents(activation, context_frames=0), expected, atol=1e-6)
+    # С контекстом края блока дополняются повтором крайнего кадра
+    np.testing.assert_allclose(viterbi_cents(activation), expected, atol=1e-6)
+
+
+def test_block_seams_do_not_change_the_path(monkeypatch):
+    # Блоки по 150 кадров с контекстом против пути по всему сигналу сразу
+    activation = melody_activation(1500, seed=1)
+    expected_cents, expected_path = reference_viterbi_cents(activation.astype(np.float64))
+
+    paths = []
+    average = viterbi.local_average_cents
+    monkeypatch.setattr(viterbi, "local_average_cents", lambda act, path: paths.append(path) or average(act, path))
+    cents = viterbi_cents(activation, block_frames=150, context_frames=CONTEXT_FRAMES)
+    path, = paths
+
+    # С коротким контекстом (10-20 кадров) на этих активациях стыки блоков
+    # дают недопустимые переходы. Веса переходов и вероятности наблюдений принимают немного значений,
+    # поэтому оптимальных путей бывает несколько и argmax на равенстве
+    # выбирает любой. Блоки не должны давать путь хуже глобального
+    np.testing.assert_allclose(path_log_likelihood(activation, path),
+                               path_log_likelihood(activation, expected_path), rtol=1e-12)
+    same = path == expected_path
+    assert np.mean(same) > 0.99
+    np.testing.assert_allclose(cents[same], expected_cents[same], atol=1e-6)
@@ -0,0 +1,68 @@
+"""Векторный YIN: частота синтетических тонов, тишина и шум, стыки блоков"""
+import os
+import sys
+
+import librosa
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import yin  # noqa: E402
+from yin import yin_track  # noqa: E402
+
+
+SR = 22050
+# Диапазон нот по умолчанию с тем же запасом, что в engine.detect_pitch_yin
+FMIN, FMAX = librosa.note_to_hz("C3") * 0.9, librosa.note_to_hz("C6") * 1.1
+
+
+def tone(freq, seconds=0.5, harmonics=(1.0, 0.5, 0.25)):
+    t = np.arange(int(seconds * SR)) / SR
+    y = sum(amp * np.sin(2 * np.pi * freq * (k + 1) * t) for k, amp in enumerate(harmonics))
+    return (0.5 * y / np.max(np.abs(y))).astype(np.float32)
+
+
+def cents(frequency, reference):
+    return 1200 * np.log2(frequency / reference)
+
+
+@pytest.mark.parametrize("note", ["C3", "G3", "E4", "A4", "C5", "F#5", "C6"])
+def test_tone_frequency_within_a_few_cents(note):
+    freq = librosa.note_to_hz(note)
+    frequency, confidence = yin_track(tone(freq), SR, FMIN, FMAX)
+    # Кадры, целиком лежащие внутри тона (без краев с нулевым дополнением)
+    inner = slice(3, len(frequency) - 3)
+    assert np.all(frequency[inner] > 0)
+    assert np.max(np.abs(cents(frequency[inner], freq))) < 5
+    assert np.min(confidence[inner]) > 0.9
+
+
+def test_silence_and_noise_are_unvoiced():
+    silence = np.zeros(SR, dtype=np.float32)
+    frequency, confidence = yin_track(silence, SR, FMIN, FMAX)
+    assert np.all(frequency == 0)
+
+    noise = 0.3 * np.random.default_rng(0).standard_normal(SR).astype(np.float32)
+    frequency, _ = yin_track(noise, SR, FMIN, FMAX)
+    assert np.mean(frequency == 0) > 0.9
+
+
+def test_pause_between_tones_is_unvoiced():
+    y = np.concatenate([tone(220.0), np.zeros(SR // 2, dtype=np.float32), tone(330.0)])
+    frequency, _ = yin_track(y, SR, FMIN, FMAX)
+    times = librosa.frames_to_time(np.arange(len(frequency)), sr=SR, hop_length=yin.HOP_LENGTH)
+    # Пауза 0.5-1.0 с; кадры окна 2048 задевают тоны на 1024 отсчета с каждой стороны
+    pause = (times > 0.5 + 0.05) & (times < 1.0 - 0.05)
+    assert np.all(frequency[pause] == 0)
+    assert np.median(np.abs(cents(frequency[times < 0.45], 220.0))) < 5
+    assert np.median(np.abs(cents(frequency[(times > 1.05) & (times < 1.45)], 330.0))) < 5
+
+
+def test_blocks_do_not_change_the_track(monkeypatch):
+    y = np.concatenate([tone(196.0, 1.0), tone(523.3, 1.0)])
+    whole = yin_track(y, SR, FMIN, FMAX)
+    monkeypatch.setattr(yin, "BLOCK_FRAMES", 7)
+    blocked = yin_track(y, SR, FMIN, FMAX)
+    np.testing.assert_allclose(blocked[0], whole[0], rtol=1e-6)
+    np.testing.assert_allclose(blocked[1], whole[1], rtol=1e-6, atol=1e-9)
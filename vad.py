@@ -0,0 +1,89 @@
+"""Грубое определение активных участков по энергии сигнала.
+
+Детекторы высоты тона запускаются только на участках, где RMS превышает
+порог (с запасом по краям), а их результаты раскладываются обратно на
+полную временную сетку. Порог берется от шумового фона файла и не выше
+порога громкости: тихие кадры все равно обнуляются фильтром громкости в
+``advanced_note_processing``, поэтому время детекторов зависит от
+длительности пения, а не от длины файла.
+
+Запас по краям покрывает медианный и гауссов фильтры трека высоты, так
+что кадры внутри участков получают те же значения, что и при полном
+прогоне. Сглаживающие HMM (Витерби CREPE, PYIN) начинают каждый участок
+заново, поэтому совпадение приближенное: изредка граница ноты сдвигается
+на кадр.
+"""
+import numpy as np
+
+from segmentation import run_lengths
+
+
+# Шумовой фон - этот перцентиль RMS по файлу (паузы, дыхание, фон помещения)
+NOISE_FLOOR_PERCENTILE = 10
+# Во сколько раз участок должен быть громче фона, чтобы считаться активным
+NOISE_FLOOR_MARGIN = 4.0
+
+
+def activity_threshold(rms, volume_threshold, min_threshold=0.0):
+    """Порог активности по шумовому фону самого файла.
+
+    Порог выше фона в NOISE_FLOOR_MARGIN раз (но не ниже min_threshold -
+    для записей с цифровой тишиной). Выше volume_threshold он не
+    поднимается: кадры тише него все равно обнуляет фильтр громкости, а
+    более громкие должны дойти до детектора. Порог зависит от файла, а не
+    от ползунка громкости, пока тот выше фона, поэтому смена громкости не
+    сбрасывает кэш детекторов.
+    """
+    rms = np.asarray(rms)
+    floor = float(np.percentile(rms, NOISE_FLOOR_PERCENTILE)) if len(rms) else 0.0
+    return min(volume_threshold, max(min_threshold, NOISE_FLOOR_MARGIN * floor))
+
+
+def active_spans(rms, threshold, sr, n_samples, hop_length=512, frame_length=2048,
+                 pad_seconds=0.3, min_gap_seconds=0.1):
+    """Участки сигнала [start, stop) в отсчетах, где rms > threshold.
+
+    Участки расширяются на pad_seconds в обе стороны (контекст для
+    сглаживающих фильтров и HMM детекторов), а паузы короче
+    min_gap_seconds заполняются, чтобы не дробить сигнал на мелкие вызовы.
+    """
+    active = np.asarray(rms) > threshold
+    if not active.any():
+        return []
+    from scipy.ndimage import binary_closing, binary_dilation
+
+    # Кадр рядом с громким тоже может пройти порог после интерполяции
+    pad_frames = 1 + int(np.ceil(pad_seconds * sr / hop_length))
+    active = binary_dilation(active, iterations=pad_frames)
+
+    gap_frames = int(min_gap_seconds * sr / hop_length)
+    if gap_frames > 0:
+        # Закрытие не трогает края массива, поэтому дополняем их нулями
+        active = binary_closing(np.pad(active, gap_frames), iterations=gap_frames)[gap_frames:-gap_frames]
+
+    starts, lengths, values = run_lengths(active)
+    spans = []
+    for start, length in zip(starts[values], lengths[values]):
+        sample_start = max(0, int(start) * hop_length - frame_length // 2)
+        sample_stop = min(n_samples, (int(start) + int(length) - 1) * hop_length + frame_length // 2)
+        if sample_stop > sample_start:
+            spans.append((sample_start, sample_stop))
+    return spans
+
+
+def spans_to_frames(spans, sr, frame_period, n_frames):
+    """Перевод участков в отсчетах в диапазоны кадров детектора [first, last)"""
+    ranges = []
+    for start, stop in spans:
+        first = max(0, int(np.floor(start / sr / frame_period)))
+        last = min(n_frames, int(np.ceil(stop / sr / frame_period)) + 1)
+        if last > first:
+            ranges.append((first, last))
+    return ranges
+
+
+def voiced_fraction(spans, n_samples):
+    """Доля сигнала, попавшая в активные участки"""
+    if n_samples == 0:
+        return 0.0
+    return sum(stop - start for start, stop in spans) / n_samples
@@ -0,0 +1,164 @@
+"""Декодирование Витерби по матрице активаций CREPE на NumPy.
+
+Та же модель, что у ``crepe.core.to_viterbi_cents``: скрытое состояние -
+бин высоты (20 центов), переход возможен не дальше чем на
+``transition_bins`` бинов с треугольными весами, наблюдение - бин максимума
+активации с вероятностью ``self_emission`` "узнать" свое состояние. Но
+состояния ограничены полосой бинов диапазона нот, и переходы считаются
+ленточно: работа пропорциональна кадрам x ширине полосы x ширине перехода,
+а не кадрам x 360 x 360. Сигнал декодируется блоками с перекрытием
+(как окна CREPE), а все блоки идут одновременно - шаг Витерби по времени
+делается векторно сразу для пачки блоков. Кадры за краями сигнала на путь
+не влияют, а контекста ``CONTEXT_FRAMES`` хватает, чтобы стыки блоков
+не меняли путь: совпадение с ``to_viterbi_cents`` во всей полосе проверяет
+``tests/test_viterbi.py``.
+
+Декодирование не требует нейросети, поэтому при смене диапазона нот,
+ширины переходов или порога уверенности трек пересчитывается за доли секунды.
+"""
+import numpy as np
+
+
+ACTIVATION_BINS = 360
+CENTS_PER_BIN = 20
+# Центы (относительно 10 Гц) центра нулевого бина, как в crepe.core
+FIRST_BIN_CENTS = 1997.3794084376191
+CENTS_MAPPING = FIRST_BIN_CENTS + CENTS_PER_BIN * np.arange(ACTIVATION_BINS)
+
+TRANSITION_BINS = 12
+SELF_EMISSION = 0.1
+# Полуширина окна усреднения вокруг бина пути (как в to_local_average_cents)
+AVERAGE_RADIUS = 4
+
+# Блок не длиннее BLOCK_FRAMES; короткий трек режется на блоки помельче
+# (шагов по времени столько, сколько кадров в блоке), но не мельче MIN_BLOCK_FRAMES
+BLOCK_FRAMES = 2000
+MIN_BLOCK_FRAMES = 400
+CONTEXT_FRAMES = 100
+# Сколько блоков декодируется за один векторный проход (ограничивает память)
+BLOCKS_PER_PASS = 32
+
+
+def hz_to_bin(frequency):
+    """Дробный номер бина CREPE для частоты в Гц"""
+    return (1200 * np.log2(np.asarray(frequency) / 10.0) - FIRST_BIN_CENTS) / CENTS_PER_BIN
+
+
+def band_for_range(fmin, fmax, margin_bins=AVERAGE_RADIUS):
+    """Полоса бинов [lo, hi) для частот fmin..fmax с запасом на усреднение"""
+    lo = max(0, int(np.floor(hz_to_bin(fmin))) - margin_bins)
+    hi = min(ACTIVATION_BINS, int(np.ceil(hz_to_bin(fmax))) + margin_bins + 1)
+    return lo, max(hi, lo + 1)
+
+
+def banded_transitions(n_states, transition_bins=TRANSITION_BINS):
+    """Ленточные переходы: (источники (n, k), логарифмы весов (n, k)) для каждого состояния.
+
+    Веса max(transition_bins - |i - j|, 0) нормируются по строке источника i
+    в пределах полосы, как строки матрицы переходов crepe.
+    """
+    offsets = np.arange(-(transition_bins - 1), transition_bins)
+    states = np.arange(n_states)
+    weights = np.maximum(transition_bins - np.abs(states[:, None] - states[None, :]), 0).astype(np.float64)
+    weights /= weights.sum(axis=1, keepdims=True)
+
+    sources = states[:, None] + offsets[None, :]
+    valid = (sources >= 0) & (sources < n_states)
+    sources = np.clip(sources, 0, n_states - 1)
+    with np.errstate(divide="ignore"):
+        log_weights = np.where(valid, np.log(weights[sources, states[:, None]]), -np.inf)
+    return sources, log_weights
+
+
+def viterbi_paths(observations, sources, log_weights, self_emission=SELF_EMISSION):
+    """Пути Витерби для пачки блоков. observations - (время, блоки) номера бинов полосы.
+
+    -1 - кадр за краем сигнала. Такие кадры на путь не влияют: после кадров
+    до начала сигнала путь начинается заново с равномерного распределения,
+    а после конца сигнала состояние не меняется.
+    """
+    n_steps, n_blocks = observations.shape
+    n_states = len(sources)
+    log_hit = np.log(self_emission + (1 - self_emission) / n_states)
+    log_miss = np.log((1 - self_emission) / n_states)
+    blocks = np.arange(n_blocks)
+    states = np.arange(n_states)
+    outside = observations < 0
+    before_start = np.cumsum(~outside, axis=0) == 0
+
+    def emission(t):
+        scores = np.full((n_blocks, n_states), log_miss)
+        observed = ~outside[t]
+        scores[blocks[observed], observations[t][observed]] = log_hit
+        return scores
+
+    start = -np.log(n_states)
+    score = emission(0) + start
+    back = np.empty((n_steps, n_blocks, n_states), dtype=np.int16)
+    for t in range(1, n_steps):
+        candidates = score[:, sources] + log_weights
+        best = np.argmax(candidates, axis=2)
+        back[t] = sources[states, best]
+        previous = score
+        score = np.take_along_axis(candidates, best[:, :, None], axis=2)[:, :, 0] + emission(t)
+        restart = before_start[t - 1]
+        score[restart] = emission(t)[restart] + start
+        stay = outside[t] & ~before_start[t]
+        score[stay] = previous[stay]
+        back[t][restart | stay] = states
+
+    path = np.empty((n_steps, n_blocks), dtype=np.intp)
+    path[-1] = np.argmax(score, axis=1)
+    for t in range(n_steps - 1, 0, -1):
+        path[t - 1] = back[t, blocks, path[t]]
+    return path
+
+
+def local_average_cents(activation, path):
+    """Центы кадров: среднее по активации в окне вокруг бина пути (векторно)"""
+    window = path[:, None] + np.arange(-AVERAGE_RADIUS, AVERAGE_RADIUS + 1)
+    inside = (window >= 0) & (window < ACTIVATION_BINS)
+    window = np.clip(window, 0, ACTIVATION_BINS - 1)
+    weights = np.where(inside, np.take_along_axis(activation, window, axis=1), 0).astype(np.float64)
+    total = weights.sum(axis=1)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        cents = (weights * CENTS_MAPPING[window]).sum(axis=1) / total
+    return np.where(total > 0, cents, CENTS_MAPPING[path])
+
+
+def viterbi_cents(activation, band=(0, ACTIVATION_BINS), transition_bins=TRANSITION_BINS, self_emission=SELF_EMISSION,
+                  block_frames=BLOCK_FRAMES, context_frames=CONTEXT_FRAMES, check=None):
+    """Центы (относительно 10 Гц) по кадрам активации (frames x 360).
+
+    band - полоса бинов [lo, hi), в которой ищется путь. Блоки (не длиннее
+    block_frames кадров) декодируются с перекрытием context_frames с каждой
+    стороны, в результат идет только середина блока. check - проверка
+    отмены между проходами.
+    """
+    n_frames = len(activation)
+    if n_frames == 0:
+        return np.zeros(0)
+    lo, hi = band
+    observations = np.argmax(activation[:, lo:hi], axis=1)
+    sources, log_weights = banded_transitions(hi - lo, transition_bins)
+
+    block_frames = int(np.clip(np.ceil(n_frames / BLOCKS_PER_PASS), MIN_BLOCK_FRAMES, block_frames))
+    starts = np.arange(0, n_frames, block_frames)
+    steps = np.arange(block_frames + 2 * context_frames) - context_frames
+    path = np.empty(n_frames, dtype=np.intp)
+
+    for first in range(0, len(starts), BLOCKS_PER_PASS):
+        if check is not None:
+            check()
+        pass_starts = starts[first:first + BLOCKS_PER_PASS]
+        # Кадры блока с контекстом; за краями сигнала наблюдений нет (-1), чтобы
+        # путь у краев был тем же, что при декодировании всего сигнала сразу
+        frames = pass_starts[None, :] + steps[:, None]
+        outside = (frames < 0) | (frames >= n_frames)
+        block_observations = np.where(outside, -1, observations[np.clip(frames, 0, n_frames - 1)])
+        block_path = viterbi_paths(block_observations, sources, log_weights, self_emission)
+        for index, start in enumerate(pass_starts.tolist()):
+            stop = min(n_frames, start + block_frames)
+            path[start:stop] = block_path[context_frames:context_frames + stop - start, index]
+
+    return local_average_cents(activation, path + lo)
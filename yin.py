@@ -0,0 +1,105 @@
+"""Быстрый черновой детектор высоты тона: YIN по всем кадрам сразу.
+
+Разностная функция YIN
+
+    d(tau) = sum_j (x[j] - x[j + tau]) ** 2 = E(0) + E(tau) - 2 r(tau)
+
+считается не циклом по кадрам и задержкам, а для блока кадров целиком:
+взаимная корреляция r(tau) - через БПФ (NumPy), энергии окон E - через
+накопленные суммы квадратов. Дальше - нормировка накопленным средним,
+первый провал ниже порога и параболическое уточнение периода. Сетка
+кадров та же, что у PYIN (frame_length 2048, hop 512, center=True), поэтому
+трек подключается к обработке нот без интерполяции.
+"""
+import numpy as np
+from numpy.lib.stride_tricks import as_strided
+
+
+FRAME_LENGTH = 2048
+HOP_LENGTH = 512
+# Провал нормированной разности ниже этого порога - период найден
+TROUGH_THRESHOLD = 0.1
+# Кадр с минимумом выше этого порога считается невокализованным
+VOICING_THRESHOLD = 0.5
+# Кадров в одном блоке БПФ: ограничивает память на длинных файлах
+BLOCK_FRAMES = 2048
+
+
+def padded_frames(y, frame_length, hop_length):
+    """Кадры с центрированием (как librosa с center=True), без копирования"""
+    y = np.pad(np.asarray(y, dtype=np.float32), frame_length // 2)
+    n_frames = 1 + (len(y) - frame_length) // hop_length
+    stride = y.strides[0]
+    return as_strided(y, shape=(n_frames, frame_length), strides=(hop_length * stride, stride), writeable=False)
+
+
+def cumulative_mean_normalized_difference(frames, min_period, max_period):
+    """Нормированная разность YIN для задержек 0..max_period+1 (кадры по строкам)"""
+    frame_length = frames.shape[1]
+    max_lag = max_period + 1
+    window = frame_length - max_lag
+
+    n_fft = 1 << int(np.ceil(np.log2(frame_length)))
+    spectrum = np.fft.rfft(frames, n_fft, axis=1)
+    head = np.fft.rfft(frames[:, :window], n_fft, axis=1)
+    correlation = np.fft.irfft(np.conj(head) * spectrum, n_fft, axis=1)[:, :max_lag + 1]
+
+    squares = np.cumsum(np.square(frames, dtype=np.float64), axis=1)
+    squares = np.concatenate((np.zeros((len(frames), 1)), squares), axis=1)
+    lags = np.arange(max_lag + 1)
+    energy = squares[:, lags + window] - squares[:, lags]
+
+    difference = np.maximum(energy[:, :1] + energy - 2 * correlation, 0)
+    difference[:, 0] = 0
+
+    # d'(tau) = d(tau) * tau / sum_{1..tau} d; d'(0) = 1
+    running = np.cumsum(difference[:, 1:], axis=1)
+    normalized = np.ones_like(difference)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        normalized[:, 1:] = np.where(running > 0, difference[:, 1:] * lags[1:] / running, 1.0)
+    return normalized
+
+
+def pick_periods(normalized, min_period, max_period, threshold=TROUGH_THRESHOLD):
+    """(период с дробной частью, значение провала) для каждого кадра"""
+    rows = np.arange(len(normalized))
+    search = normalized[:, min_period:max_period + 1]
+
+    # Первый локальный минимум ниже порога; если его нет - глобальный минимум
+    left = normalized[:, min_period - 1:max_period]
+    right = normalized[:, min_period + 1:max_period + 2]
+    trough = (search < threshold) & (search <= left) & (search <= right)
+    has_trough = trough.any(axis=1)
+    best = np.where(has_trough, np.argmax(trough, axis=1), np.argmin(search, axis=1)) + min_period
+
+    # Параболическое уточнение по соседним задержкам
+    a = normalized[rows, best - 1]
+    b = normalized[rows, best]
+    c = normalized[rows, best + 1]
+    curvature = a - 2 * b + c
+    with np.errstate(divide="ignore", invalid="ignore"):
+        shift = np.where(curvature > 0, 0.5 * (a - c) / curvature, 0.0)
+    return best + np.clip(shift, -0.5, 0.5), b
+
+
+def yin_track(y, sr, fmin, fmax, frame_length=FRAME_LENGTH, hop_length=HOP_LENGTH, check=None):
+    """Трек YIN: (частота в Гц, 0 - нет тона; уверенность 0..1) на сетке PYIN.
+
+    check - проверка отмены между блоками кадров.
+    """
+    min_period = max(1, int(np.floor(sr / fmax)))
+    max_period = min(frame_length // 2, int(np.ceil(sr / fmin)))
+    frames = padded_frames(y, frame_length, hop_length)
+
+    frequency = np.zeros(len(frames))
+    confidence = np.zeros(len(frames))
+    for start in range(0, len(frames), BLOCK_FRAMES):
+        if check is not None:
+            check()
+        block = slice(start, start + BLOCK_FRAMES)
+        normalized = cumulative_mean_normalized_difference(frames[block], min_period, max_period)
+        period, trough = pick_periods(normalized, min_period, max_period)
+        voiced = trough < VOICING_THRESHOLD
+        frequency[block] = np.where(voiced, sr / period, 0.0)
+        confidence[block] = np.clip(1.0 - trough, 0.0, 1.0)
+    return frequency, confidence